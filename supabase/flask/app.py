@@ -1,18 +1,25 @@
 
-from flask import Flask, jsonify, request
-from supabase import create_client, Client as SupabaseClient
-import threading
 import time
-import cohere
+_APP_IMPORT_STARTED_AT = time.perf_counter()
+
+from flask import Flask, Blueprint, Response, g, jsonify, request
+import threading
+import importlib
+import sys
 import os
-from twilio.rest import Client as TwilioClient
-from twilio.twiml.messaging_response import MessagingResponse
 from dotenv import load_dotenv
-from youtube_transcript_api import YouTubeTranscriptApi
 import re
 import json
+import queue
+from concurrent.futures import Future
+from html.parser import HTMLParser
 import logging
+import logging.handlers
+import contextvars
+import atexit
+import uuid
 from datetime import datetime
+from collections import OrderedDict
 
 # Load environment variables from .env file
 load_dotenv()
@@ -21,15 +28,158 @@ load_dotenv()
 # LOGGING CONFIGURATION - Set to False for minimal logging
 # =============================================================== #
 VERBOSE_LOGGING = False  # Set to False to reduce logging output for analyze_users and process_summaries
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG' if VERBOSE_LOGGING else 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()  # 'text' or 'json'
+
+logger = logging.getLogger('twin')
+
+# Correlation ids (message_sid, user_id, run_id) attached to every record logged in this context
+_log_context = contextvars.ContextVar('twin_log_context', default={})
+
+def bind_log_context(**ids):
+    """Add correlation ids to the current request/thread/task context"""
+    _log_context.set({**_log_context.get(), **{k: v for k, v in ids.items() if v}})
+
+def reset_log_context():
+    """Drop all correlation ids (start of a request on a reused worker thread)"""
+    _log_context.set({})
+
+class CorrelationFilter(logging.Filter):
+    """Copies the bound correlation ids onto each record (runs on the logging thread's caller)"""
+    
+    def filter(self, record):
+        record.correlation = _log_context.get()
+        return True
+
+class TextLogFormatter(logging.Formatter):
+    def format(self, record):
+        ids = getattr(record, 'correlation', None) or {}
+        prefix = ' '.join(f"{k}={v}" for k, v in ids.items())
+        line = f"{self.formatTime(record, '%H:%M:%S')} {record.levelname:<7} {f'[{prefix}] ' if prefix else ''}{record.getMessage()}"
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+            **(getattr(record, 'correlation', None) or {})
+        }
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+_log_listener = None
+
+def configure_logging():
+    """
+    Route the 'twin' logger through a queue so callers never block on stdout
+    
+    The QueueHandler formats on the calling thread only for records that pass the
+    level check; a QueueListener thread does the actual writes. Called at import
+    and again in forked children (the listener thread doesn't survive fork).
+    """
+    global _log_listener
+    if _log_listener is not None:
+        try:
+            _log_listener.stop()
+        except Exception:
+            pass
+    
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else TextLogFormatter())
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationFilter())
+    
+    logger.handlers = [queue_handler]
+    logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    logger.propagate = False
+    
+    _log_listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _log_listener.start()
+
+def flush_logs():
+    """Drain queued records (used before exit by scripts)"""
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener.start()
+
+def _stop_log_listener():
+    if _log_listener is not None:
+        _log_listener.stop()
 
-def log_verbose(message: str):
-    """Print message only if verbose logging is enabled"""
-    if VERBOSE_LOGGING:
-        print(message)
+def is_verbose_logging() -> bool:
+    """True when debug records are emitted; guard expensive debug-only loops with it"""
+    return logger.isEnabledFor(logging.DEBUG)
 
-def log_always(message: str):
-    """Always print important messages regardless of verbose setting"""
-    print(message)
+def log_verbose(message: str, *args):
+    """Debug-level record; %-style args are only formatted if debug logging is on"""
+    logger.debug(message, *args)
+
+def log_always(message: str, *args):
+    """Info-level record for the normal operational trail"""
+    logger.info(message, *args)
+
+def log_warning(message: str, *args):
+    logger.warning(message, *args)
+
+def log_error(message: str, *args):
+    logger.error(message, *args)
+
+configure_logging()
+os.register_at_fork(after_in_child=configure_logging)
+atexit.register(_stop_log_listener)
+
+# =============================================================== #
+# Deferred Imports
+# =============================================================== #
+
+# SDKs that are only imported on first use (cohere, twilio, supabase, ... take most of the cold start)
+DEFERRED_MODULES = [
+    'supabase',
+    'cohere',
+    'twilio.rest',
+    'twilio.twiml.messaging_response',
+    'youtube_transcript_api',
+    'requests',
+]
+
+_deferred_import_timings = {}  # module name -> seconds spent on its first import
+_deferred_import_lock = threading.Lock()
+
+def deferred_import(module_name: str):
+    """
+    Import a heavy dependency the first time it is needed and time the import
+    
+    Args:
+        module_name (str): Dotted module name, e.g. 'twilio.rest'
+        
+    Returns:
+        module: The imported module
+    """
+    with _deferred_import_lock:
+        if module_name not in _deferred_import_timings:
+            started_at = time.perf_counter()
+            importlib.import_module(module_name)
+            _deferred_import_timings[module_name] = round(time.perf_counter() - started_at, 4)
+    return sys.modules[module_name]
+
+def get_startup_report() -> dict:
+    """Return app.py's own import time and the deferred imports paid for so far"""
+    with _deferred_import_lock:
+        loaded = dict(_deferred_import_timings)
+    return {
+        'app_import_seconds': APP_IMPORT_SECONDS,
+        'deferred_imports_loaded': loaded,
+        'deferred_imports_seconds': round(sum(loaded.values()), 4),
+        'deferred_imports_pending': [m for m in DEFERRED_MODULES if m not in loaded]
+    }
 
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
@@ -38,16 +188,740 @@ COHERE_API_KEY = os.getenv('COHERE_API_KEY')
 SUPABASE_URL = os.getenv('SUPABASE_URL')  # Note: using actual env var name from .env (missing 'S')
 SUPABASE_PUBLISHABLE_KEY = os.getenv('SUPABASE_PUBLISHABLE_KEY')
 
+# =============================================================== #
+# PIPELINE CONFIGURATION
+# =============================================================== #
+SUMMARY_USER_PAGE_SIZE = 50  # Users per batched summaries query in process_user_summaries
+SUMMARY_BATCH_COLUMNS = 'id, user_id, summary, prompt_generated_at, processed'  # Narrow projection for batch reads
+SUMMARY_FETCH_PAGE_ROWS = int(os.getenv('SUMMARY_FETCH_PAGE_ROWS', '1000'))  # Rows per .range() page; keep <= PostgREST max-rows
+SUMMARY_PROCESSED_REFRESH_CHUNK = 200  # Cached summary ids per processed-flag re-read in the watermark fetch
+MESSAGE_HISTORY_HARVEST_HOURS = 72  # Conversation window swept once per process_user_summaries cycle
+SUMMARY_NOVELTY_THRESHOLD = 0.2  # Below this share of unseen shingles, new summaries are marked processed without Cohere
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000'))  # Conversation + summaries tokens packed into reply prompts
+CONTEXT_RECENT_TURNS = 4  # Newest turns packed before any summaries
+CONTEXT_TURN_MAX_TOKENS = 150  # Per-turn cap
+CONTEXT_SUMMARY_MAX_TOKENS = 800  # Per-summary cap
+CONTEXT_MIN_SUMMARY_TOKENS = 100  # Don't pack a summary into less than this
+COHERE_CACHE_ENABLED = os.getenv('COHERE_CACHE_ENABLED', 'false').lower() == 'true'  # Replay identical co.chat requests from memory
+COHERE_CACHE_TTL_SECONDS = int(os.getenv('COHERE_CACHE_TTL_SECONDS', '900'))
+COHERE_CACHE_MAX_ENTRIES = int(os.getenv('COHERE_CACHE_MAX_ENTRIES', '256'))
+SCRAPE_MAX_BYTES = int(os.getenv('SCRAPE_MAX_BYTES', '1000000'))  # Page bodies are cut off here while streaming
+SCRAPE_MAX_TEXT_CHARS = int(os.getenv('SCRAPE_MAX_TEXT_CHARS', '12000'))  # Extracted text handed to the agent
+SCRAPE_TIMEOUT_SECONDS = 10
+RESOURCE_CACHE_TTL_SECONDS = int(os.getenv('RESOURCE_CACHE_TTL_SECONDS', '21600'))  # Transcripts and page text stay warm for 6 hours
+RESOURCE_CACHE_MAX_ENTRIES = int(os.getenv('RESOURCE_CACHE_MAX_ENTRIES', '500'))
+RESOURCE_PREFETCH_ENABLED = os.getenv('RESOURCE_PREFETCH_ENABLED', 'true').lower() == 'true'  # Warm the cache from learning-graph URLs
+RESOURCE_PREFETCH_WORKERS = 2
+RESOURCE_PREFETCH_MAX_PER_RUN = 8  # URLs prefetched per analyzed user
+RESOURCE_INFLIGHT_WAIT_SECONDS = 30  # How long a tool call waits on a fetch already in flight
+SPECULATIVE_PREFETCH_MAX_URLS = 3  # Links in one inbound text fetched before the agent runs
+INSTANT_ACK_ENABLED = os.getenv('INSTANT_ACK_ENABLED', 'true').lower() == 'true'  # Server texts the acknowledgement, not the agent
+# Conditions that end the agent loop after a tool batch, without an extra co.chat ('done_tool', 'sms_only_batch')
+AGENT_TERMINAL_CONDITIONS = {c.strip() for c in os.getenv('AGENT_TERMINAL_CONDITIONS', 'done_tool,sms_only_batch').split(',') if c.strip()}
+PIPELINE_ENGINE = os.getenv('PIPELINE_ENGINE', 'threads').lower()  # 'threads' or 'async' (see async_engine.py)
+PIPELINE_STAGGER_SECONDS = float(os.getenv('PIPELINE_STAGGER_SECONDS', '0.5'))  # Pause between starting per-user threads
+SYSTEM_PROMPT_DUMP_PATH = os.getenv('SYSTEM_PROMPT_DUMP_PATH', 'system_prompt.txt' if VERBOSE_LOGGING else '')  # Debug copy of the last reply prompt ('' = off)
+WEBHOOK_CAPTURE_PATH = os.getenv('WEBHOOK_CAPTURE_PATH', '')  # Opt-in: append inbound /sms payloads here for replay_webhooks.py
+AGENT_MODEL = 'command-a-03-2025'  # Tool-using agent (inbound replies and proactive texts)
+LEARNING_GRAPH_MODEL = 'command-r-plus'  # Learning-graph summaries in analyze_all_users
+USAGE_LEDGER_TABLE = 'usage_ledger'  # Supabase table of per-user, per-UTC-day usage deltas
+USAGE_DAILY_TOKEN_CAP = int(os.getenv('USAGE_DAILY_TOKEN_CAP', '0'))  # Cohere input+output tokens per user per day (0 = no cap)
+USAGE_DAILY_SMS_SEGMENT_CAP = int(os.getenv('USAGE_DAILY_SMS_SEGMENT_CAP', '0'))  # Twilio segments per user per day (0 = no cap)
+USAGE_DEGRADE_AT = float(os.getenv('USAGE_DEGRADE_AT', '0.8'))  # Share of a cap where a user drops to the reduced tier
+USAGE_REDUCED_MODEL = os.getenv('USAGE_REDUCED_MODEL', 'command-r7b-12-2024')  # Cheaper model for reduced/exhausted users
+USAGE_LEDGER_REFRESH_SECONDS = 60  # Stored totals are re-read after this (other workers write to the ledger too)
+USAGE_LEDGER_FLUSH_SECONDS = 30  # Pending deltas are written at most this long after they were recorded
+USER_RECORD_CACHE_TTL_SECONDS = int(os.getenv('USER_RECORD_CACHE_TTL_SECONDS', '300'))  # Onboarded users' rows reused by /sms lookups
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))  # Consecutive failures that open a dependency's circuit
+CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', '30'))  # Open circuits let one probe call through after this
+CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv('CIRCUIT_SLOW_CALL_SECONDS', '30'))  # Calls slower than this count as failures (0 = off)
+CIRCUIT_FALLBACK_SMS = os.getenv('CIRCUIT_FALLBACK_SMS', "my brain's a little overloaded rn 😵 give me a few min and text me again!")  # TwiML reply while Cohere or Supabase is down
+
+
+# =============================================================== #
+# Metrics
+# =============================================================== #
+
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+METRIC_HELP = {
+    'twin_external_call_duration_seconds': ('histogram', 'Latency of calls to Cohere, Twilio, Supabase and agent tools'),
+    'twin_external_call_errors_total': ('counter', 'External calls that raised'),
+    'twin_http_request_duration_seconds': ('histogram', 'Flask request latency by endpoint'),
+    'twin_cohere_tokens_total': ('counter', 'Cohere tokens billed, by model and direction'),
+    'twin_pipeline_users': ('gauge', 'Users in the last pipeline cycle, by outcome'),
+    'twin_pipeline_sms_sent': ('gauge', 'SMS sent by the last pipeline cycle'),
+    'twin_pipeline_cycles_total': ('counter', 'Completed pipeline cycles'),
+    'twin_usage_degraded_total': ('counter', 'Pipeline steps run on a reduced budget, by tier and pipeline'),
+    'twin_circuit_state': ('gauge', 'Dependency circuit state (0 closed, 1 half-open, 2 open)'),
+    'twin_circuit_opened_total': ('counter', 'Times a dependency circuit opened'),
+    'twin_circuit_rejected_total': ('counter', 'Calls short-circuited by an open dependency circuit'),
+    'twin_circuit_deferred_total': ('counter', 'Pipeline users and inbound texts deferred by an open circuit, by pipeline'),
+}
+
+# Per-process series: (name, sorted label tuple) -> value; histograms hold [bucket counts..., sum, count]
+_metrics = {'histogram': {}, 'counter': {}, 'gauge': {}}
+_metrics_lock = threading.Lock()
+
+def _metric_key(name: str, labels: dict) -> tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None)))
+
+def observe_latency(name: str, seconds: float, **labels):
+    """Add one observation to a latency histogram"""
+    key = _metric_key(name, labels)
+    with _metrics_lock:
+        series = _metrics['histogram'].setdefault(key, [0] * len(METRICS_LATENCY_BUCKETS) + [0.0, 0])
+        for i, bound in enumerate(METRICS_LATENCY_BUCKETS):
+            if seconds <= bound:
+                series[i] += 1
+        series[-2] += seconds
+        series[-1] += 1
+
+def increment_counter(name: str, value: float = 1, **labels):
+    """Increase a counter"""
+    key = _metric_key(name, labels)
+    with _metrics_lock:
+        _metrics['counter'][key] = _metrics['counter'].get(key, 0) + value
+
+def set_gauge(name: str, value: float, **labels):
+    """Set a gauge to its latest value"""
+    with _metrics_lock:
+        _metrics['gauge'][_metric_key(name, labels)] = value
+
+class timed_call:
+    """
+    Context manager timing one external call into twin_external_call_duration_seconds
+    
+    Exceptions are counted in twin_external_call_errors_total and re-raised.
+    
+        with timed_call('twilio', 'messages.create'):
+            twilio_client.messages.create(...)
+    """
+    
+    def __init__(self, service: str, operation: str, **labels):
+        self.labels = {'service': service, 'operation': operation, **labels}
+        self.breaker = circuit_breakers.get(service)
+    
+    def __enter__(self):
+        # Open circuit: fail now instead of waiting on a dependency that is down
+        if self.breaker is not None and not self.breaker.allow():
+            increment_counter('twin_circuit_rejected_total', service=self.labels['service'])
+            raise CircuitOpenError(self.labels['service'])
+        self.started_at = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started_at
+        observe_latency('twin_external_call_duration_seconds', elapsed, **self.labels)
+        if exc_type is not None:
+            increment_counter('twin_external_call_errors_total', error=exc_type.__name__, **self.labels)
+        if self.breaker is not None:
+            self.breaker.record(exc, elapsed)
+        return False
+
+def record_pipeline_cycle(pipeline: str, users: dict, sms_sent: int = None):
+    """
+    Publish the gauges for one finished pipeline cycle
+    
+    Args:
+        pipeline (str): 'analyze' or 'summaries'
+        users (dict): Outcome -> user count, e.g. {'processed': 10, 'skipped': 4}
+        sms_sent (int): SMS sent this cycle, if the pipeline texts
+    """
+    for outcome, count in users.items():
+        set_gauge('twin_pipeline_users', count, pipeline=pipeline, outcome=outcome)
+    if sms_sent is not None:
+        set_gauge('twin_pipeline_sms_sent', sms_sent, pipeline=pipeline)
+    increment_counter('twin_pipeline_cycles_total', pipeline=pipeline)
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+def render_prometheus_metrics() -> str:
+    """Render all series in the Prometheus text exposition format"""
+    with _metrics_lock:
+        snapshot = {kind: {key: (list(v) if isinstance(v, list) else v) for key, v in series.items()} for kind, series in _metrics.items()}
+    
+    lines = []
+    for name, (kind, help_text) in METRIC_HELP.items():
+        series = {key: value for key, value in snapshot[kind].items() if key[0] == name}
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (_, labels), value in sorted(series.items()):
+            if kind == 'histogram':
+                for bound, count in zip(METRICS_LATENCY_BUCKETS, value):
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {value[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {round(value[-2], 6)}")
+                lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+            else:
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+    return '\n'.join(lines) + '\n'
+
+class InstrumentedQuery:
+    """
+    Wraps a Supabase query builder so execute() is timed per table and operation
+    
+    Builder methods are forwarded and their results re-wrapped; the first
+    select/insert/update/upsert/delete call names the operation. With is_async,
+    execute() returns a coroutine (for the async client).
+    """
+    
+    OPERATIONS = {'select', 'insert', 'update', 'upsert', 'delete'}
+    
+    def __init__(self, builder, table: str, operation: str = None, is_async: bool = False):
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+        self._is_async = is_async
+    
+    def __getattr__(self, attr):
+        value = getattr(self._builder, attr)
+        if not callable(value):
+            return value
+        
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            if result is None:
+                return result
+            operation = self._operation or (attr if attr in self.OPERATIONS else None)
+            return InstrumentedQuery(result, self._table, operation, self._is_async)
+        return call
+    
+    def execute(self):
+        if self._is_async:
+            return self._execute_async()
+        with timed_call('supabase', self._operation or 'query', table=self._table):
+            return self._builder.execute()
+    
+    async def _execute_async(self):
+        with timed_call('supabase', self._operation or 'query', table=self._table):
+            return await self._builder.execute()
+
+class InstrumentedSupabase:
+    """Supabase client whose table() queries report to /metrics"""
+    
+    def __init__(self, client, is_async: bool = False):
+        self._client = client
+        self._is_async = is_async
+    
+    def table(self, name: str):
+        return InstrumentedQuery(self._client.table(name), name, is_async=self._is_async)
+    
+    def __getattr__(self, attr):
+        return getattr(self._client, attr)
+
+def cohere_chat_call(**chat_kwargs):
+    """co.chat timed per model, with billed tokens counted"""
+    model = chat_kwargs.get('model')
+    with timed_call('cohere', 'chat', model=model):
+        response = co.chat(**chat_kwargs)
+    record_cohere_tokens(model, response)
+    return response
+
+def record_cohere_tokens(model: str, response):
+    """Count a response's input/output tokens for /metrics and the current user's usage ledger"""
+    usage = getattr(response, 'usage', None)
+    if usage is None:
+        return
+    billed = getattr(usage, 'billed_units', None) or usage
+    ledger = {'cohere_calls': 1}
+    for direction in ('input_tokens', 'output_tokens'):
+        tokens = getattr(billed, direction, None) or getattr(usage, direction, None)
+        if isinstance(tokens, (int, float)) and tokens:
+            increment_counter('twin_cohere_tokens_total', tokens, model=model, direction=direction.split('_')[0])
+            ledger[direction] = int(tokens)
+    record_usage(**ledger)
+
+# =============================================================== #
+# Circuit Breakers
+# =============================================================== #
+
+# Postgres SQLSTATE classes / PostgREST codes that mean the request itself was rejected:
+# data exceptions (22), constraint violations (23), auth (28), syntax/permissions (42),
+# raised exceptions (P0), and PostgREST request, schema cache and JWT errors (PGRST1-3xx)
+CLIENT_ERROR_CODE_PREFIXES = ('22', '23', '28', '42', 'P0', 'PGRST1', 'PGRST2', 'PGRST3')
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open"""
+    
+    def __init__(self, service: str):
+        super().__init__(f"{service} circuit is open")
+        self.service = service
+
+def is_dependency_failure(error) -> bool:
+    """
+    Whether an exception means the dependency is unhealthy
+    
+    Rejected requests (4xx other than 429) mean the service answered, so they
+    don't count against its circuit; timeouts, connection errors and 5xx do.
+    postgrest's APIError carries no HTTP status, only the Postgres SQLSTATE or
+    PostgREST error code, so Supabase rejections are classified by that code.
+    """
+    status = getattr(error, 'status', None) or getattr(error, 'status_code', None) \
+        or getattr(getattr(error, 'response', None), 'status_code', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    code = getattr(error, 'code', None)
+    if isinstance(code, str) and code:
+        return not code.upper().startswith(CLIENT_ERROR_CODE_PREFIXES)
+    return True
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker for one dependency
+    
+    CIRCUIT_FAILURE_THRESHOLD consecutive failures (errors or calls slower than
+    CIRCUIT_SLOW_CALL_SECONDS) open the circuit and every call fails fast with
+    CircuitOpenError. After CIRCUIT_RESET_SECONDS one probe call is let through:
+    success closes the circuit, failure keeps it open for another period.
+    """
+    
+    STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+    
+    def __init__(self, service: str):
+        self.service = service
+        self._lock = threading.Lock()
+        self._reset()
+    
+    def _reset(self):
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.times_opened = 0
+        self.rejected_calls = 0
+    
+    def _set_state(self, state: str):
+        self.state = state
+        set_gauge('twin_circuit_state', self.STATE_VALUES[state], service=self.service)
+    
+    def _reset_elapsed(self) -> bool:
+        return time.monotonic() - self.opened_at >= CIRCUIT_RESET_SECONDS
+    
+    def is_open(self) -> bool:
+        """Whether the circuit is open and not yet due a probe (half-open circuits report False)"""
+        with self._lock:
+            return self.state == 'open' and not self._reset_elapsed()
+    
+    def allow(self) -> bool:
+        """Admit one call, claiming the half-open probe when the reset period has passed"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and self._reset_elapsed():
+                self._set_state('half_open')
+                log_always("🔌 %s circuit half-open, probing", self.service)
+            if self.state == 'half_open' and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.rejected_calls += 1
+            return False
+    
+    def record(self, error, elapsed: float):
+        """Record the outcome of an admitted call"""
+        if isinstance(error, BaseException) and not isinstance(error, Exception):
+            # Cancelled or interrupted: says nothing about the dependency
+            with self._lock:
+                self.probe_in_flight = False
+            return
+        
+        slow = CIRCUIT_SLOW_CALL_SECONDS and elapsed > CIRCUIT_SLOW_CALL_SECONDS
+        failed = slow or (error is not None and is_dependency_failure(error))
+        with self._lock:
+            was_probe = self.state == 'half_open' and self.probe_in_flight
+            self.probe_in_flight = False
+            if not failed:
+                self.consecutive_failures = 0
+                if self.state != 'closed':
+                    self._set_state('closed')
+                    log_always("✅ %s circuit closed", self.service)
+                return
+            
+            self.consecutive_failures += 1
+            if was_probe or (self.state == 'closed' and self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD):
+                self._set_state('open')
+                self.opened_at = time.monotonic()
+                self.times_opened += 1
+                increment_counter('twin_circuit_opened_total', service=self.service)
+                reason = f"slow call ({elapsed:.1f}s)" if slow else type(error).__name__
+                log_warning("🔌 %s circuit open after %d failures (last: %s), failing fast for %ss",
+                            self.service, self.consecutive_failures, reason, CIRCUIT_RESET_SECONDS)
+    
+    def snapshot(self) -> dict:
+        with self._lock:
+            retry_in = None
+            if self.state == 'open':
+                retry_in = round(max(0.0, CIRCUIT_RESET_SECONDS - (time.monotonic() - self.opened_at)), 1)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'times_opened': self.times_opened,
+                'rejected_calls': self.rejected_calls,
+                'retry_in_seconds': retry_in,
+            }
+
+circuit_breakers = {service: CircuitBreaker(service) for service in ('cohere', 'twilio', 'supabase')}
+
+def circuit_is_open(*services: str) -> bool:
+    """Whether any of the named dependencies would fail fast right now"""
+    return any(circuit_breakers[service].is_open() for service in services)
+
+def get_circuit_breaker_states() -> dict:
+    """Per-dependency breaker state for /health"""
+    return {service: breaker.snapshot() for service, breaker in circuit_breakers.items()}
+
+def record_circuit_deferral(pipeline: str, service: str):
+    """Count one pipeline user or inbound text put off by an open circuit"""
+    increment_counter('twin_circuit_deferred_total', pipeline=pipeline, service=service)
+
+def defer_for_open_circuit(pipeline: str, *services: str) -> str:
+    """
+    Name the first open circuit among services and count the deferral, or return None
+    
+    Deferred pipeline users keep their unprocessed rows, so the next cycle picks them up.
+    """
+    for service in services:
+        if circuit_breakers[service].is_open():
+            record_circuit_deferral(pipeline, service)
+            return service
+    return None
+
+def _reset_circuits_after_fork():
+    """A forked worker starts with closed circuits and its own locks"""
+    for breaker in circuit_breakers.values():
+        breaker._lock = threading.Lock()
+        breaker._reset()
+
+os.register_at_fork(after_in_child=_reset_circuits_after_fork)
+
+
+# =============================================================== #
+# Usage Ledger
+# =============================================================== #
+
+USAGE_FIELDS = ('input_tokens', 'output_tokens', 'cohere_calls', 'sms_segments', 'tool_calls')
+
+# Characters Twilio can send as GSM-7 (anything else makes the message UCS-2)
+GSM7_CHARACTERS = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED_CHARACTERS = set("^{}\\[~]|€\f")  # Count as two characters
+
+# (user_id, day) -> {'stored': totals read from the ledger or None, 'pending': unwritten deltas, 'loaded_at': ts}
+_usage_totals = {}
+_usage_lock = threading.Lock()
+_usage_last_flush = {'at': time.monotonic()}
+
+def usage_day() -> str:
+    """Today's ledger day (UTC, YYYY-MM-DD)"""
+    return time.strftime('%Y-%m-%d', time.gmtime())
+
+def count_sms_segments(message_body: str) -> int:
+    """Number of billed Twilio segments for a message body"""
+    if not message_body:
+        return 1
+    if all(char in GSM7_CHARACTERS or char in GSM7_EXTENDED_CHARACTERS for char in message_body):
+        length = sum(2 if char in GSM7_EXTENDED_CHARACTERS else 1 for char in message_body)
+        single, multi = 160, 153
+    else:
+        length = len(message_body.encode('utf-16-le')) // 2
+        single, multi = 70, 67
+    return 1 if length <= single else -(-length // multi)
+
+def record_usage(user_id: str = None, **deltas):
+    """
+    Add usage to a user's ledger row for today
+    
+    Deltas are held in memory and written in batches by flush_usage_ledger().
+    
+    Args:
+        user_id (str): The user to charge; defaults to the user bound to the log context
+        **deltas: Amounts for any of USAGE_FIELDS
+    """
+    user_id = user_id or _log_context.get().get('user_id')
+    if not user_id:
+        return
+    with _usage_lock:
+        entry = _usage_totals.setdefault((user_id, usage_day()), {
+            'stored': None,
+            'pending': dict.fromkeys(USAGE_FIELDS, 0),
+            'loaded_at': 0.0
+        })
+        for field, amount in deltas.items():
+            entry['pending'][field] += amount
+
+def flush_usage_ledger() -> int:
+    """
+    Write all pending usage deltas to the ledger table in one insert
+    
+    Once the pending deltas are written, entries for past days are dropped so a
+    long-running worker keeps at most today's entries in memory.
+    
+    Returns:
+        int: Number of ledger rows written
+    """
+    if circuit_is_open('supabase'):
+        return 0  # Deltas stay pending until Supabase recovers
+    
+    with _usage_lock:
+        _usage_last_flush['at'] = time.monotonic()
+        batch = []
+        for (user_id, day), entry in _usage_totals.items():
+            if any(entry['pending'].values()):
+                batch.append((user_id, day, entry['pending']))
+                if entry['stored'] is not None:
+                    for field, amount in entry['pending'].items():
+                        entry['stored'][field] += amount
+                entry['pending'] = dict.fromkeys(USAGE_FIELDS, 0)
+    
+    if not batch:
+        _prune_past_usage_days()
+        return 0
+    
+    try:
+        supabase.table(USAGE_LEDGER_TABLE).insert([
+            {'user_id': user_id, 'day': day, **pending} for user_id, day, pending in batch
+        ]).execute()
+        _prune_past_usage_days()
+        return len(batch)
+    except Exception as e:
+        log_error("💥 Error writing %d usage ledger rows: %s", len(batch), e)
+        # Put the deltas back so the next flush retries them
+        with _usage_lock:
+            for user_id, day, pending in batch:
+                entry = _usage_totals[(user_id, day)]
+                for field, amount in pending.items():
+                    entry['pending'][field] += amount
+                    if entry['stored'] is not None:
+                        entry['stored'][field] -= amount
+        return 0
+
+def _prune_past_usage_days():
+    """Drop ledger entries for days before today that have nothing left to flush"""
+    today = usage_day()
+    with _usage_lock:
+        for key in [key for key, entry in _usage_totals.items() if key[1] < today and not any(entry['pending'].values())]:
+            del _usage_totals[key]
+
+def maybe_flush_usage_ledger() -> int:
+    """Flush if the last flush was more than USAGE_LEDGER_FLUSH_SECONDS ago"""
+    if time.monotonic() - _usage_last_flush['at'] < USAGE_LEDGER_FLUSH_SECONDS:
+        return 0
+    return flush_usage_ledger()
+
+def get_usage_history(user_id: str, days: int = 1) -> dict:
+    """
+    Read a user's ledger for the last few UTC days, including unwritten deltas
+    
+    Args:
+        user_id (str): The user ID
+        days (int): Number of days to return, today included
+        
+    Returns:
+        dict: Contains success flag and 'days' (day -> totals), newest first
+    """
+    first_day = time.strftime('%Y-%m-%d', time.gmtime(time.time() - (days - 1) * 86400))
+    try:
+        response = supabase.table(USAGE_LEDGER_TABLE) \
+            .select('day, ' + ', '.join(USAGE_FIELDS)) \
+            .eq('user_id', user_id) \
+            .gte('day', first_day) \
+            .execute()
+    except Exception as e:
+        log_error("💥 Error reading usage ledger for %s: %s", user_id, e)
+        return {'success': False, 'error': str(e), 'user_id': user_id, 'days': {}}
+    
+    totals = {}
+    for row in response.data or []:
+        day_totals = totals.setdefault(row['day'], dict.fromkeys(USAGE_FIELDS, 0))
+        for field in USAGE_FIELDS:
+            day_totals[field] += row.get(field) or 0
+    
+    with _usage_lock:
+        for (entry_user_id, day), entry in _usage_totals.items():
+            if entry_user_id == user_id and day >= first_day:
+                day_totals = totals.setdefault(day, dict.fromkeys(USAGE_FIELDS, 0))
+                for field, amount in entry['pending'].items():
+                    day_totals[field] += amount
+    
+    today = usage_day()
+    with _usage_lock:
+        entry = _usage_totals.get((user_id, today))
+        if entry is not None and today in totals:
+            # Refresh the enforcement view while we have the stored sums anyway
+            entry['stored'] = {field: totals[today][field] - entry['pending'][field] for field in USAGE_FIELDS}
+            entry['loaded_at'] = time.monotonic()
+    
+    return {
+        'success': True,
+        'user_id': user_id,
+        'days': dict(sorted(totals.items(), reverse=True))
+    }
+
+def get_user_usage_today(user_id: str) -> dict:
+    """Today's totals for a user (stored sums refreshed every USAGE_LEDGER_REFRESH_SECONDS, plus pending deltas)"""
+    key = (user_id, usage_day())
+    with _usage_lock:
+        entry = _usage_totals.get(key)
+        fresh = entry is not None and entry['stored'] is not None and time.monotonic() - entry['loaded_at'] < USAGE_LEDGER_REFRESH_SECONDS
+        if fresh:
+            return {field: entry['stored'][field] + entry['pending'][field] for field in USAGE_FIELDS}
+    
+    history = get_usage_history(user_id, days=1)
+    today = history['days'].get(key[1], dict.fromkeys(USAGE_FIELDS, 0))
+    if history['success']:
+        with _usage_lock:
+            entry = _usage_totals.setdefault(key, {'stored': None, 'pending': dict.fromkeys(USAGE_FIELDS, 0), 'loaded_at': 0.0})
+            entry['stored'] = {field: today[field] - entry['pending'][field] for field in USAGE_FIELDS}
+            entry['loaded_at'] = time.monotonic()
+    return today
+
+def get_usage_budget(user_id: str, pipeline: str = None) -> dict:
+    """
+    Decide how a user's pipelines run given today's usage and the configured caps
+    
+    Tiers:
+        normal    - under USAGE_DEGRADE_AT of every cap
+        reduced   - cheaper model and half the reply context
+        exhausted - cap reached: cheaper model, no proactive texts, inbound texts
+                    get a light reply instead of the agent
+    
+    Args:
+        user_id (str): The user ID (None means no ledger: normal tier)
+        pipeline (str): Pipeline name for the degradation counter ('analyze', 'proactive', 'inbound')
+        
+    Returns:
+        dict: tier, agent_model, learning_graph_model, context_token_budget,
+              proactive_allowed, usage (today's totals or None)
+    """
+    budget = {
+        'tier': 'normal',
+        'agent_model': AGENT_MODEL,
+        'learning_graph_model': LEARNING_GRAPH_MODEL,
+        'context_token_budget': CONTEXT_TOKEN_BUDGET,
+        'proactive_allowed': True,
+        'usage': None
+    }
+    if not user_id or not (USAGE_DAILY_TOKEN_CAP or USAGE_DAILY_SMS_SEGMENT_CAP):
+        return budget
+    
+    usage = get_user_usage_today(user_id)
+    budget['usage'] = usage
+    shares = []
+    if USAGE_DAILY_TOKEN_CAP:
+        shares.append((usage['input_tokens'] + usage['output_tokens']) / USAGE_DAILY_TOKEN_CAP)
+    if USAGE_DAILY_SMS_SEGMENT_CAP:
+        shares.append(usage['sms_segments'] / USAGE_DAILY_SMS_SEGMENT_CAP)
+    share = max(shares)
+    
+    if share >= 1:
+        budget.update(tier='exhausted', agent_model=USAGE_REDUCED_MODEL, learning_graph_model=USAGE_REDUCED_MODEL,
+                      context_token_budget=CONTEXT_TOKEN_BUDGET // 4, proactive_allowed=False)
+    elif share >= USAGE_DEGRADE_AT:
+        budget.update(tier='reduced', agent_model=USAGE_REDUCED_MODEL, learning_graph_model=USAGE_REDUCED_MODEL,
+                      context_token_budget=CONTEXT_TOKEN_BUDGET // 2)
+    
+    if budget['tier'] != 'normal' and pipeline:
+        increment_counter('twin_usage_degraded_total', tier=budget['tier'], pipeline=pipeline)
+    return budget
+
+def _reset_usage_after_fork():
+    global _usage_lock
+    _usage_lock = threading.Lock()
+    _usage_totals.clear()  # The parent flushes its own deltas
+
+os.register_at_fork(after_in_child=_reset_usage_after_fork)
+atexit.register(flush_usage_ledger)
+
 
-app = Flask(__name__)
+# =============================================================== #
+# API Clients
+# =============================================================== #
+
+class LazyClient:
+    """
+    Proxy for an API client that is only built the first time it is used
+    
+    Importing app.py therefore needs no network access, and each worker process
+    builds its own client (and connection pool) instead of inheriting the parent's
+    across fork. Attribute access is forwarded to the real client.
+    """
+    
+    def __init__(self, name: str, factory):
+        self._name = name
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+        _lazy_clients.append(self)
+    
+    @property
+    def initialized(self) -> bool:
+        return self._client is not None
+    
+    def get(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    log_verbose("🔌 Creating %s client in process %s", self._name, os.getpid())
+                    self._client = self._factory()
+        return self._client
+    
+    def reset(self):
+        """Drop the client so the next use builds a fresh one (called in forked children)"""
+        self._client = None
+        self._lock = threading.Lock()
+    
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
+
+_lazy_clients = []
 
 # Initialize Supabase client
-supabase: SupabaseClient = create_client(supabase_url=SUPABASE_URL, supabase_key=SUPABASE_PUBLISHABLE_KEY)
+supabase = LazyClient('supabase', lambda: InstrumentedSupabase(deferred_import('supabase').create_client(supabase_url=SUPABASE_URL, supabase_key=SUPABASE_PUBLISHABLE_KEY)))
 
 # Initialize Cohere client
-co = cohere.ClientV2(api_key=COHERE_API_KEY)
+co = LazyClient('cohere', lambda: deferred_import('cohere').ClientV2(api_key=COHERE_API_KEY))
+
+twilio_client = LazyClient('twilio', lambda: deferred_import('twilio.rest').Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN))
+
+# Asyncio engine, created on first use when PIPELINE_ENGINE=async
+_async_engine = None
+_async_engine_lock = threading.Lock()
+
+def get_async_engine():
+    """Return the process-wide AsyncEngine, starting its event loop on first use"""
+    global _async_engine
+    with _async_engine_lock:
+        if _async_engine is None:
+            import sys
+            from async_engine import AsyncEngine
+            _async_engine = AsyncEngine(sys.modules[__name__])
+            _async_engine.start()
+        return _async_engine
 
-twilio_client = TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+def _reset_clients_after_fork():
+    """Forked workers must not reuse the parent's sockets or event loop thread"""
+    global _async_engine, _async_engine_lock
+    for client in _lazy_clients:
+        client.reset()
+    _async_engine = None
+    _async_engine_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_clients_after_fork)
+
+# All HTTP routes; registered on the Flask app by create_app()
+routes = Blueprint('twin', __name__)
 
 
 # TODO: MOVE THIS TO A NEW "SERVER" - this server should ONLY BE FOR EXISTING FUNCTIONS
@@ -77,11 +951,13 @@ def send_sms(message_body: str, to_number: str): #
     """
 
     try:
-        message = twilio_client.messages.create(
-            body=message_body,
-            from_=TWILIO_PHONE_NUMBER,
-            to=to_number
-        )
+        with timed_call('twilio', 'messages.create'):
+            message = twilio_client.messages.create(
+                body=message_body,
+                from_=TWILIO_PHONE_NUMBER,
+                to=to_number
+            )
+        record_usage(sms_segments=count_sms_segments(message_body))
         
         return {
             'success': True,
@@ -105,10 +981,31 @@ def send_sms(message_body: str, to_number: str): #
 # Video Transcript
 # =============================================================== #
 
+def extract_youtube_video_id(youtube_url: str):
+    """
+    Extract the 11-character video ID from the common YouTube URL formats
+    
+    Returns:
+        str: The video ID, or None if the URL isn't a recognizable YouTube link
+    """
+    patterns = [
+        r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/|youtube\.com\/v\/)([a-zA-Z0-9_-]{11})',
+        r'(?:youtube\.com\/.*[?&]v=)([a-zA-Z0-9_-]{11})'
+    ]
+    
+    for pattern in patterns:
+        match = re.search(pattern, youtube_url or '')
+        if match:
+            return match.group(1)
+    return None
+
 def get_youtube_transcript(youtube_url: str):
     """
     Extract transcript text from a YouTube video URL
     
+    Served from the resource cache when warm; joins an in-flight fetch of the same
+    video (e.g. a speculative prefetch) instead of starting a second one.
+    
     Args:
         youtube_url (str): The YouTube video URL
         
@@ -117,105 +1014,566 @@ def get_youtube_transcript(youtube_url: str):
     """
     try:
         # Extract video ID from various YouTube URL formats
-        video_id = None
-        patterns = [
-            r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/|youtube\.com\/v\/)([a-zA-Z0-9_-]{11})',
-            r'(?:youtube\.com\/.*[?&]v=)([a-zA-Z0-9_-]{11})'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, youtube_url)
-            if match:
-                video_id = match.group(1)
-                break
+        video_id = extract_youtube_video_id(youtube_url)
         
         if not video_id:
             return None
         
-        # Initialize YouTubeTranscriptApi instance and fetch transcript
-        ytt_api = YouTubeTranscriptApi()
-        fetched_transcript = ytt_api.fetch(video_id)
-        
-        # Extract transcript snippets and combine into full text
-        full_transcript_parts = []
-        for snippet in fetched_transcript.snippets:
-            full_transcript_parts.append(snippet.text)
-        
-        # Return the combined transcript text
-        return ' '.join(full_transcript_parts)
+        return load_resource('transcript', video_id, lambda: _fetch_youtube_transcript(video_id))
         
     except Exception as e:
-        print(f"Error fetching transcript: {str(e)}")
+        log_always("Error fetching transcript: %s", str(e))
         return None
+
+def _fetch_youtube_transcript(video_id: str) -> str:
+    """Download and join a video's transcript snippets (raises on failure)"""
+    # Initialize YouTubeTranscriptApi instance and fetch transcript
+    ytt_api = deferred_import('youtube_transcript_api').YouTubeTranscriptApi()
+    fetched_transcript = ytt_api.fetch(video_id)
+    
+    # Extract transcript snippets and combine into full text
+    full_transcript_parts = []
+    for snippet in fetched_transcript.snippets:
+        full_transcript_parts.append(snippet.text)
+    
+    return ' '.join(full_transcript_parts)
     
 # =============================================================== #
 # Website Scraping Content
 # =============================================================== #
 
+SCRAPE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+SCRAPE_ALLOWED_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+# Subtrees that never hold the page's main content
+BOILERPLATE_TAGS = {'script', 'style', 'noscript', 'template', 'svg', 'canvas', 'iframe', 'nav', 'footer', 'header', 'aside', 'form', 'button', 'select'}
+BOILERPLATE_ATTR_PATTERN = re.compile(r'\b(nav|navbar|menu|footer|sidebar|cookie|banner|breadcrumbs?|share|social|advert|ads|promo|subscribe|newsletter|related|comments?|skip-link)\b', re.IGNORECASE)
+BLOCK_TAGS = {'p', 'div', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'section', 'article', 'main', 'br', 'tr', 'td', 'th', 'pre', 'blockquote', 'dd', 'dt', 'figcaption'}
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+class MainContentExtractor(HTMLParser):
+    """
+    Single-pass main-content extractor built on the stdlib HTML tokenizer
+    
+    Drops boilerplate subtrees (nav, footer, cookie banners, ...) and link-heavy
+    blocks such as menus, and prefers text inside <main>/<article> when the page
+    has enough of it. No document tree is built.
+    """
+    
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._stack = []  # (tag, is_boilerplate, is_main)
+        self._skip_depth = 0
+        self._main_depth = 0
+        self._block_text = []
+        self._block_link_chars = 0
+        self._in_link = 0
+        self._block_in_main = False
+        self.blocks = []  # (text, in_main)
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self._flush_block()
+        if tag in VOID_TAGS:
+            return
+        
+        attr_text = ' '.join(value or '' for name, value in attrs if name in ('class', 'id', 'role'))
+        is_boilerplate = tag in BOILERPLATE_TAGS or bool(attr_text and BOILERPLATE_ATTR_PATTERN.search(attr_text))
+        is_main = tag in ('main', 'article')
+        self._stack.append((tag, is_boilerplate, is_main))
+        self._skip_depth += is_boilerplate
+        self._main_depth += is_main
+        if tag == 'a':
+            self._in_link += 1
+    
+    def handle_endtag(self, tag):
+        if tag in BLOCK_TAGS:
+            self._flush_block()
+        if not any(open_tag == tag for open_tag, _, _ in self._stack):
+            return  # Stray end tag
+        
+        # Pop up to the matching tag, closing anything left unclosed on the way
+        while self._stack:
+            open_tag, is_boilerplate, is_main = self._stack.pop()
+            self._skip_depth -= is_boilerplate
+            self._main_depth -= is_main
+            if open_tag == 'a':
+                self._in_link = max(0, self._in_link - 1)
+            if open_tag == tag:
+                break
+    
+    def handle_data(self, data):
+        if self._skip_depth or not data.strip():
+            return
+        if not self._block_text:
+            self._block_in_main = self._main_depth > 0
+        self._block_text.append(data)
+        if self._in_link:
+            self._block_link_chars += len(data.strip())
+    
+    def _flush_block(self):
+        text = ' '.join(' '.join(self._block_text).split())
+        link_chars = self._block_link_chars
+        self._block_text = []
+        self._block_link_chars = 0
+        
+        # Short blocks that are mostly links are menus, tag clouds or pagination
+        if text and not (len(text) < 200 and link_chars > 0.5 * len(text)):
+            self.blocks.append((text, self._block_in_main))
+    
+    def close(self):
+        super().close()
+        self._flush_block()
+
+def extract_text_from_html(content, max_chars: int = None) -> str:
+    """
+    Turn an HTML document into its main body text
+    
+    Args:
+        content (bytes | str): The raw HTML
+        max_chars (int): Cap on the returned text (defaults to SCRAPE_MAX_TEXT_CHARS)
+        
+    Returns:
+        str: Main-content text, one block per line, without navigation or boilerplate
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='replace')
+    max_chars = max_chars or SCRAPE_MAX_TEXT_CHARS
+    
+    extractor = MainContentExtractor()
+    extractor.feed(content)
+    extractor.close()
+    
+    # Prefer <main>/<article> when the page marks up enough real content there
+    main_blocks = [text for text, in_main in extractor.blocks if in_main]
+    if sum(len(text) for text in main_blocks) >= 500:
+        blocks = main_blocks
+    else:
+        blocks = [text for text, _ in extractor.blocks]
+    
+    text = '\n'.join(blocks)
+    if len(text) > max_chars:
+        text = text[:max_chars].rsplit(' ', 1)[0] + ' ...'
+    return text
+
+def is_scrapable_content_type(content_type: str) -> bool:
+    """True if a Content-Type header is on the scrape allowlist (a missing header is allowed)"""
+    if not content_type:
+        return True
+    return content_type.split(';')[0].strip().lower() in SCRAPE_ALLOWED_CONTENT_TYPES
+
+def decode_scraped_body(body: bytes, content_type: str, max_chars: int = None) -> str:
+    """
+    Turn a capped response body into text for the agent
+    
+    Args:
+        body (bytes): Response body, already cut at SCRAPE_MAX_BYTES
+        content_type (str): The response Content-Type header
+        max_chars (int): Cap on the returned text
+        
+    Returns:
+        str: Extracted text
+    """
+    charset_match = re.search(r'charset=([\w-]+)', content_type or '', re.IGNORECASE)
+    try:
+        html = body.decode(charset_match.group(1) if charset_match else 'utf-8', errors='replace')
+    except LookupError:
+        html = body.decode('utf-8', errors='replace')
+    
+    if (content_type or '').lower().startswith('text/plain'):
+        max_chars = max_chars or SCRAPE_MAX_TEXT_CHARS
+        text = ' '.join(html.split())
+        return text[:max_chars]
+    
+    return extract_text_from_html(html, max_chars=max_chars)
+
 def scrape_website_info(url: str):
     """
     Scrape website content and return the body text
     
+    The body is streamed and cut off at SCRAPE_MAX_BYTES, and only allowlisted
+    content types are downloaded, so huge pages and binaries can't stall the agent.
+    Warm pages come from the resource cache, and a fetch already in flight for the
+    same URL is joined rather than repeated.
+    
     Args:
         url (str): The website URL to scrape
         
     Returns:
-        str: The website body content as text, or None if scraping fails
+        str: The page's main content as text, or None if scraping fails
     """
     try:
-        import requests
-        from bs4 import BeautifulSoup
-        
         # Ensure URL has proper protocol
         if not url.startswith(('http://', 'https://')):
             url = 'https://' + url
         
-        # Set headers to mimic a real browser
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
+        return load_resource('page', normalize_resource_url(url), lambda: _fetch_website_info(url))
         
-        # Make request with timeout
-        response = requests.get(url, headers=headers, timeout=10)
+    except Exception as e:
+        log_always("Error scraping website: %s", str(e))
+        return None
+
+def _fetch_website_info(url: str):
+    """Stream one page within the byte cap and extract its text (raises on HTTP errors)"""
+    requests = deferred_import('requests')
+    
+    with requests.get(url, headers=SCRAPE_HEADERS, timeout=SCRAPE_TIMEOUT_SECONDS, stream=True) as response:
         response.raise_for_status()  # Raise exception for bad status codes
         
-        # Parse HTML content
-        soup = BeautifulSoup(response.content, 'html.parser')
+        content_type = response.headers.get('Content-Type', '')
+        if not is_scrapable_content_type(content_type):
+            log_always("⏩ Not scraping %s: content type %s is not text", url, content_type)
+            return None
         
-        # Remove script and style elements
-        for script in soup(["script", "style"]):
-            script.decompose()
+        body = bytearray()
+        for chunk in response.iter_content(chunk_size=16384):
+            body.extend(chunk)
+            if len(body) >= SCRAPE_MAX_BYTES:
+                log_verbose("✂️ Stopped reading %s at %s bytes", url, SCRAPE_MAX_BYTES)
+                break
+    
+    return decode_scraped_body(bytes(body[:SCRAPE_MAX_BYTES]), content_type)
+
+# =============================================================== #
+# Resource Cache & Prefetch
+# =============================================================== #
+
+# Transcripts and page text keyed by ('transcript', video_id) / ('page', url) -> (stored_at, text)
+_resource_cache = OrderedDict()
+_resource_cache_lock = threading.Lock()
+_resource_cache_stats = {'hits': 0, 'misses': 0, 'stores': 0, 'inflight_joins': 0, 'prefetched': 0, 'prefetch_failed': 0, 'prefetch_skipped': 0, 'speculative_fetches': 0}
+_resource_inflight = {}  # (kind, key) -> Future for fetches currently running
+
+# Prefetch queue of (rank, sequence, url); lower rank is fetched first
+_prefetch_queue = queue.PriorityQueue()
+_prefetch_pending = set()
+_prefetch_lock = threading.Lock()
+_prefetch_sequence = 0
+_prefetch_workers = []
+
+PREFETCH_PRIORITY_RANKS = {'high': 0, 'medium': 1, 'low': 2}
+
+def normalize_resource_url(url: str) -> str:
+    """Cache key for a page URL: scheme added, fragment and trailing slash dropped"""
+    url = (url or '').strip()
+    if not url.startswith(('http://', 'https://')):
+        url = 'https://' + url
+    return url.split('#', 1)[0].rstrip('/')
+
+def resource_cache_get(kind: str, key: str):
+    """Return cached transcript/page text, or None on a miss or expired entry"""
+    cache_key = (kind, key)
+    with _resource_cache_lock:
+        entry = _resource_cache.get(cache_key)
+        if entry and time.time() - entry[0] < RESOURCE_CACHE_TTL_SECONDS:
+            _resource_cache.move_to_end(cache_key)
+            _resource_cache_stats['hits'] += 1
+            return entry[1]
+        if entry:
+            del _resource_cache[cache_key]
+        _resource_cache_stats['misses'] += 1
+        return None
+
+def resource_cache_put(kind: str, key: str, text: str):
+    """Store transcript/page text, evicting the least recently used entries"""
+    if not text:
+        return
+    with _resource_cache_lock:
+        _resource_cache[(kind, key)] = (time.time(), text)
+        _resource_cache.move_to_end((kind, key))
+        _resource_cache_stats['stores'] += 1
+        while len(_resource_cache) > RESOURCE_CACHE_MAX_ENTRIES:
+            _resource_cache.popitem(last=False)
+
+def get_inflight_resource(kind: str, key: str):
+    """Return the Future of a fetch already running for this resource, or None"""
+    with _resource_cache_lock:
+        return _resource_inflight.get((kind, key))
+
+def load_resource(kind: str, key: str, loader):
+    """
+    Read-through cache with single-flight loading
+    
+    Concurrent callers for the same resource share one loader call: the first
+    runs it, the rest wait on its Future. Successful results are cached.
+    
+    Args:
+        kind (str): 'transcript' or 'page'
+        key (str): Video id or normalized URL
+        loader (callable): Fetches the text; may raise or return None
         
-        # Get text content
-        text = soup.get_text()
+    Returns:
+        str: The resource text, or None if the loader found nothing
+    """
+    cached = resource_cache_get(kind, key)
+    if cached is not None:
+        return cached
+    
+    with _resource_cache_lock:
+        future = _resource_inflight.get((kind, key))
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _resource_inflight[(kind, key)] = future
+        else:
+            _resource_cache_stats['inflight_joins'] += 1
+    
+    if not is_owner:
+        return future.result(timeout=RESOURCE_INFLIGHT_WAIT_SECONDS)
+    
+    try:
+        value = loader()
+        resource_cache_put(kind, key, value)
+        future.set_result(value)
+        return value
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _resource_cache_lock:
+            _resource_inflight.pop((kind, key), None)
+
+def is_resource_cached(url: str) -> bool:
+    """True if the transcript or page for a URL is already warm (doesn't count as a hit)"""
+    video_id = extract_youtube_video_id(url)
+    cache_key = ('transcript', video_id) if video_id else ('page', normalize_resource_url(url))
+    with _resource_cache_lock:
+        entry = _resource_cache.get(cache_key)
+        return bool(entry and time.time() - entry[0] < RESOURCE_CACHE_TTL_SECONDS)
+
+def get_resource_cache_stats() -> dict:
+    """Snapshot of the resource cache and prefetch queue for /health"""
+    with _resource_cache_lock:
+        stats = dict(_resource_cache_stats)
+        stats['entries'] = len(_resource_cache)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0.0
+    stats['prefetch_queued'] = _prefetch_queue.qsize()
+    stats['prefetch_enabled'] = RESOURCE_PREFETCH_ENABLED
+    return stats
+
+def extract_summary_urls(summary_text: str) -> list:
+    """Return the unique URLs mentioned anywhere in a learning-graph summary"""
+    url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+    return list(set(re.findall(url_pattern, summary_text)))
+
+def rank_prefetch_urls(summary_text: str, key_urls: list, extracted_urls: list) -> list:
+    """
+    Order the URLs from one learning-graph run for prefetching
+    
+    URLs Cohere flagged under key_resources.for_ai_analysis come first by their
+    priority, then high_value resources, then the remaining activity and summary
+    URLs. Within a rank, YouTube links (the slowest to fetch) go first.
+    
+    Args:
+        summary_text (str): The learning-graph JSON returned by Cohere
+        key_urls (list): Activity URLs sent in the prompt
+        extracted_urls (list): URLs found anywhere in the summary text
         
-        # Clean up text - remove extra whitespace and newlines
-        lines = (line.strip() for line in text.splitlines())
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        text = ' '.join(chunk for chunk in chunks if chunk)
+    Returns:
+        list: (rank, url) tuples, best first, at most RESOURCE_PREFETCH_MAX_PER_RUN
+    """
+    ranks = {}
+    
+    def add(url, rank):
+        if isinstance(url, str) and url.startswith(('http://', 'https://')):
+            ranks[url] = min(rank, ranks.get(url, rank))
+    
+    try:
+        key_resources = json.loads(summary_text).get('key_resources', {}) or {}
+    except (ValueError, AttributeError):
+        key_resources = {}
+    
+    for resource in key_resources.get('for_ai_analysis', []) or []:
+        if isinstance(resource, dict):
+            add(resource.get('url'), PREFETCH_PRIORITY_RANKS.get(str(resource.get('priority', '')).lower(), 2))
+    for resource in key_resources.get('high_value', []) or []:
+        if isinstance(resource, dict):
+            add(resource.get('url'), 1)
+    for url in key_urls:
+        add(url, 3)
+    for url in extracted_urls:
+        add(url, 4)
+    
+    ranked = sorted(ranks.items(), key=lambda item: (item[1], extract_youtube_video_id(item[0]) is None))
+    return [(rank, url) for url, rank in ranked[:RESOURCE_PREFETCH_MAX_PER_RUN]]
+
+def _prefetch_worker():
+    """Drain the prefetch queue, warming the transcript and page caches"""
+    while True:
+        rank, _, url = _prefetch_queue.get()
+        try:
+            if is_resource_cached(url):
+                continue
+            if extract_youtube_video_id(url):
+                text = get_youtube_transcript(url)
+            else:
+                text = scrape_website_info(url)
+            
+            with _resource_cache_lock:
+                _resource_cache_stats['prefetched' if text else 'prefetch_failed'] += 1
+            log_verbose("🔥 Prefetched %s (rank %s): %s", url, rank, 'ok' if text else 'failed')
+        except Exception as e:
+            log_verbose("❌ Prefetch failed for %s: %s", url, e)
+        finally:
+            with _prefetch_lock:
+                _prefetch_pending.discard(url)
+            _prefetch_queue.task_done()
+
+def schedule_resource_prefetch(ranked_urls: list) -> int:
+    """
+    Queue URLs for background fetching, skipping ones that are warm or already queued
+    
+    Args:
+        ranked_urls (list): (rank, url) tuples from rank_prefetch_urls()
         
-        return text
+    Returns:
+        int: Number of URLs queued
+    """
+    global _prefetch_sequence
+    if not RESOURCE_PREFETCH_ENABLED or not ranked_urls:
+        return 0
+    
+    queued = 0
+    with _prefetch_lock:
+        # Workers start on first use so importing app.py stays thread-free
+        if not _prefetch_workers:
+            for i in range(RESOURCE_PREFETCH_WORKERS):
+                worker = threading.Thread(target=_prefetch_worker, name=f"PrefetchThread-{i+1}", daemon=True)
+                worker.start()
+                _prefetch_workers.append(worker)
+        
+        for rank, url in ranked_urls:
+            if url in _prefetch_pending or is_resource_cached(url):
+                with _resource_cache_lock:
+                    _resource_cache_stats['prefetch_skipped'] += 1
+                continue
+            _prefetch_pending.add(url)
+            _prefetch_sequence += 1
+            _prefetch_queue.put((rank, _prefetch_sequence, url))
+            queued += 1
+    return queued
+
+def extract_message_urls(message: str) -> list:
+    """Return the links in an inbound text, trailing punctuation stripped, in order"""
+    urls = []
+    for match in URL_PATTERN.finditer(message or ''):
+        url = match.group(0).rstrip('.,;:!?)\'"')
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+def speculative_prefetch_message_urls(incoming_msg: str) -> list:
+    """
+    Start fetching the links in an inbound text before the agent asks for them
+    
+    Each URL is fetched in its own daemon thread through the same single-flight
+    path as the agent's tools, so the agent's later get_youtube_transcript /
+    scrape_website_info call joins the running fetch or hits the cache.
+    
+    Args:
+        incoming_msg (str): The inbound SMS body
         
-    except Exception as e:
-        print(f"Error scraping website: {str(e)}")
-        return None
+    Returns:
+        list: The URLs that were started
+    """
+    if not RESOURCE_PREFETCH_ENABLED:
+        return []
+    
+    started = []
+    for url in extract_message_urls(incoming_msg)[:SPECULATIVE_PREFETCH_MAX_URLS]:
+        if is_resource_cached(url):
+            continue
+        fetch = get_youtube_transcript if extract_youtube_video_id(url) else scrape_website_info
+        threading.Thread(target=fetch, args=(url,), name="SpeculativeFetch", daemon=True).start()
+        started.append(url)
+    
+    if started:
+        with _resource_cache_lock:
+            _resource_cache_stats['speculative_fetches'] += len(started)
+    return started
+
+def _reset_prefetch_after_fork():
+    """Prefetch threads don't survive fork; the child starts its own on first use"""
+    global _prefetch_queue, _prefetch_lock, _resource_cache_lock
+    _prefetch_queue = queue.PriorityQueue()
+    _prefetch_pending.clear()
+    _prefetch_workers.clear()
+    _prefetch_lock = threading.Lock()
+    _resource_cache_lock = threading.Lock()
+    _resource_inflight.clear()
+
+os.register_at_fork(after_in_child=_reset_prefetch_after_fork)
 
 # =============================================================== #
 # Util Functions
 # =============================================================== #
 
+# Onboarded users by phone number: phone_number -> (user row, cached_at).
+# Users mid-onboarding are never cached, since another worker may move them to the next gate.
+_user_records = {}
+_user_records_lock = threading.Lock()
+
+def is_onboarded_user(user: dict) -> bool:
+    """Whether a users row has passed every onboarding gate (same rules as check_onboarding_gates)"""
+    state = user.get('onboarding_state')
+    if state == 'complete':
+        return True
+    if state in ('awaiting_email', 'awaiting_name'):
+        return False
+    return bool((user.get('email') or '').strip() and (user.get('name') or '').strip())
+
+def remember_user_record(user: dict):
+    """Cache an onboarded user's row for later lookups by phone number"""
+    if user and user.get('phone_number') and is_onboarded_user(user):
+        with _user_records_lock:
+            _user_records[user['phone_number']] = (user, time.monotonic())
+
+def cached_user_record(phone_number: str):
+    """Return the cached row for an onboarded user, or None"""
+    with _user_records_lock:
+        entry = _user_records.get(phone_number)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] > USER_RECORD_CACHE_TTL_SECONDS:
+            del _user_records[phone_number]
+            return None
+        return entry[0]
+
+def _reset_user_records_after_fork():
+    global _user_records_lock
+    _user_records_lock = threading.Lock()
+    _user_records.clear()
+
+os.register_at_fork(after_in_child=_reset_user_records_after_fork)
+
 def get_user_by_phone_number(phone_number: str):
     """
     Get user information by phone number
     
+    Onboarded users are served from a short-lived in-process cache; everyone
+    else is read from Supabase so onboarding always sees the current gate.
+    
     Args:
         phone_number (str): The phone number to look up
         
     Returns:
         dict: Contains user info and success status
     """
+    user = cached_user_record(phone_number)
+    record_context_fetch('user_record', fetched=user is None)
+    if user is not None:
+        return {
+            'success': True,
+            'phone_number': phone_number,
+            'user_found': True,
+            'user_info': user
+        }
+    
     try:
-        print(f"🔍 Looking up user by phone number: {phone_number}")
+        log_verbose("🔍 Looking up user by phone number: %s", phone_number)
         
         user_response = supabase.table('users') \
             .select('id, email, phone_number, name, onboarding_state') \
@@ -223,7 +1581,7 @@ def get_user_by_phone_number(phone_number: str):
             .execute()
         
         if not user_response.data:
-            print(f"❌ No user found with phone number: {phone_number}")
+            log_verbose("❌ No user found with phone number: %s", phone_number)
             return {
                 'success': False,
                 'error': 'User not found',
@@ -234,8 +1592,9 @@ def get_user_by_phone_number(phone_number: str):
         
         user = user_response.data[0]
         user_email = user.get('email', 'No email')
+        remember_user_record(user)
         
-        print(f"✅ Found user: {user_email} (ID: {user['id'][:8]}...)")
+        log_verbose("✅ Found user: %s (ID: %.8s...)", user_email, user['id'])
         
         return {
             'success': True,
@@ -244,8 +1603,10 @@ def get_user_by_phone_number(phone_number: str):
             'user_info': user
         }
         
+    except CircuitOpenError:
+        raise  # Not 'user not found': callers would treat an existing user as new
     except Exception as e:
-        print(f"💥 Error looking up user by phone number {phone_number}: {e}")
+        log_error("💥 Error looking up user by phone number %s: %s", phone_number, e)
         return {
             'success': False,
             'error': str(e),
@@ -289,12 +1650,12 @@ def check_onboarding_gates(phone_number: str) -> dict:
         }
     """
     try:
-        print(f"🚪 Checking onboarding gates for {phone_number}")
+        log_always("🚪 Checking onboarding gates for %s", phone_number)
         
         user_lookup = get_user_by_phone_number(phone_number)
         
         if not user_lookup['success'] or not user_lookup['user_found']:
-            print(f"🆕 New user - needs registration")
+            log_always("🆕 New user - needs registration")
             return {
                 'user_exists': False,
                 'user_info': None,
@@ -308,7 +1669,7 @@ def check_onboarding_gates(phone_number: str) -> dict:
         email = user_info.get('email')
         name = user_info.get('name')
         
-        print(f"📊 User state: onboarding_state='{onboarding_state}', email='{email}', name='{name}'")
+        log_always("📊 User state: onboarding_state='%s', email='%s', name='%s'", onboarding_state, email, name)
         
         # Determine next gate based on current state
         if onboarding_state is None:
@@ -343,7 +1704,7 @@ def check_onboarding_gates(phone_number: str) -> dict:
                 next_gate = 'complete'
                 complete = True
         
-        print(f"🎯 Next gate: {next_gate}, Complete: {complete}")
+        log_always("🎯 Next gate: %s, Complete: %s", next_gate, complete)
         
         return {
             'user_exists': True,
@@ -353,8 +1714,10 @@ def check_onboarding_gates(phone_number: str) -> dict:
             'current_state': onboarding_state
         }
         
+    except CircuitOpenError:
+        raise  # sms_reply answers with the fallback text instead of a registration gate
     except Exception as e:
-        print(f"💥 Error checking onboarding gates: {e}")
+        log_error("💥 Error checking onboarding gates: %s", e)
         return {
             'user_exists': False,
             'user_info': None,
@@ -375,7 +1738,7 @@ def create_new_user(phone_number: str) -> dict:
         dict: Contains success status and user info
     """
     try:
-        print(f"👤 Creating new user for {phone_number}")
+        log_always("👤 Creating new user for %s", phone_number)
         
         # Create new user with minimal info
         new_user_data = {
@@ -389,7 +1752,7 @@ def create_new_user(phone_number: str) -> dict:
         
         if response.data:
             user = response.data[0]
-            print(f"✅ Created new user: {user['id'][:8]}... for {phone_number}")
+            log_always("✅ Created new user: %s... for %s", user['id'][:8], phone_number)
             
             return {
                 'success': True,
@@ -397,15 +1760,17 @@ def create_new_user(phone_number: str) -> dict:
                 'message': 'User created successfully'
             }
         else:
-            print(f"❌ Failed to create user for {phone_number}")
+            log_error("❌ Failed to create user for %s", phone_number)
             return {
                 'success': False,
                 'error': 'Failed to create user in database'
             }
             
+    except CircuitOpenError:
+        raise
     except Exception as e:
         error_message = str(e)
-        print(f"💥 Error creating user for {phone_number}: {error_message}")
+        log_error("💥 Error creating user for %s: %s", phone_number, error_message)
         
         # Provide more specific error messages for common constraint violations
         if "users_email_key" in error_message:
@@ -436,7 +1801,7 @@ def update_user_email(user_id: str, email: str) -> dict:
         dict: Contains success status and updated user info
     """
     try:
-        print(f"📧 Updating email for user {user_id[:8]}... to {email}")
+        log_always("📧 Updating email for user %s... to %s", user_id[:8], email)
         
         response = supabase.table('users') \
             .update({
@@ -448,7 +1813,7 @@ def update_user_email(user_id: str, email: str) -> dict:
         
         if response.data:
             user = response.data[0]
-            print(f"✅ Updated email for user {user_id[:8]}...")
+            log_always("✅ Updated email for user %s...", user_id[:8])
             
             return {
                 'success': True,
@@ -456,14 +1821,16 @@ def update_user_email(user_id: str, email: str) -> dict:
                 'message': 'Email updated successfully'
             }
         else:
-            print(f"❌ Failed to update email for user {user_id[:8]}...")
+            log_error("❌ Failed to update email for user %s...", user_id[:8])
             return {
                 'success': False,
                 'error': 'Failed to update email in database'
             }
             
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        print(f"💥 Error updating email for user {user_id[:8]}...: {e}")
+        log_error("💥 Error updating email for user %s...: %s", user_id[:8], e)
         return {
             'success': False,
             'error': str(e)
@@ -481,7 +1848,7 @@ def update_user_name(user_id: str, name: str) -> dict:
         dict: Contains success status and updated user info
     """
     try:
-        print(f"👤 Updating name for user {user_id[:8]}... to {name}")
+        log_always("👤 Updating name for user %s... to %s", user_id[:8], name)
         
         response = supabase.table('users') \
             .update({
@@ -493,7 +1860,8 @@ def update_user_name(user_id: str, name: str) -> dict:
         
         if response.data:
             user = response.data[0]
-            print(f"✅ Updated name for user {user_id[:8]}... - Onboarding complete!")
+            remember_user_record(user)  # Their first real message skips the lookup
+            log_always("✅ Updated name for user %s... - Onboarding complete!", user_id[:8])
             
             return {
                 'success': True,
@@ -501,14 +1869,16 @@ def update_user_name(user_id: str, name: str) -> dict:
                 'message': 'Name updated successfully, onboarding complete'
             }
         else:
-            print(f"❌ Failed to update name for user {user_id[:8]}...")
+            log_error("❌ Failed to update name for user %s...", user_id[:8])
             return {
                 'success': False,
                 'error': 'Failed to update name in database'
             }
             
+    except CircuitOpenError:
+        raise
     except Exception as e:
-        print(f"💥 Error updating name for user {user_id[:8]}...: {e}")
+        log_error("💥 Error updating name for user %s...: %s", user_id[:8], e)
         return {
             'success': False,
             'error': str(e)
@@ -527,11 +1897,11 @@ def handle_onboarding_flow(incoming_msg: str, sender_number: str, gate_status: d
         next_gate = gate_status['next_gate']
         user_info = gate_status.get('user_info')
         
-        print(f"🚪 Handling onboarding gate: {next_gate}")
+        log_always("🚪 Handling onboarding gate: %s", next_gate)
         
         if next_gate == 'registration':
             # Gate #1: New user registration
-            print("🆕 Gate #1: New user registration")
+            log_always("🆕 Gate #1: New user registration")
             
             # Create new user
             result = create_new_user(sender_number)
@@ -546,18 +1916,18 @@ def handle_onboarding_flow(incoming_msg: str, sender_number: str, gate_status: d
                 send_sms(welcome_msg2, sender_number) 
                 send_result = send_sms(welcome_msg3, sender_number)
                 if send_result['success']:
-                    print("✅ Welcome messages sent successfully")
+                    log_always("✅ Welcome messages sent successfully")
                 else:
-                    print(f"❌ Failed to send welcome message: {send_result}")
+                    log_error("❌ Failed to send welcome message: %s", send_result)
             else:
                 # Send error message
                 error_msg = "oof something went wrong setting up your account 😅 try again?"
                 send_sms(error_msg, sender_number)
-                print(f"❌ Failed to create user: {result}")
+                log_error("❌ Failed to create user: %s", result)
         
         elif next_gate == 'email':
             # Gate #2: Email collection
-            print("📧 Gate #2: Email collection")
+            log_always("📧 Gate #2: Email collection")
             
             # Validate email format
             if validate_email_format(incoming_msg):
@@ -571,27 +1941,27 @@ def handle_onboarding_flow(incoming_msg: str, sender_number: str, gate_status: d
                     
                     send_result = send_sms(name_request_msg, sender_number)
                     if send_result['success']:
-                        print("✅ Name request sent successfully")
+                        log_always("✅ Name request sent successfully")
                     else:
-                        print(f"❌ Failed to send name request: {send_result}")
+                        log_error("❌ Failed to send name request: %s", send_result)
                 else:
                     # Send error message
                     error_msg = "hmm something went wrong saving that email 🤔 try again?"
                     send_sms(error_msg, sender_number)
-                    print(f"❌ Failed to update email: {result}")
+                    log_error("❌ Failed to update email: %s", result)
             else:
                 # Invalid email format
                 invalid_email_msg = "that email looks a bit off 📧 can you send it again? (like you@gmail.com)"
                 
                 send_result = send_sms(invalid_email_msg, sender_number)
                 if send_result['success']:
-                    print("✅ Invalid email message sent successfully")
+                    log_always("✅ Invalid email message sent successfully")
                 else:
-                    print(f"❌ Failed to send invalid email message: {send_result}")
+                    log_error("❌ Failed to send invalid email message: %s", send_result)
         
         elif next_gate == 'name':
             # Gate #3: Name collection
-            print("👤 Gate #3: Name collection")
+            log_always("👤 Gate #3: Name collection")
             
             # Any non-empty string is valid for name
             name = incoming_msg.strip()
@@ -611,32 +1981,83 @@ def handle_onboarding_flow(incoming_msg: str, sender_number: str, gate_status: d
                     send_sms(completion_msg3, sender_number)
                     send_result = send_sms(completion_msg4, sender_number)
                     if send_result['success']:
-                        print("✅ Onboarding completion messages sent successfully")
+                        log_always("✅ Onboarding completion messages sent successfully")
                     else:
-                        print(f"❌ Failed to send completion message: {send_result}")
+                        log_error("❌ Failed to send completion message: %s", send_result)
                 else:
                     # Send error message
                     error_msg = "hmm couldn't save that name 😅 try again?"
                     send_sms(error_msg, sender_number)
-                    print(f"❌ Failed to update name: {result}")
+                    log_error("❌ Failed to update name: %s", result)
             else:
                 # Empty name
                 empty_name_msg = "what should I call you? 😊"
                 
                 send_result = send_sms(empty_name_msg, sender_number)
                 if send_result['success']:
-                    print("✅ Empty name message sent successfully")
+                    log_always("✅ Empty name message sent successfully")
                 else:
-                    print(f"❌ Failed to send empty name message: {send_result}")
+                    log_error("❌ Failed to send empty name message: %s", send_result)
+        
+        else:
+            log_always("❓ Unknown gate: %s", next_gate)
+            
+    except CircuitOpenError:
+        raise  # sms_reply answers with the fallback text
+    except Exception as e:
+        log_error("💥 Error in handle_onboarding_flow: %s", e)
+        # Send generic error message
+        error_msg = "oops something went wrong 😅 try again?"
+        send_sms(error_msg, sender_number)
+
+def format_summary_rows(summaries: list) -> dict:
+    """
+    Format raw `summaries` rows into the shape used by the agent pipelines
+    
+    Args:
+        summaries (list): Rows from the summaries table, newest first
+        
+    Returns:
+        dict: Contains formatted summaries, unprocessed summaries and combined text
+    """
+    formatted_summaries = []
+    unprocessed_summaries = []
+    all_summaries_text = ""
+    
+    for summary in summaries:
+        # Extract summary text content
+        summary_text = ""
+        if summary.get('summary'):
+            if isinstance(summary['summary'], list):
+                for item in summary['summary']:
+                    if isinstance(item, dict) and 'text' in item:
+                        summary_text += item['text']
+            elif isinstance(summary['summary'], str):
+                summary_text = summary['summary']
+        
+        formatted_summary = {
+            'id': summary['id'],
+            'prompt_generated_at': summary.get('prompt_generated_at'),
+            'summary_text': summary_text,
+            'cohere_finish_reason': summary.get('cohere_finish_reason'),
+            'cohere_usage': summary.get('cohere_usage'),
+            'source_activity_count': len(summary.get('source_activity_ids') or []),
+            'processed': summary.get('processed', False)
+        }
         
-        else:
-            print(f"❓ Unknown gate: {next_gate}")
-            
-    except Exception as e:
-        print(f"💥 Error in handle_onboarding_flow: {e}")
-        # Send generic error message
-        error_msg = "oops something went wrong 😅 try again?"
-        send_sms(error_msg, sender_number)
+        formatted_summaries.append(formatted_summary)
+        
+        # Track unprocessed summaries separately
+        if not summary.get('processed', False):
+            unprocessed_summaries.append(formatted_summary)
+        
+        all_summaries_text += f"\n\n--- Summary from {summary.get('prompt_generated_at', 'Unknown time')} ---\n{summary_text}"
+    
+    return {
+        'summaries': formatted_summaries,
+        'unprocessed_summaries': unprocessed_summaries,
+        'combined_summaries_text': all_summaries_text
+    }
 
 def get_user_summaries_between_dates(user_id: str, start_timestamp: str, end_timestamp: str, only_unprocessed: bool = True):
     """
@@ -652,8 +2073,8 @@ def get_user_summaries_between_dates(user_id: str, start_timestamp: str, end_tim
         dict: Contains user info, summaries, and metadata
     """
     try:
-        print(f"📊 Fetching summaries for user {user_id[:8]}...")
-        print(f"📅 Time range: {start_timestamp} to {end_timestamp}")
+        log_always("📊 Fetching summaries for user %s...", user_id[:8])
+        log_always("📅 Time range: %s to %s", start_timestamp, end_timestamp)
         
         # Get user info
         user_response = supabase.table('users') \
@@ -662,7 +2083,7 @@ def get_user_summaries_between_dates(user_id: str, start_timestamp: str, end_tim
             .execute()
         
         if not user_response.data:
-            print(f"❌ No user found with ID: {user_id}")
+            log_error("❌ No user found with ID: %s", user_id)
             return {
                 'success': False,
                 'error': 'User not found',
@@ -676,7 +2097,7 @@ def get_user_summaries_between_dates(user_id: str, start_timestamp: str, end_tim
         user_email = user.get('email', 'No email')
         user_phone = user.get('phone_number', 'No phone')
         
-        print(f"✅ Found user: {user_email} (ID: {user_id[:8]}...)")
+        log_always("✅ Found user: %s (ID: %s...)", user_email, user_id[:8])
         
         # Fetch summaries for this user within the specified time range
         summaries_response = supabase.table('summaries') \
@@ -688,7 +2109,7 @@ def get_user_summaries_between_dates(user_id: str, start_timestamp: str, end_tim
             .execute()
         
         if summaries_response.data is None:
-            print(f"❌ Error fetching summaries for user {user_email}")
+            log_error("❌ Error fetching summaries for user %s", user_email)
             return {
                 'success': False,
                 'error': 'Error fetching summaries',
@@ -702,41 +2123,9 @@ def get_user_summaries_between_dates(user_id: str, start_timestamp: str, end_tim
         summaries = summaries_response.data
         summaries_count = len(summaries)
         
-        print(f"📈 Found {summaries_count} summaries for {user_email} in specified time range")
-        
-        # Format summaries for easy use
-        formatted_summaries = []
-        unprocessed_summaries = []
-        all_summaries_text = ""
-        
-        for summary in summaries:
-            # Extract summary text content
-            summary_text = ""
-            if summary.get('summary'):
-                if isinstance(summary['summary'], list):
-                    for item in summary['summary']:
-                        if isinstance(item, dict) and 'text' in item:
-                            summary_text += item['text']
-                elif isinstance(summary['summary'], str):
-                    summary_text = summary['summary']
-            
-            formatted_summary = {
-                'id': summary['id'],
-                'prompt_generated_at': summary.get('prompt_generated_at'),
-                'summary_text': summary_text,
-                'cohere_finish_reason': summary.get('cohere_finish_reason'),
-                'cohere_usage': summary.get('cohere_usage'),
-                'source_activity_count': len(summary.get('source_activity_ids', [])),
-                'processed': summary.get('processed', False)
-            }
-            
-            formatted_summaries.append(formatted_summary)
-            
-            # Track unprocessed summaries separately
-            if not summary.get('processed', False):
-                unprocessed_summaries.append(formatted_summary)
-            
-            all_summaries_text += f"\n\n--- Summary from {summary.get('prompt_generated_at', 'Unknown time')} ---\n{summary_text}"
+        log_always("📈 Found %s summaries for %s in specified time range", summaries_count, user_email)
+        
+        formatted = format_summary_rows(summaries)
         
         return {
             'success': True,
@@ -744,15 +2133,15 @@ def get_user_summaries_between_dates(user_id: str, start_timestamp: str, end_tim
             'user_found': True,
             'user_info': user,
             'summaries_count': summaries_count,
-            'unprocessed_count': len(unprocessed_summaries),
-            'summaries': formatted_summaries,
-            'unprocessed_summaries': unprocessed_summaries,
-            'combined_summaries_text': all_summaries_text,
+            'unprocessed_count': len(formatted['unprocessed_summaries']),
+            'summaries': formatted['summaries'],
+            'unprocessed_summaries': formatted['unprocessed_summaries'],
+            'combined_summaries_text': formatted['combined_summaries_text'],
             'time_range': f"{start_timestamp} to {end_timestamp}"
         }
         
     except Exception as e:
-        print(f"💥 Error fetching user summaries for {user_id}: {e}")
+        log_error("💥 Error fetching user summaries for %s: %s", user_id, e)
         return {
             'success': False,
             'error': str(e),
@@ -762,6 +2151,380 @@ def get_user_summaries_between_dates(user_id: str, start_timestamp: str, end_tim
             'summaries': []
         }
 
+def get_summaries_for_users_between_dates(users: list, start_timestamp: str, end_timestamp: str, since: dict = None):
+    """
+    Retrieve summaries for a page of users with a single query
+    
+    The caller already holds the `users` rows, so no per-user lookup is done.
+    The query is read in SUMMARY_FETCH_PAGE_ROWS pages with .range() so the
+    PostgREST max-rows cap cannot silently drop the oldest rows. Rows are
+    grouped locally by user_id and returned in the same shape as
+    get_user_summaries_between_dates().
+    
+    Args:
+        users (list): User rows (id, email, phone_number) for the current page
+        start_timestamp (str): Start time in ISO format (inclusive)
+        end_timestamp (str): End time in ISO format (inclusive)
+        since (dict): Optional user_id -> ISO timestamp cursor; users listed here only
+            get rows at or after their cursor instead of the whole window (rows sharing
+            the cursor timestamp come back again and are deduplicated by id)
+        
+    Returns:
+        dict: Maps user_id to that user's summaries result
+    """
+    user_ids = [u['id'] for u in users]
+    if not user_ids:
+        return {}
+    
+    try:
+        log_verbose("📊 Batch fetching summaries for %s users (%s to %s)", len(user_ids), start_timestamp, end_timestamp)
+        
+        or_filter = None
+        if since:
+            # One OR branch per user with a cursor, one shared branch for cold users
+            cold_ids = [user_id for user_id in user_ids if not since.get(user_id)]
+            branches = [
+                f'and(user_id.eq.{user_id},prompt_generated_at.gte."{since[user_id]}")'
+                for user_id in user_ids if since.get(user_id)
+            ]
+            if cold_ids:
+                branches.append(f"user_id.in.({','.join(cold_ids)})")
+            or_filter = ','.join(branches)
+        
+        rows, seen_ids, pages, error = [], set(), 0, None
+        while True:
+            query = supabase.table('summaries') \
+                .select(SUMMARY_BATCH_COLUMNS) \
+                .in_('user_id', user_ids) \
+                .gte('prompt_generated_at', start_timestamp) \
+                .lte('prompt_generated_at', end_timestamp)
+            if or_filter:
+                query = query.or_(or_filter)
+            
+            offset = pages * SUMMARY_FETCH_PAGE_ROWS
+            summaries_response = query \
+                .order('prompt_generated_at', desc=True) \
+                .order('id', desc=True) \
+                .range(offset, offset + SUMMARY_FETCH_PAGE_ROWS - 1) \
+                .execute()
+            pages += 1
+            
+            if summaries_response.data is None:
+                error = 'Error fetching summaries'
+                break
+            for row in summaries_response.data:
+                if row['id'] not in seen_ids:  # Rows inserted mid-read shift later pages
+                    seen_ids.add(row['id'])
+                    rows.append(row)
+            if len(summaries_response.data) < SUMMARY_FETCH_PAGE_ROWS:
+                break
+        
+        if pages > 1:
+            log_always("📚 Summaries for %s users hit the %s-row page cap, read %s rows in %s pages", len(user_ids), SUMMARY_FETCH_PAGE_ROWS, len(rows), pages)
+        if error:
+            rows = None
+    except Exception as e:
+        log_error("💥 Error batch fetching summaries for %s users: %s", len(user_ids), e)
+        rows = None
+        error = str(e)
+    
+    # Group rows by user, preserving the newest-first ordering of the query
+    rows_by_user = {user_id: [] for user_id in user_ids}
+    for row in rows or []:
+        rows_by_user.setdefault(row['user_id'], []).append(row)
+    
+    results = {}
+    for user in users:
+        user_id = user['id']
+        if error:
+            results[user_id] = {
+                'success': False,
+                'error': error,
+                'user_id': user_id,
+                'user_found': True,
+                'user_info': user,
+                'summaries_count': 0,
+                'summaries': []
+            }
+            continue
+        
+        formatted = format_summary_rows(rows_by_user[user_id])
+        results[user_id] = {
+            'success': True,
+            'user_id': user_id,
+            'user_found': True,
+            'user_info': user,
+            'summaries_count': len(formatted['summaries']),
+            'unprocessed_count': len(formatted['unprocessed_summaries']),
+            'summaries': formatted['summaries'],
+            'unprocessed_summaries': formatted['unprocessed_summaries'],
+            'combined_summaries_text': formatted['combined_summaries_text'],
+            'time_range': f"{start_timestamp} to {end_timestamp}"
+        }
+    
+    log_verbose("📈 Batch fetch returned %s summaries for %s users", len(rows or []), len(user_ids))
+    return results
+
+# Per-user summary watermarks: user_id -> {
+#     'cursor_at', 'cursor_id': newest prompt_generated_at / id seen,
+#     'entries': {summary_id: formatted summary} inside the current window,
+#     'processed_digest', 'processed_summaries_text': cached already-processed context
+# }
+_summary_watermarks = {}
+_summary_watermarks_lock = threading.Lock()
+
+def build_summary_context_texts(summaries: list) -> dict:
+    """
+    Split formatted summaries into the NEW / PROCESSED prompt sections
+    
+    Args:
+        summaries (list): Formatted summaries, newest first
+        
+    Returns:
+        dict: Contains 'new_summaries_text' and 'processed_summaries_text'
+    """
+    new_summaries_text = ""
+    processed_summaries_text = ""
+    
+    for summary in summaries:
+        summary_text = summary.get('summary_text', '')
+        timestamp = summary.get('prompt_generated_at', 'Unknown time')
+        
+        if summary.get('processed', False):
+            processed_summaries_text += f"\n\n--- PROCESSED Summary from {timestamp} ---\n{summary_text}"
+        else:
+            new_summaries_text += f"\n\n--- NEW Summary from {timestamp} ---\n{summary_text}"
+    
+    return {
+        'new_summaries_text': new_summaries_text,
+        'processed_summaries_text': processed_summaries_text
+    }
+
+def _refresh_watermark_result(user: dict, state: dict, start_timestamp: str, end_timestamp: str, new_rows_count: int) -> dict:
+    """Prune a watermark state to the window and build the summaries result from it (caller holds the lock)"""
+    import hashlib
+    
+    # Drop entries that have aged out of the window
+    for summary_id, summary in list(state['entries'].items()):
+        if (summary.get('prompt_generated_at') or '') < start_timestamp:
+            del state['entries'][summary_id]
+    
+    summaries = sorted(
+        state['entries'].values(),
+        key=lambda s: (s.get('prompt_generated_at') or '', s['id']),
+        reverse=True
+    )
+    unprocessed_summaries = [s for s in summaries if not s.get('processed', False)]
+    processed_summaries = [s for s in summaries if s.get('processed', False)]
+    
+    # Rebuild the processed context only when the processed set actually changed
+    processed_digest = hashlib.sha1(
+        '|'.join(s['id'] for s in processed_summaries).encode('utf-8')
+    ).hexdigest()
+    if processed_digest != state.get('processed_digest'):
+        state['processed_digest'] = processed_digest
+        state['processed_summaries_text'] = build_summary_context_texts(processed_summaries)['processed_summaries_text']
+    
+    combined_summaries_text = ""
+    for summary in summaries:
+        combined_summaries_text += f"\n\n--- Summary from {summary.get('prompt_generated_at', 'Unknown time')} ---\n{summary['summary_text']}"
+    
+    return {
+        'success': True,
+        'user_id': user['id'],
+        'user_found': True,
+        'user_info': user,
+        'summaries_count': len(summaries),
+        'unprocessed_count': len(unprocessed_summaries),
+        'new_rows_count': new_rows_count,
+        'summaries': summaries,
+        'unprocessed_summaries': unprocessed_summaries,
+        'combined_summaries_text': combined_summaries_text,
+        'processed_summaries_text': state['processed_summaries_text'],
+        'processed_digest': state['processed_digest'],
+        'time_range': f"{start_timestamp} to {end_timestamp}"
+    }
+
+def _refresh_cached_processed_flags(user_ids: list) -> list:
+    """
+    Re-read the processed flag of every cached unprocessed summary for these users
+    
+    Another worker (or process) may have marked them processed since we cached
+    them; trusting the in-process copy would text the user about them again.
+    Rows that no longer exist are dropped from the cache.
+    
+    Args:
+        user_ids (list): Users whose watermark state is reused this cycle
+        
+    Returns:
+        list: User IDs whose state could not be refreshed (caller refetches them cold)
+    """
+    with _summary_watermarks_lock:
+        owners = {
+            summary_id: user_id
+            for user_id in user_ids
+            for summary_id, summary in _summary_watermarks[user_id]['entries'].items()
+            if not summary.get('processed', False)
+        }
+    if not owners:
+        return []
+    
+    summary_ids = list(owners)
+    processed_by_id = {}
+    try:
+        for offset in range(0, len(summary_ids), SUMMARY_PROCESSED_REFRESH_CHUNK):
+            response = supabase.table('summaries') \
+                .select('id, processed') \
+                .in_('id', summary_ids[offset:offset + SUMMARY_PROCESSED_REFRESH_CHUNK]) \
+                .execute()
+            for row in response.data or []:
+                processed_by_id[row['id']] = bool(row.get('processed'))
+    except Exception as e:
+        log_warning("⚠️ Could not refresh processed flags for %s cached summaries, refetching: %s", len(summary_ids), e)
+        return list(set(owners.values()))
+    
+    flipped = 0
+    with _summary_watermarks_lock:
+        for summary_id, user_id in owners.items():
+            entries = _summary_watermarks[user_id]['entries']
+            if summary_id not in entries:
+                continue
+            if summary_id not in processed_by_id:
+                del entries[summary_id]
+            elif processed_by_id[summary_id]:
+                entries[summary_id] = {**entries[summary_id], 'processed': True}
+                flipped += 1
+    if flipped:
+        log_verbose("🔖 %s cached summaries were processed elsewhere since the last cycle", flipped)
+    return []
+
+def get_incremental_summaries_for_users(users: list, start_timestamp: str, end_timestamp: str):
+    """
+    Retrieve a page of users' summaries, transferring only rows newer than each user's watermark
+    
+    Users seen in a previous cycle are queried from their last seen
+    prompt_generated_at onwards; everything older is served from the
+    in-process cache. A user with nothing new costs no summary bodies, only
+    a re-read of the processed flag of their cached unprocessed rows.
+    
+    Args:
+        users (list): User rows (id, email, phone_number) for the current page
+        start_timestamp (str): Start time in ISO format (inclusive)
+        end_timestamp (str): End time in ISO format (inclusive)
+        
+    Returns:
+        dict: Maps user_id to that user's summaries result
+    """
+    with _summary_watermarks_lock:
+        since = {
+            u['id']: _summary_watermarks[u['id']]['cursor_at']
+            for u in users
+            if u['id'] in _summary_watermarks and _summary_watermarks[u['id']]['cursor_at'] >= start_timestamp
+        }
+    
+    for user_id in _refresh_cached_processed_flags(list(since)):
+        del since[user_id]
+    
+    fetched = get_summaries_for_users_between_dates(users, start_timestamp, end_timestamp, since=since)
+    
+    results = {}
+    with _summary_watermarks_lock:
+        for user in users:
+            user_id = user['id']
+            page_result = fetched.get(user_id)
+            if not page_result or not page_result['success']:
+                results[user_id] = page_result
+                continue
+            
+            if user_id not in since:
+                # Cold user or cursor fell out of the window - start from the full window
+                _summary_watermarks[user_id] = {
+                    'cursor_at': start_timestamp,
+                    'cursor_id': None,
+                    'entries': {},
+                    'processed_digest': None,
+                    'processed_summaries_text': ''
+                }
+            state = _summary_watermarks[user_id]
+            
+            new_rows_count = 0
+            for summary in page_result['summaries']:
+                if summary['id'] in state['entries']:
+                    continue  # Already cached (e.g. refetched after a cursor reset)
+                state['entries'][summary['id']] = summary
+                new_rows_count += 1
+                summary_at = summary.get('prompt_generated_at') or ''
+                if (summary_at, summary['id']) > (state['cursor_at'], state['cursor_id'] or ''):
+                    state['cursor_at'] = summary_at
+                    state['cursor_id'] = summary['id']
+            
+            results[user_id] = _refresh_watermark_result(user, state, start_timestamp, end_timestamp, new_rows_count)
+    
+    users_with_new_rows = len([r for r in results.values() if r and r.get('new_rows_count', 0) > 0])
+    log_verbose("🔖 Watermark fetch: %s/%s users have new summaries", users_with_new_rows, len(users))
+    return results
+
+def mark_watermark_summaries_processed(user_id: str, summary_ids: list):
+    """
+    Flip cached summaries to processed after they were marked in the database
+    
+    Args:
+        user_id (str): The user the summaries belong to
+        summary_ids (list): IDs that were just marked processed
+    """
+    with _summary_watermarks_lock:
+        state = _summary_watermarks.get(user_id)
+        if not state:
+            return
+        for summary_id in summary_ids:
+            if summary_id in state['entries']:
+                state['entries'][summary_id] = {**state['entries'][summary_id], 'processed': True}
+
+def format_twilio_message(msg) -> dict:
+    """Convert a Twilio MessageInstance into the plain dict used in message histories"""
+    return {
+        'sid': msg.sid,
+        'from': msg.from_,
+        'to': msg.to,
+        'body': msg.body,
+        'direction': msg.direction,
+        'status': msg.status,
+        'date_created': msg.date_created.isoformat() if msg.date_created else None,
+        'date_sent': msg.date_sent.isoformat() if msg.date_sent else None,
+        'num_media': msg.num_media
+    }
+
+def build_message_history_result(phone_number: str, formatted_history: list) -> dict:
+    """
+    Wrap formatted messages (newest first) in the get_message_history() result shape
+    
+    Args:
+        phone_number (str): The counterpart phone number
+        formatted_history (list): Messages from format_twilio_message(), newest first
+        
+    Returns:
+        dict: Contains message history and metadata
+    """
+    # Create a summary of the conversation
+    inbound_count = len([m for m in formatted_history if m['direction'] == 'inbound'])
+    outbound_count = len([m for m in formatted_history if m['direction'] in ['outbound-api', 'outbound-call']])
+    
+    return {
+        'success': True,
+        'phone_number': phone_number,
+        'total_messages': len(formatted_history),
+        'inbound_messages': inbound_count,
+        'outbound_messages': outbound_count,
+        'messages': formatted_history,
+        'conversation_summary': {
+            'total_messages': len(formatted_history),
+            'inbound_count': inbound_count,
+            'outbound_count': outbound_count,
+            'last_message_date': formatted_history[0]['date_created'] if formatted_history else None,
+            'first_message_date': formatted_history[-1]['date_created'] if formatted_history else None
+        }
+    }
+
 def get_message_history(phone_number: str, limit: int = 50):
     """
     Retrieve previous messages with a specific phone number
@@ -774,19 +2537,21 @@ def get_message_history(phone_number: str, limit: int = 50):
         dict: Contains message history and metadata
     """
     try:
-        print(f"📞 Fetching message history for {phone_number} (limit: {limit})")
+        log_always("📞 Fetching message history for %s (limit: %s)", phone_number, limit)
         
         # Get messages where this number was either the sender OR recipient
         # We need to check both directions since messages can go both ways
-        messages_from = twilio_client.messages.list(
-            from_=phone_number,
-            limit=limit
-        )
+        with timed_call('twilio', 'messages.list'):
+            messages_from = twilio_client.messages.list(
+                from_=phone_number,
+                limit=limit
+            )
         
-        messages_to = twilio_client.messages.list(
-            to=phone_number,
-            limit=limit
-        )
+        with timed_call('twilio', 'messages.list'):
+            messages_to = twilio_client.messages.list(
+                to=phone_number,
+                limit=limit
+            )
         
         # Combine and sort messages by date (most recent first)
         all_messages = messages_from + messages_to
@@ -803,108 +2568,357 @@ def get_message_history(phone_number: str, limit: int = 50):
         )[:limit]  # Take only the requested limit after sorting
         
         # Format message history for easy use
-        formatted_history = []
-        for msg in sorted_messages:
-            formatted_msg = {
-                'sid': msg.sid,
-                'from': msg.from_,
-                'to': msg.to,
-                'body': msg.body,
-                'direction': msg.direction,
-                'status': msg.status,
-                'date_created': msg.date_created.isoformat() if msg.date_created else None,
-                'date_sent': msg.date_sent.isoformat() if msg.date_sent else None,
-                'num_media': msg.num_media
-            }
-            formatted_history.append(formatted_msg)
+        formatted_history = [format_twilio_message(msg) for msg in sorted_messages]
         
-        print(f"📊 Found {len(formatted_history)} messages in history with {phone_number}")
+        log_always("📊 Found %s messages in history with %s", len(formatted_history), phone_number)
         
-        # Create a summary of the conversation
-        inbound_count = len([m for m in formatted_history if m['direction'] == 'inbound'])
-        outbound_count = len([m for m in formatted_history if m['direction'] in ['outbound-api', 'outbound-call']])
+        return build_message_history_result(phone_number, formatted_history)
         
+    except Exception as e:
+        log_error("💥 Error fetching message history for %s: %s", phone_number, e)
         return {
-            'success': True,
+            'success': False,
+            'error': str(e),
             'phone_number': phone_number,
-            'total_messages': len(formatted_history),
-            'inbound_messages': inbound_count,
-            'outbound_messages': outbound_count,
-            'messages': formatted_history,
-            'conversation_summary': {
-                'total_messages': len(formatted_history),
-                'inbound_count': inbound_count,
-                'outbound_count': outbound_count,
-                'last_message_date': formatted_history[0]['date_created'] if formatted_history else None,
-                'first_message_date': formatted_history[-1]['date_created'] if formatted_history else None
-            }
+            'total_messages': 0,
+            'messages': []
+        }
+
+def harvest_message_history(since, page_size: int = 1000) -> dict:
+    """
+    Pull every message for our Twilio number since a point in time in one paginated sweep
+    
+    Messages are partitioned in memory by the counterpart phone number, so the
+    number of Twilio API calls grows with message volume (one per page) rather
+    than with the number of users. Each page fetch is timed on its own, so a
+    long sweep never counts as one slow Twilio call.
+    
+    Args:
+        since (datetime): Only messages sent after this time are harvested
+        page_size (int): Twilio page size for the sweep
+        
+    Returns:
+        dict: Contains success flag, 'partitions' (phone -> messages, newest first)
+              and the number of messages harvested
+    """
+    try:
+        log_verbose("🌾 Harvesting message history for %s since %s", TWILIO_PHONE_NUMBER, since.isoformat())
+        
+        partitions = {}
+        harvested_count = 0
+        page_number = 0
+        page = None
+        while page_number == 0 or page is not None:
+            with timed_call('twilio', 'messages.page'):
+                if page_number == 0:
+                    page = twilio_client.messages.page(date_sent_after=since, page_size=page_size)
+                else:
+                    page = page.next_page()
+                records = list(page) if page is not None else []
+            page_number += 1
+            
+            for msg in records:
+                if msg.from_ == TWILIO_PHONE_NUMBER:
+                    counterpart = msg.to
+                elif msg.to == TWILIO_PHONE_NUMBER:
+                    counterpart = msg.from_
+                else:
+                    continue  # Another number on the same account
+                partitions.setdefault(counterpart, []).append(format_twilio_message(msg))
+                harvested_count += 1
+        
+        for messages in partitions.values():
+            messages.sort(key=lambda m: m['date_created'] or '', reverse=True)
+        
+        log_always("🌾 Harvested %s messages across %s conversations in %s pages", harvested_count, len(partitions), page_number)
+        
+        return {
+            'success': True,
+            'partitions': partitions,
+            'harvested_count': harvested_count,
+            'since': since.isoformat()
         }
         
     except Exception as e:
-        print(f"💥 Error fetching message history for {phone_number}: {e}")
+        log_error("💥 Error harvesting message history: %s", e)
         return {
             'success': False,
             'error': str(e),
-            'phone_number': phone_number,
-            'total_messages': 0,
-            'messages': []
+            'partitions': {},
+            'harvested_count': 0
         }
 
-def create_intelligent_response_prompt(incoming_message: str, sender_number: str, message_history: dict = None, user_summaries: dict = None):
+def get_message_history_from_harvest(harvest: dict, phone_number: str, limit: int = 50) -> dict:
     """
-    Create an intelligent prompt for the Cohere agent to respond to incoming SMS messages
+    Serve one user's message history from a harvest_message_history() partition
+    
+    Falls back to get_message_history() if the harvest itself failed or holds
+    fewer than `limit` messages with this number, so a user who was quiet for
+    most of the harvest window still gets their older conversation.
+    
+    Args:
+        harvest (dict): Result of harvest_message_history()
+        phone_number (str): The phone number to get message history for
+        limit (int): Maximum number of messages to return
+        
+    Returns:
+        dict: Same shape as get_message_history()
+    """
+    if not harvest_covers_history(harvest, phone_number, limit):
+        return get_message_history(phone_number, limit=limit)
+    
+    messages = harvest['partitions'][phone_number][:limit]
+    return build_message_history_result(phone_number, messages)
+
+def harvest_covers_history(harvest: dict, phone_number: str, limit: int) -> bool:
+    """True when a successful harvest_message_history() result holds at least `limit` messages with this number"""
+    return bool(harvest and harvest.get('success') and len(harvest['partitions'].get(phone_number, [])) >= limit)
+
+# Per-process counters for lazily loaded context: name -> {'fetched': int, 'skipped': int}
+_context_fetch_counters = {}
+_context_fetch_counters_lock = threading.Lock()
+
+def record_context_fetch(name: str, fetched: bool):
+    """Count one lazily loaded context source as fetched or skipped"""
+    with _context_fetch_counters_lock:
+        counters = _context_fetch_counters.setdefault(name, {'fetched': 0, 'skipped': 0})
+        counters['fetched' if fetched else 'skipped'] += 1
+
+def get_context_fetch_counters() -> dict:
+    """Return a snapshot of the lazy context fetch counters"""
+    with _context_fetch_counters_lock:
+        return {name: dict(counters) for name, counters in _context_fetch_counters.items()}
+
+class LazyContext:
+    """
+    Expensive context (e.g. Twilio history) that is only fetched when first used
+    
+    Call get() wherever the value is needed and close() once the caller is done;
+    close() counts the source as skipped if nothing ever asked for it.
+    """
+    
+    def __init__(self, name: str, loader):
+        self.name = name
+        self._loader = loader
+        self._loaded = False
+        self._closed = False
+        self._value = None
+        self._lock = threading.Lock()  # Shared across threads for cycle-wide context
+    
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+    
+    def get(self):
+        with self._lock:
+            if not self._loaded:
+                self._value = self._loader()
+                self._loaded = True
+                record_context_fetch(self.name, fetched=True)
+            return self._value
+    
+    def close(self):
+        with self._lock:
+            if not self._loaded and not self._closed:
+                record_context_fetch(self.name, fetched=False)
+            self._closed = True
+
+# Words too common to signal that a summary is relevant to the current text
+RELEVANCE_STOPWORDS = {
+    'what', 'whats', 'when', 'where', 'which', 'that', 'this', 'with', 'from', 'have', 'about',
+    'your', 'you', 'can', 'could', 'would', 'should', 'does', 'did', 'the', 'and', 'for', 'are',
+    'how', 'why', 'who', 'was', 'were', 'been', 'just', 'like', 'some', 'there', 'they', 'them'
+}
+
+def estimate_tokens(text: str) -> int:
+    """
+    Count tokens locally without a tokenizer round trip
+    
+    Approximates a BPE tokenizer: each word costs one token per ~4 characters,
+    each punctuation mark or emoji costs one.
+    """
+    if not text:
+        return 0
+    tokens = 0
+    for piece in re.findall(r'\w+|[^\w\s]', text):
+        tokens += (len(piece) + 3) // 4 if piece[0].isalnum() or piece[0] == '_' else 1
+    return max(1, tokens)
+
+def _truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text so that estimate_tokens() of the result stays within max_tokens"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle] + '...') <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + '...'
+
+def _relevance_words(text: str) -> set:
+    return {w for w in re.findall(r'[a-z0-9]{3,}', (text or '').lower()) if w not in RELEVANCE_STOPWORDS}
+
+def pack_response_context(incoming_message: str, message_history: dict = None, user_summaries: dict = None, token_budget: int = None) -> dict:
+    """
+    Fill a fixed token budget with the most useful context for an inbound text
+    
+    Priority order: the current message, the most recent turns, learning
+    summaries ranked by overlap with the current message (then recency),
+    and finally older turns with whatever budget is left.
     
     Args:
         incoming_message (str): The current SMS message from the user
-        sender_number (str): The phone number of the sender
-        message_history (dict): Previous conversation history with this user
-        user_summaries (dict): User's recent learning summaries
+        message_history (dict): Result of get_message_history()
+        user_summaries (dict): Result of get_user_summaries_between_dates()
+        token_budget (int): Context token budget (defaults to CONTEXT_TOKEN_BUDGET)
         
     Returns:
-        str: Comprehensive prompt for the Cohere agent
+        dict: Contains 'conversation_context', 'learning_context' and a token 'breakdown'
     """
+    budget = token_budget or CONTEXT_TOKEN_BUDGET
+    message_tokens = estimate_tokens(incoming_message)
+    remaining = max(0, budget - message_tokens)
     
-    # Build context sections
-    message_context = ""
-    learning_context = ""
-    conversation_context = ""
+    # Candidate turns, newest first, each rendered once
+    turns = []
+    if message_history and message_history.get('success'):
+        for msg in message_history.get('messages', []):
+            direction = "📤 User" if msg['direction'] == 'inbound' else "📥 Assistant"
+            timestamp = (msg.get('date_created') or 'Unknown time')[:16]  # Just date and time
+            body = _truncate_to_tokens(msg.get('body') or '', CONTEXT_TURN_MAX_TOKENS)
+            turns.append({'timestamp': timestamp, 'direction': direction, 'body': body, 'tokens': estimate_tokens(body) + 8})
+    
+    # Candidate summaries ranked by relevance to the current message, then recency
+    summaries = []
+    if user_summaries and user_summaries.get('success'):
+        message_words = _relevance_words(incoming_message)
+        for position, summary in enumerate(user_summaries.get('summaries', [])):
+            summary_text = summary.get('summary_text') or 'No summary available'
+            overlap = len(message_words & _relevance_words(summary_text))
+            summaries.append({
+                'position': position,
+                'timestamp': (summary.get('prompt_generated_at') or 'Unknown time')[:16],
+                'text': summary_text,
+                'overlap': overlap
+            })
+        summaries.sort(key=lambda s: (-s['overlap'], s['position']))
     
-    # Add message history context
+    included_turns = 0
+    conversation_tokens = 0
+    
+    # 1. Most recent turns
+    for turn in turns[:CONTEXT_RECENT_TURNS]:
+        if turn['tokens'] > remaining:
+            break
+        remaining -= turn['tokens']
+        conversation_tokens += turn['tokens']
+        included_turns += 1
+    
+    # 2. Relevant summaries, truncated to fit the remaining budget
+    included_summaries = []
+    summary_tokens = 0
+    for summary in summaries:
+        if remaining < CONTEXT_MIN_SUMMARY_TOKENS:
+            break
+        text = _truncate_to_tokens(summary['text'], min(remaining - 8, CONTEXT_SUMMARY_MAX_TOKENS))
+        cost = estimate_tokens(text) + 8
+        remaining -= cost
+        summary_tokens += cost
+        included_summaries.append({**summary, 'text': text})
+    
+    # 3. Older turns with whatever is left
+    for turn in turns[included_turns:]:
+        if included_turns < CONTEXT_RECENT_TURNS or turn['tokens'] > remaining:
+            break
+        remaining -= turn['tokens']
+        conversation_tokens += turn['tokens']
+        included_turns += 1
+    
+    conversation_context = ""
     if message_history and message_history.get('success'):
-        total_msgs = message_history.get('total_messages', 0)
-        recent_messages = message_history.get('messages', [])
-        
         conversation_context = f"""
             CONVERSATION HISTORY:
-            - Total previous messages with this user: {total_msgs}
+            - Total previous messages with this user: {message_history.get('total_messages', 0)}
             - Inbound messages: {message_history.get('inbound_messages', 0)}
             - Outbound messages: {message_history.get('outbound_messages', 0)}
 
             Recent conversation (most recent first):"""
         
-        for i, msg in enumerate(recent_messages[:10]):  # Last 10 messages for better context
-            direction = "📤 User" if msg['direction'] == 'inbound' else "📥 Assistant"
-            timestamp = msg.get('date_created', 'Unknown time')[:16]  # Just date and time
-            conversation_context += f"\n{i+1}. [{timestamp}] {direction}: {msg['body']}"
+        for i, turn in enumerate(turns[:included_turns]):
+            conversation_context += f"\n{i+1}. [{turn['timestamp']}] {turn['direction']}: {turn['body']}"
     
-    # Add learning context from summaries
+    learning_context = ""
     if user_summaries and user_summaries.get('success'):
-        summaries_count = user_summaries.get('summaries_count', 0)
-        summaries = user_summaries.get('summaries', [])
-        
         learning_context = f"""
         USER'S LEARNING CONTEXT (Past 36 hours):
-        - Total learning summaries available: {summaries_count}
+        - Total learning summaries available: {user_summaries.get('summaries_count', 0)}
 
         Recent Learning Topics and Activities:"""
         
-        for i, summary in enumerate(summaries[:5]):  # Show last 5 summaries for better context
-            timestamp = summary.get('prompt_generated_at', 'Unknown time')[:16]
-            summary_text = summary.get('summary_text', 'No summary available')
-            # Include full summary to preserve URLs and detailed context
-            # This is critical for answering questions about specific websites/resources consulted
-            summary_preview = summary_text[:2000] + '...' if len(summary_text) > 2000 else summary_text
-            learning_context += f"\n{i+1}. [{timestamp}]: {summary_preview}"
+        # Show the packed summaries newest first; full text is kept where it fits so URLs survive
+        for i, summary in enumerate(sorted(included_summaries, key=lambda s: s['position'])):
+            learning_context += f"\n{i+1}. [{summary['timestamp']}]: {summary['text']}"
+    
+    return {
+        'conversation_context': conversation_context,
+        'learning_context': learning_context,
+        'breakdown': {
+            'budget': budget,
+            'current_message': message_tokens,
+            'conversation': conversation_tokens,
+            'summaries': summary_tokens,
+            'total': message_tokens + conversation_tokens + summary_tokens,
+            'turns_included': included_turns,
+            'turns_available': len(turns),
+            'summaries_included': len(included_summaries),
+            'summaries_available': len(summaries)
+        }
+    }
+
+def create_intelligent_response_prompt(incoming_message: str, sender_number: str, message_history: dict = None, user_summaries: dict = None, token_budget: int = None, acknowledgement_sent: str = None):
+    """
+    Create an intelligent prompt for the Cohere agent to respond to incoming SMS messages
+    
+    Args:
+        incoming_message (str): The current SMS message from the user
+        sender_number (str): The phone number of the sender
+        message_history (dict): Previous conversation history with this user
+        user_summaries (dict): User's recent learning summaries
+        token_budget (int): Context token budget (defaults to CONTEXT_TOKEN_BUDGET)
+        acknowledgement_sent (str): Acknowledgement the server already texted, if any;
+            the agent is told to skip its own acknowledgement step
+        
+    Returns:
+        str: Comprehensive prompt for the Cohere agent
+    """
+    
+    # Pack conversation turns and learning summaries into the token budget
+    packed = pack_response_context(incoming_message, message_history, user_summaries, token_budget=token_budget)
+    conversation_context = packed['conversation_context']
+    learning_context = packed['learning_context']
+    
+    breakdown = packed['breakdown']
+    log_always("🧮 Context packed: %s/%s tokens "
+               "(message %s, conversation %s in %s turns, summaries %s in %s summaries)",
+               breakdown['total'], breakdown['budget'], breakdown['current_message'],
+               breakdown['conversation'], breakdown['turns_included'],
+               breakdown['summaries'], breakdown['summaries_included'])
+    
+    # Acknowledgement step: the server may already have texted one
+    if acknowledgement_sent:
+        acknowledgement_step = f"""1. **ALREADY DONE: an acknowledgment was texted for you: "{acknowledgement_sent}"**
+                   - Do NOT send another acknowledgment - go straight to tools or your answer"""
+        video_ack = website_ack = history_ack = "(acknowledgment already sent - skip)"
+    else:
+        acknowledgement_step = """1. **FIRST: Always send_sms an immediate acknowledgment**:
+                   - Link received? → send_sms("got it! checking that out for you 👀")
+                   - Question asked? → send_sms("ooh good question! let me help ✨")
+                   - General message? → send_sms("yo! 👋") """
+        video_ack = 'send_sms("yo checking out that vid for you 📹")'
+        website_ack = 'send_sms("cool! let me check out that site 🌐")'
+        history_ack = 'send_sms("lemme check what you\'ve been studying 📚")'
     
     # Create the comprehensive prompt
     prompt = f"""🚨 CRITICAL: You MUST text back using send_sms. This is a texting conversation - NEVER end without sending SMS responses! 🚨
@@ -935,10 +2949,7 @@ def create_intelligent_response_prompt(incoming_message: str, sender_number: str
 
                 RESPONSE WORKFLOW (MANDATORY):
 
-                1. **FIRST: Always send_sms an immediate acknowledgment**:
-                   - Link received? → send_sms("got it! checking that out for you 👀")
-                   - Question asked? → send_sms("ooh good question! let me help ✨")
-                   - General message? → send_sms("yo! 👋") 
+                {acknowledgement_step}
 
                 2. **THEN: Use tools if needed (YouTube, website, etc.)**
 
@@ -950,7 +2961,7 @@ def create_intelligent_response_prompt(incoming_message: str, sender_number: str
                 MANDATORY EXAMPLES:
 
                 Video request workflow:
-                1. send_sms("yo checking out that vid for you 📹")
+                1. {video_ack}
                 2. get_youtube_transcript(url) 
                 3. send_sms("ok so main point: React hooks let you use state in functions")
                 4. send_sms("basically useState is like having variables that update the UI") 
@@ -958,14 +2969,14 @@ def create_intelligent_response_prompt(incoming_message: str, sender_number: str
                 6. send_sms("want me to explain any specific hooks?")
 
                 Website workflow:
-                1. send_sms("cool! let me check out that site 🌐")
+                1. {website_ack}
                 2. scrape_website_info(url)
                 3. send_sms("alright so this covers [key topic]")
                 4. send_sms("[main insight from website]")
                 5. send_sms("does this help? any questions? 💭")
 
                 Browsing history question:
-                1. send_sms("lemme check what you've been studying 📚")
+                1. {history_ack}
                 2. send_sms("ok you've been deep in JavaScript lately!")
                 3. send_sms("saw you hit up MDN, w3schools, and some React docs")
                 4. send_sms("you're on the right track fr 🔥")
@@ -978,101 +2989,173 @@ def create_intelligent_response_prompt(incoming_message: str, sender_number: str
                 EVERY SINGLE RESPONSE MUST INCLUDE send_sms CALLS!
                 """
     
-    # Save prompt to txt file
-    with open('system_prompt.txt', 'w', encoding='utf-8') as f:
-        f.write(prompt)
+    # Save prompt to txt file for debugging
+    if SYSTEM_PROMPT_DUMP_PATH:
+        with open(SYSTEM_PROMPT_DUMP_PATH, 'w', encoding='utf-8') as f:
+            f.write(prompt)
     
     return prompt
 
+# =============================================================== #
+# Cohere Response Cache
+# =============================================================== #
+
+# Tools whose calls have side effects; responses requesting them are never replayed
+NON_IDEMPOTENT_TOOLS = {'send_sms'}
+
+# request hash -> (stored_at, response), oldest first for LRU eviction
+_cohere_cache = OrderedDict()
+_cohere_cache_lock = threading.Lock()
+_cohere_cache_stats = {'hits': 0, 'misses': 0, 'uncacheable': 0, 'evictions': 0}
+
+def _cohere_cache_default(obj):
+    """JSON fallback for SDK objects inside messages (pydantic models, tool calls)"""
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump()
+    if hasattr(obj, 'dict'):
+        return obj.dict()
+    return repr(obj)
+
+def cohere_cache_key(**chat_kwargs) -> str:
+    """Content address of a co.chat request: hash of model, messages, tools and parameters"""
+    import hashlib
+    canonical = json.dumps(chat_kwargs, sort_keys=True, default=_cohere_cache_default, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def _is_replayable_response(response) -> bool:
+    """A response may be replayed only if it asks for no side-effecting tools"""
+    tool_calls = getattr(getattr(response, 'message', None), 'tool_calls', None) or []
+    return not any(tool_call.function.name in NON_IDEMPOTENT_TOOLS for tool_call in tool_calls)
+
+def cached_cohere_chat(**chat_kwargs):
+    """
+    co.chat with an optional content-addressed, TTL- and size-bounded response cache
+    
+    Retries after a failed mark-processed step and overlapping runs send
+    byte-identical requests; with COHERE_CACHE_ENABLED those are answered from
+    memory. Responses that call NON_IDEMPOTENT_TOOLS (send_sms) are never
+    stored, so a replay can't re-send a text.
+    
+    Args:
+        **chat_kwargs: Arguments passed straight to co.chat
+        
+    Returns:
+        The co.chat response (possibly a cached one)
+    """
+    if not COHERE_CACHE_ENABLED:
+        return cohere_chat_call(**chat_kwargs)
+    
+    key = cohere_cache_key(**chat_kwargs)
+    cached = cohere_cache_get(key)
+    if cached is not None:
+        log_verbose("🗃️ Cohere cache hit (%s, key %s)", chat_kwargs.get('model'), key[:12])
+        return cached
+    
+    response = cohere_chat_call(**chat_kwargs)
+    cohere_cache_put(key, response)
+    return response
+
+def cohere_cache_get(key: str):
+    """Return the live cached response for a key (or None), counting the hit/miss"""
+    with _cohere_cache_lock:
+        entry = _cohere_cache.get(key)
+        if entry and time.time() - entry[0] <= COHERE_CACHE_TTL_SECONDS:
+            _cohere_cache.move_to_end(key)
+            _cohere_cache_stats['hits'] += 1
+            return entry[1]
+        if entry:
+            del _cohere_cache[key]  # Expired
+        _cohere_cache_stats['misses'] += 1
+        return None
+
+def cohere_cache_put(key: str, response):
+    """Store a response unless it calls a non-idempotent tool, evicting the oldest entries"""
+    with _cohere_cache_lock:
+        if not _is_replayable_response(response):
+            _cohere_cache_stats['uncacheable'] += 1
+            return
+        _cohere_cache[key] = (time.time(), response)
+        _cohere_cache.move_to_end(key)
+        while len(_cohere_cache) > COHERE_CACHE_MAX_ENTRIES:
+            _cohere_cache.popitem(last=False)
+            _cohere_cache_stats['evictions'] += 1
+
+def get_cohere_cache_stats() -> dict:
+    """Return cache counters and current size"""
+    with _cohere_cache_lock:
+        return {
+            'enabled': COHERE_CACHE_ENABLED,
+            'entries': len(_cohere_cache),
+            **_cohere_cache_stats
+        }
+
 # =============================================================== #
 # Cohere Analytics
 # =============================================================== #
 
-def process_user_with_cohere(user_id, user_email=None, check_recent_activity=True, minimum_inactivity=20):
+def get_most_recent_activity_time(activities: list, thread_name: str = None):
     """
-    Process a single user's unprocessed activities with Cohere in a separate thread
+    Find the newest activity timestamp as a timezone-aware datetime
     
     Args:
-        user_id (str): The user ID to process
-        user_email (str): Optional user email for logging
-        check_recent_activity (bool): If True, skip processing if most recent activity was within minimum_inactivity seconds
+        activities (list): Activity rows with a 'timestamp' field
+        thread_name (str): Optional thread name for log lines
+        
+    Returns:
+        datetime: The most recent timestamp, or None if none could be parsed
     """
-    thread_name = threading.current_thread().name
-    user_label = user_email or user_id[:8] + "..."
+    from datetime import datetime, timezone
+    thread_name = thread_name or threading.current_thread().name
     
-    try:
-        log_verbose(f"🧵 [{thread_name}] Starting analysis for user {user_label}")
-        
-        # Get unprocessed activities for this user
-        unprocessed_response = supabase.table('activities') \
-            .select('id, timestamp, domain, title, url') \
-            .eq('user_id', user_id) \
-            .eq('processed', False) \
-            .execute()
-            
-        if unprocessed_response.data is None:
-            log_always(f'❌ [{thread_name}] Error fetching unprocessed activities for {user_label}')
-            return
-            
-        unprocessed_activities = unprocessed_response.data
-        log_always(f"📊 [{thread_name}] Found {len(unprocessed_activities)} unprocessed activities for {user_label}")
-        
-        if not unprocessed_activities or len(unprocessed_activities) == 0:
-            log_always(f"⏩ [{thread_name}] No unprocessed activities for {user_label}, skipping")
-            return
-        
-        # Check if most recent activity is too recent (within minimum_inactivity seconds)
-        if check_recent_activity:
-            from datetime import datetime, timezone, timedelta
-            now = datetime.now(timezone.utc)
-            
-            # Find the most recent activity timestamp
-            most_recent_timestamp = None
-            for activity in unprocessed_activities:
-                activity_time_str = activity.get('timestamp')
-                if activity_time_str:
-                    try:
-                        # Parse the timestamp - handle both with and without timezone info
-                        if activity_time_str.endswith('Z'):
-                            activity_time = datetime.fromisoformat(activity_time_str.replace('Z', '+00:00'))
-                        elif '+' in activity_time_str or activity_time_str.endswith('00'):
-                            activity_time = datetime.fromisoformat(activity_time_str)
-                        else:
-                            # Assume UTC if no timezone info
-                            activity_time = datetime.fromisoformat(activity_time_str).replace(tzinfo=timezone.utc)
-                        
-                        if most_recent_timestamp is None or activity_time > most_recent_timestamp:
-                            most_recent_timestamp = activity_time
-                    except Exception as parse_error:
-                        print(f"⚠️ [{thread_name}] Error parsing timestamp '{activity_time_str}': {parse_error}")
-                        continue
-            
-            if most_recent_timestamp:
-                time_since_recent = now - most_recent_timestamp
-                if time_since_recent.total_seconds() < minimum_inactivity:
-                    log_verbose(f"⏰ [{thread_name}] Skipping {user_label} - most recent activity was {time_since_recent.total_seconds():.1f} seconds ago (< {minimum_inactivity})")
-                    return
+    most_recent_timestamp = None
+    for activity in activities:
+        activity_time_str = activity.get('timestamp')
+        if activity_time_str:
+            try:
+                # Parse the timestamp - handle both with and without timezone info
+                if activity_time_str.endswith('Z'):
+                    activity_time = datetime.fromisoformat(activity_time_str.replace('Z', '+00:00'))
+                elif '+' in activity_time_str or activity_time_str.endswith('00'):
+                    activity_time = datetime.fromisoformat(activity_time_str)
                 else:
-                    log_verbose(f"✅ [{thread_name}] Most recent activity for {user_label} was {time_since_recent.total_seconds():.1f} seconds ago, proceeding with processing")
-            
-            
-        # Create detailed activity descriptions for Cohere
-        activity_descriptions = []
-        key_urls = []
-        
-        for activity in unprocessed_activities:
-            # Build detailed activity entry with URL for potential future processing
-            activity_entry = f"Time: {activity['timestamp']}\nDomain: {activity['domain']}\nTitle: {activity['title']}\nURL: {activity.get('url', 'N/A')}\n"
-            activity_descriptions.append(activity_entry)
-            
-            # Collect URLs that might be important learning resources
-            if activity.get('url'):
-                key_urls.append(activity['url'])
-        
-        activity_text = '\n'.join(activity_descriptions)
+                    # Assume UTC if no timezone info
+                    activity_time = datetime.fromisoformat(activity_time_str).replace(tzinfo=timezone.utc)
+    
+                if most_recent_timestamp is None or activity_time > most_recent_timestamp:
+                    most_recent_timestamp = activity_time
+            except Exception as parse_error:
+                log_warning("⚠️ [%s] Error parsing timestamp '%s': %s", thread_name, activity_time_str, parse_error)
+                continue
+    
+    return most_recent_timestamp
+
+def build_learning_graph_prompt(activities: list):
+    """
+    Build the learning-graph analysis prompt for a batch of activities
+    
+    Args:
+        activities (list): Unprocessed activity rows (id, timestamp, domain, title, url)
         
-        # Create comprehensive learning graph prompt that analyzes all URLs
-        prompt = f"""Analyze browsing activity and create a learning journey map:
+    Returns:
+        tuple: (prompt, key_urls) - the Cohere prompt and the activity URLs it covers
+    """
+    # Create detailed activity descriptions for Cohere
+    activity_descriptions = []
+    key_urls = []
+    
+    for activity in activities:
+        # Build detailed activity entry with URL for potential future processing
+        activity_entry = f"Time: {activity['timestamp']}\nDomain: {activity['domain']}\nTitle: {activity['title']}\nURL: {activity.get('url', 'N/A')}\n"
+        activity_descriptions.append(activity_entry)
+    
+        # Collect URLs that might be important learning resources
+        if activity.get('url'):
+            key_urls.append(activity['url'])
+    
+    activity_text = '\n'.join(activity_descriptions)
+    
+    # Create comprehensive learning graph prompt that analyzes all URLs
+    prompt = f"""Analyze browsing activity and create a learning journey map:
 
                 ACTIVITY DATA:
                 {activity_text}
@@ -1134,12 +3217,125 @@ def process_user_with_cohere(user_id, user_email=None, check_recent_activity=Tru
                 7. Spot learning patterns and gaps
 
                 Return ONLY JSON."""
+    
+    return prompt, key_urls
+
+def serialize_cohere_content(response):
+    """
+    Extract the text of a co.chat response plus a JSON-serializable copy of its content
+    
+    Returns:
+        tuple: (text, serializable_content)
+    """
+    summary_text = ""
+    summary_content_serializable = []
+    
+    if response and hasattr(response, 'message') and hasattr(response.message, 'content'):
+        content = response.message.content
+        if isinstance(content, list):
+            for item in content:
+                if hasattr(item, 'text'):
+                    summary_text += item.text
+                    summary_content_serializable.append({
+                        'type': 'text', 
+                        'text': item.text
+                    })
+                elif isinstance(item, dict):
+                    if 'text' in item:
+                        summary_text += item['text']
+                        summary_content_serializable.append(item)
+                    else:
+                        text_content = str(item)
+                        summary_text += text_content
+                        summary_content_serializable.append({
+                            'type': 'text',
+                            'text': text_content
+                        })
+        else:
+            summary_text = str(content)
+            summary_content_serializable = [{'type': 'text', 'text': summary_text}]
+    
+    return summary_text, summary_content_serializable
+
+def serialize_cohere_usage(response):
+    """Convert co.chat usage into a JSON-serializable dict (or None)"""
+    usage_serializable = None
+    if hasattr(response, 'usage') and response.usage:
+        usage_serializable = {
+            'input_tokens': getattr(response.usage, 'input_tokens', None),
+            'output_tokens': getattr(response.usage, 'output_tokens', None),
+            'total_tokens': getattr(response.usage, 'total_tokens', None),
+        }
+    
+    return usage_serializable
+
+def process_user_with_cohere(user_id, user_email=None, check_recent_activity=True, minimum_inactivity=20):
+    """
+    Process a single user's unprocessed activities with Cohere in a separate thread
+    
+    Args:
+        user_id (str): The user ID to process
+        user_email (str): Optional user email for logging
+        check_recent_activity (bool): If True, skip processing if most recent activity was within minimum_inactivity seconds
+        
+    Returns:
+        str: 'summarized', 'skipped', 'deferred' or 'error' (used for the cycle metrics)
+    """
+    thread_name = threading.current_thread().name
+    user_label = user_email or user_id[:8] + "..."
+    bind_log_context(user_id=user_id)
+    
+    try:
+        log_verbose("🧵 [%s] Starting analysis for user %s", thread_name, user_label)
+        
+        # Get unprocessed activities for this user
+        unprocessed_response = supabase.table('activities') \
+            .select('id, timestamp, domain, title, url') \
+            .eq('user_id', user_id) \
+            .eq('processed', False) \
+            .execute()
+            
+        if unprocessed_response.data is None:
+            log_error('❌ [%s] Error fetching unprocessed activities for %s', thread_name, user_label)
+            return 'error'
+            
+        unprocessed_activities = unprocessed_response.data
+        log_always("📊 [%s] Found %s unprocessed activities for %s", thread_name, len(unprocessed_activities), user_label)
+        
+        if not unprocessed_activities or len(unprocessed_activities) == 0:
+            log_always("⏩ [%s] No unprocessed activities for %s, skipping", thread_name, user_label)
+            return 'skipped'
+        
+        # Check if most recent activity is too recent (within minimum_inactivity seconds)
+        if check_recent_activity:
+            from datetime import datetime, timezone, timedelta
+            now = datetime.now(timezone.utc)
+            
+            # Find the most recent activity timestamp
+            most_recent_timestamp = get_most_recent_activity_time(unprocessed_activities, thread_name)
+            
+            if most_recent_timestamp:
+                time_since_recent = now - most_recent_timestamp
+                if time_since_recent.total_seconds() < minimum_inactivity:
+                    log_verbose("⏰ [%s] Skipping %s - most recent activity was %.1f seconds ago (< %s)", thread_name, user_label, time_since_recent.total_seconds(), minimum_inactivity)
+                    return 'skipped'
+                else:
+                    log_verbose("✅ [%s] Most recent activity for %s was %.1f seconds ago, proceeding with processing", thread_name, user_label, time_since_recent.total_seconds())
+            
+            
+        # Create comprehensive learning graph prompt that analyzes all URLs
+        prompt, key_urls = build_learning_graph_prompt(unprocessed_activities)
+        
+        log_verbose("🤖 [%s] Calling Cohere API for %s...", thread_name, user_label)
         
-        log_verbose(f"🤖 [{thread_name}] Calling Cohere API for {user_label}...")
+        # Heavy users get the cheaper model once they near today's cap
+        budget = get_usage_budget(user_id, 'analyze')
+        if budget['tier'] != 'normal':
+            log_always("💸 [%s] %s is on the %s usage tier, using %s", thread_name, user_label, budget['tier'], budget['learning_graph_model'])
         
         # Call Cohere API
-        response = co.chat(
-            model='command-r-plus',
+        response = cached_cohere_chat(
+            model=budget['learning_graph_model'],
             messages=[
                 {
                     'role': 'user',
@@ -1149,53 +3345,21 @@ def process_user_with_cohere(user_id, user_email=None, check_recent_activity=Tru
             response_format={"type": "json_object"},
         )
         
-        log_verbose(f"✅ [{thread_name}] Received Cohere response for {user_label}")
+        log_verbose("✅ [%s] Received Cohere response for %s", thread_name, user_label)
         
         # Extract text content from Cohere response
-        summary_text = ""
-        summary_content_serializable = []
-        
-        if response and hasattr(response, 'message') and hasattr(response.message, 'content'):
-            content = response.message.content
-            if isinstance(content, list):
-                for item in content:
-                    if hasattr(item, 'text'):
-                        summary_text += item.text
-                        summary_content_serializable.append({
-                            'type': 'text', 
-                            'text': item.text
-                        })
-                    elif isinstance(item, dict):
-                        if 'text' in item:
-                            summary_text += item['text']
-                            summary_content_serializable.append(item)
-                        else:
-                            text_content = str(item)
-                            summary_text += text_content
-                            summary_content_serializable.append({
-                                'type': 'text',
-                                'text': text_content
-                            })
-            else:
-                summary_text = str(content)
-                summary_content_serializable = [{'type': 'text', 'text': summary_text}]
+        summary_text, summary_content_serializable = serialize_cohere_content(response)
         
         # Extract URLs from the response for future AI processing
-        import re
-        url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
-        extracted_urls = list(set(re.findall(url_pattern, summary_text)))
+        extracted_urls = extract_summary_urls(summary_text)
         
-        # Also include the original key URLs from activities
-        all_key_urls = list(set(key_urls + extracted_urls))
+        # Warm the transcript/page caches for the resources the user is most likely to ask about
+        prefetch_queued = schedule_resource_prefetch(rank_prefetch_urls(summary_text, key_urls, extracted_urls))
+        if prefetch_queued:
+            log_verbose("🔥 [%s] Queued %s resources for prefetch for %s", thread_name, prefetch_queued, user_label)
         
         # Convert usage to serializable format
-        usage_serializable = None
-        if hasattr(response, 'usage') and response.usage:
-            usage_serializable = {
-                'input_tokens': getattr(response.usage, 'input_tokens', None),
-                'output_tokens': getattr(response.usage, 'output_tokens', None),
-                'total_tokens': getattr(response.usage, 'total_tokens', None),
-            }
+        usage_serializable = serialize_cohere_usage(response)
         
         # Insert summary into database
         from datetime import datetime
@@ -1212,7 +3376,7 @@ def process_user_with_cohere(user_id, user_email=None, check_recent_activity=Tru
         summary_insert_response = supabase.table('summaries').insert([summary_payload]).execute()
         
         if summary_insert_response.data:
-            log_verbose(f'💾 [{thread_name}] Summary saved for {user_label}')
+            log_verbose('💾 [%s] Summary saved for %s', thread_name, user_label)
             
             # Mark activities as processed
             activity_ids = [a['id'] for a in unprocessed_activities]
@@ -1222,14 +3386,22 @@ def process_user_with_cohere(user_id, user_email=None, check_recent_activity=Tru
                 .execute()
                 
             if update_response.data:
-                log_verbose(f'✅ [{thread_name}] Marked {len(activity_ids)} activities as processed for {user_label}')
+                log_verbose('✅ [%s] Marked %s activities as processed for %s', thread_name, len(activity_ids), user_label)
             else:
-                log_verbose(f'⚠️ [{thread_name}] Failed to mark activities as processed for {user_label}')
+                log_verbose('⚠️ [%s] Failed to mark activities as processed for %s', thread_name, user_label)
+            return 'summarized'
         else:
-            log_always(f'❌ [{thread_name}] Error saving summary for {user_label}:', summary_insert_response)
-            
+            log_error('❌ [%s] Error saving summary for %s: %s', thread_name, user_label, summary_insert_response)
+            return 'error'
+    
+    except CircuitOpenError as e:
+        # Activities stay unprocessed, so the next cycle analyzes them
+        log_warning("⏸️ [%s] Deferred %s: %s", thread_name, user_label, e)
+        record_circuit_deferral('analyze', e.service)
+        return 'deferred'
     except Exception as e:
-        log_always(f'💥 [{thread_name}] Error processing user {user_label}: {str(e)}')
+        log_error('💥 [%s] Error processing user %s: %s', thread_name, user_label, str(e))
+        return 'error'
 
 
 def analyze_all_users():
@@ -1239,6 +3411,7 @@ def analyze_all_users():
     Returns:
         str: Status message indicating success or failure
     """
+    bind_log_context(run_id=uuid.uuid4().hex[:8])
     log_always("🔍 Starting multi-threaded user analysis...")
     
     try:
@@ -1247,11 +3420,11 @@ def analyze_all_users():
         users_response = supabase.table('users').select('id, email').execute()
         
         if users_response.data is None:
-            log_always('❌ Error fetching users:', users_response)
+            log_error('❌ Error fetching users: %s', users_response)
             return f"Error fetching users"
             
         users = users_response.data
-        log_always(f"✅ Found {len(users)} users to process")
+        log_always("✅ Found %s users to process", len(users))
         
         if not users:
             return "No users found to process"
@@ -1260,36 +3433,57 @@ def analyze_all_users():
         threads = []
         max_threads = min(len(users), 5)  # Limit to 5 concurrent threads to avoid overwhelming APIs
         
-        log_verbose(f"🧵 Creating up to {max_threads} threads for processing...")
+        log_verbose("🧵 Creating up to %s threads for processing...", max_threads)
+        
+        # Per-user outcome ('summarized' / 'skipped' / 'deferred' / 'error') for the cycle metrics
+        outcomes = {}
+        
+        def run_user(index, user):
+            outcomes[index] = process_user_with_cohere(user['id'], user.get('email'))  # check_recent_activity=True by default
         
         for i, user in enumerate(users):
+            # Supabase or Cohere down: leave the rest for the next cycle instead of queueing behind timeouts
+            if defer_for_open_circuit('analyze', 'supabase', 'cohere'):
+                outcomes[i] = 'deferred'
+                continue
+            
             if i >= max_threads:
                 # Wait for some threads to complete before starting new ones
                 for thread in threads[:max_threads//2]:
                     thread.join()
                 threads = [t for t in threads if t.is_alive()]
             
+            # Each worker gets its own copy of the run's log context
             thread = threading.Thread(
-                target=process_user_with_cohere,
-                args=(user['id'], user.get('email')),  # check_recent_activity=True by default
+                target=contextvars.copy_context().run,
+                args=(run_user, i, user),
                 name=f"UserThread-{i+1}"
             )
             thread.start()
             threads.append(thread)
             
             # Small delay to stagger API calls
-            time.sleep(0.5)
+            time.sleep(PIPELINE_STAGGER_SECONDS)
         
         # Wait for all threads to complete
-        log_verbose(f"⏳ Waiting for all {len(threads)} threads to complete...")
+        log_verbose("⏳ Waiting for all %s threads to complete...", len(threads))
         for thread in threads:
             thread.join()
         
+        outcome_values = list(outcomes.values())
+        record_pipeline_cycle('analyze', {outcome: outcome_values.count(outcome) for outcome in ('summarized', 'skipped', 'deferred', 'error')})
+        flush_usage_ledger()
+        
+        deferred_users = outcome_values.count('deferred')
+        if deferred_users:
+            log_warning("⏸️ Deferred %d/%d users to the next cycle (open circuits: %s)", deferred_users, len(users),
+                        ', '.join(service for service, state in get_circuit_breaker_states().items() if state['state'] != 'closed') or 'none')
+        
         log_always("🎉 All users processed!")
         return f"✅ Successfully processed {len(users)} users with threading"
         
     except Exception as error:
-        log_always('💥 Fatal error in analyze_all_users:', error)
+        log_error('💥 Fatal error in analyze_all_users: %s', error)
         return f"Fatal error: {error}"
 
 
@@ -1299,21 +3493,25 @@ def analyze_single_user_legacy():
     Tests connection with the original test user
     """
     test_user_id = '123e4567-e89b-12d3-a456-426614174000'
-    print(f"� Testing single user analysis for {test_user_id}...")
+    log_always("� Testing single user analysis for %s...", test_user_id)
     
     try:
         process_user_with_cohere(test_user_id, "test@example.com")  # check_recent_activity=True by default
         return f"✅ Single user test completed"
     except Exception as error:
-        print('💥 Error in single user test:', error)
+        log_error('💥 Error in single user test: %s', error)
         return f"Error in single user test: {error}"
 
 
-@app.route('/api/analyze-users', methods=['POST'])
+@routes.route('/api/analyze-users', methods=['POST'])
 def api_analyze_users():
     """API endpoint to analyze all users with Cohere"""
     try:
-        result = analyze_all_users()
+        if PIPELINE_ENGINE == 'async':
+            engine = get_async_engine()
+            result = engine.run(engine.analyze_all_users())
+        else:
+            result = analyze_all_users()
         
         # analyze_all_users returns a string, so we need to format it properly
         if result.startswith('✅'):
@@ -1338,7 +3536,144 @@ def api_analyze_users():
 # Cohere Summaries Parsing
 # =============================================================== #
 
-def process_single_user_summaries(user, twenty_four_hours_ago, results_dict, index):
+# Tokens that appear in every learning-graph summary and say nothing about novelty
+NOVELTY_IGNORED_TOKENS = {
+    'learning_overview', 'primary_focus', 'secondary_topics', 'level', 'total_urls',
+    'learning_graph', 'relevance_score', 'subtopics', 'urls', 'url', 'title', 'domain',
+    'timestamp', 'value', 'type', 'why', 'key_resources', 'high_value', 'for_ai_analysis',
+    'priority', 'patterns', 'behavior', 'gaps', 'progress', 'high', 'medium', 'low',
+    'beginner', 'intermediate', 'advanced', 'https', 'http', 'www', 'com', 'summary',
+    'the', 'a', 'an', 'and', 'or', 'of', 'to', 'in', 'on',
+    'for', 'is', 'are', 'with', 'this', 'that', 'it'
+}
+
+def _novelty_shingles(text: str, size: int = 3) -> set:
+    """Word shingles of a text with section headers and structural/common tokens removed"""
+    text = re.sub(r'--- (?:NEW |PROCESSED )?Summary from .*? ---', ' ', text or '')
+    tokens = [t for t in re.findall(r'[a-z0-9]+', text.lower()) if t not in NOVELTY_IGNORED_TOKENS]
+    if len(tokens) < size:
+        return {' '.join(tokens)} if tokens else set()
+    return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+def measure_summary_novelty(new_text: str, reference_texts: list) -> float:
+    """
+    Fraction of the new text's word shingles not already present in the reference texts
+    
+    Args:
+        new_text (str): The new (unprocessed) summaries text
+        reference_texts (list): Already processed summaries and recent outbound texts
+        
+    Returns:
+        float: 1.0 for entirely new content, 0.0 for a complete repeat
+    """
+    new_shingles = _novelty_shingles(new_text)
+    if not new_shingles:
+        return 0.0
+    
+    known_shingles = set()
+    for text in reference_texts:
+        known_shingles |= _novelty_shingles(text)
+    if not known_shingles:
+        return 1.0
+    
+    return len(new_shingles - known_shingles) / len(new_shingles)
+
+def mark_summaries_processed(user_id: str, summary_ids: list, thread_name: str, user_label: str) -> int:
+    """
+    Mark summaries as processed in Supabase and in the watermark cache
+    
+    Returns:
+        int: Number of summaries marked processed
+    """
+    if not summary_ids:
+        return 0
+    
+    try:
+        update_response = supabase.table('summaries') \
+            .update({'processed': True}) \
+            .in_('id', summary_ids) \
+            .execute()
+        
+        if update_response.data:
+            log_verbose("✅ [%s] Marked %s summaries as processed for %s", thread_name, len(summary_ids), user_label)
+            mark_watermark_summaries_processed(user_id, summary_ids)
+            return len(summary_ids)
+        
+        log_verbose("⚠️ [%s] Failed to mark summaries as processed for %s", thread_name, user_label)
+        return 0
+    except Exception as mark_error:
+        log_verbose("❌ [%s] Error marking summaries as processed for %s: %s", thread_name, user_label, str(mark_error))
+        return 0
+
+def build_summary_conversation_context(message_history: dict) -> str:
+    """Render the last 10 messages of a history as the summaries agent's conversation section"""
+    conversation_context = ""
+    if message_history and message_history.get('success') and message_history.get('total_messages', 0) > 0:
+        recent_messages = message_history.get('messages', [])[:10]  # Last 10 messages
+        conversation_context = f"""
+                RECENT CONVERSATION HISTORY ({message_history.get('total_messages', 0)} total messages):
+                """
+        
+        for i, msg in enumerate(recent_messages):
+            direction = "📤 User" if msg['direction'] == 'inbound' else "📥 Assistant"
+            timestamp = msg.get('date_created', 'Unknown time')[:16] if msg.get('date_created') else 'Unknown time'
+            # Preserve full message context for better AI understanding
+            body = msg.get('body', '')[:500] + '...' if len(msg.get('body', '')) > 500 else msg.get('body', '')
+            conversation_context += f"\n{i+1}. [{timestamp}] {direction}: {body}"
+    return conversation_context
+
+def recent_outbound_texts(message_history: dict) -> list:
+    """Bodies of the messages we sent, from a message history result"""
+    if not message_history or not message_history.get('success'):
+        return []
+    return [m.get('body', '') for m in message_history.get('messages', []) if m.get('direction') != 'inbound']
+
+def build_summary_agent_prompt(conversation_context: str, processed_summaries_text: str, new_summaries_text: str) -> str:
+    """Create the proactive-texting prompt for the summaries agent"""
+    # Create enhanced prompt for the agent with conversation context and smart messaging
+    return f"""You're their learning buddy who texts like Gen Z. Check their NEW learning and decide if it's worth texting about.
+
+                {conversation_context}
+
+                WHAT THEY'VE ALREADY COVERED:
+                {processed_summaries_text if processed_summaries_text else "Nothing processed yet"}
+
+                NEW STUFF THEY'VE BEEN LEARNING:
+                {new_summaries_text}
+
+                WHEN TO TEXT:
+                ✅ New topic they haven't studied
+                ✅ Cool progress in their learning  
+                ✅ Can offer helpful questions/tips
+                ✅ Haven't talked about this recently
+
+                ❌ Skip if it's repetitive/casual browsing
+
+                IF YOU TEXT:
+                - Send 2-4 short messages max
+                - Each text = one concept/question  
+                - Keep it casual & encouraging
+                - Use emojis & Gen Z language
+                - Ask engaging follow-ups
+
+                EXAMPLES:
+
+                Good texting:
+                "yo I saw you diving into React hooks! 🔥"  
+                "useState vs useEffect - which one's clicking for you?"
+                "that tutorial you found looks solid tbh"
+                "want me to explain any specific parts?"
+
+                Skip texting:
+                - Just casual browsing 
+                - Same topics as recent convos
+                - Nothing actionable to add
+
+                Only text if their new learning is actually worth discussing. Quality > quantity fr!
+                """
+
+
+def process_single_user_summaries(user, twenty_four_hours_ago, results_dict, index, prefetched_summaries=None, history_harvest=None):
     """
     Process a single user's summaries with Cohere in a separate thread
     
@@ -1347,19 +3682,24 @@ def process_single_user_summaries(user, twenty_four_hours_ago, results_dict, ind
         twenty_four_hours_ago (str): ISO timestamp for 24 hours ago
         results_dict (dict): Shared dictionary to store results
         index (int): User index for thread naming
+        prefetched_summaries (dict): Optional result from get_summaries_for_users_between_dates()
+            for this user; when given, no per-user Supabase query is made
+        history_harvest (LazyContext): Optional cycle-wide harvest_message_history() result;
+            when given, message history is served from its partition instead of per-user Twilio calls
     """
     thread_name = threading.current_thread().name
     user_id = user['id']
     user_email = user.get('email', 'No email')
     user_phone = user.get('phone_number', None)
     user_label = user_email if user_email != 'No email' else user_id[:8] + "..."
+    bind_log_context(user_id=user_id)
     
     try:
-        log_verbose(f"🧵 [{thread_name}] Processing summaries for user: {user_label}")
+        log_verbose("🧵 [%s] Processing summaries for user: %s", thread_name, user_label)
         
         # Skip users without phone numbers
         if not user_phone:
-            log_verbose(f"⚠️ [{thread_name}] Skipping user {user_label} - no phone number available")
+            log_verbose("⚠️ [%s] Skipping user %s - no phone number available", thread_name, user_label)
             results_dict[index] = {
                 'user_id': user_id,
                 'user_email': user_email,
@@ -1379,11 +3719,14 @@ def process_single_user_summaries(user, twenty_four_hours_ago, results_dict, ind
         start_timestamp = start_time.isoformat()
         end_timestamp = end_time.isoformat()
         
-        # Use the new function to fetch summaries for this user from the past 24 hours
-        user_summaries = get_user_summaries_between_dates(user_id, start_timestamp, end_timestamp)
+        # Use the batched page result when available, otherwise fetch this user's past 24 hours
+        if prefetched_summaries is not None:
+            user_summaries = prefetched_summaries
+        else:
+            user_summaries = get_user_summaries_between_dates(user_id, start_timestamp, end_timestamp)
         
         if not user_summaries['success'] or not user_summaries['user_found']:
-            log_always(f'❌ [{thread_name}] Error fetching summaries for {user_label}: {user_summaries.get("error", "Unknown error")}')
+            log_error('❌ [%s] Error fetching summaries for %s: %s', thread_name, user_label, user_summaries.get("error", "Unknown error"))
             results_dict[index] = {
                 'user_id': user_id,
                 'user_email': user_email,
@@ -1401,11 +3744,14 @@ def process_single_user_summaries(user, twenty_four_hours_ago, results_dict, ind
         unprocessed_summaries = user_summaries['unprocessed_summaries']
         all_summaries_text = user_summaries['combined_summaries_text']
         
-        log_always(f"📊 [{thread_name}] Found {summaries_count} total summaries ({unprocessed_count} unprocessed) for {user_label} in the past 24 hours")
+        log_always("📊 [%s] Found %s total summaries (%s unprocessed) for %s in the past 24 hours", thread_name, summaries_count, unprocessed_count, user_label)
         
-        # Fetch recent message history for context
-        log_verbose(f"📞 [{thread_name}] Fetching message history for {user_label} to provide conversation context")
-        message_history = get_message_history(user_phone, limit=20)  # Get last 20 messages for context
+        # Message history is only fetched if the agent actually runs for this user
+        if history_harvest is not None:
+            load_message_history = lambda: get_message_history_from_harvest(history_harvest.get(), user_phone, limit=20)
+        else:
+            load_message_history = lambda: get_message_history(user_phone, limit=20)  # Get last 20 messages for context
+        message_history_context = LazyContext('message_history', load_message_history)
         
         # Process each summary for this user
         user_result = {
@@ -1415,129 +3761,108 @@ def process_single_user_summaries(user, twenty_four_hours_ago, results_dict, ind
             'success': True,
             'summaries_count': summaries_count,
             'unprocessed_count': unprocessed_count,
-            'message_history_count': message_history.get('total_messages', 0) if message_history and message_history.get('success') else 0,
+            'message_history_count': 0,
+            'message_history_fetched': False,
             'summaries': summaries,  # Already formatted by the new function
             'agent_execution': None
         }
         
         # Only execute Cohere agent if we have unprocessed summaries to analyze
         if unprocessed_count > 0:
-            log_always(f"🤖 [{thread_name}] Executing Cohere agent for {user_label} with {unprocessed_count} unprocessed summaries")
-            
             # Separate new (unprocessed) summaries from old (processed) ones for better context
-            new_summaries_text = ""
-            processed_summaries_text = ""
+            summary_texts = build_summary_context_texts(unprocessed_summaries)
+            new_summaries_text = summary_texts['new_summaries_text']
+            if 'processed_summaries_text' in user_summaries:
+                processed_summaries_text = user_summaries['processed_summaries_text']  # Cached by the watermark fetch
+            else:
+                processed_summaries_text = build_summary_context_texts(summaries)['processed_summaries_text']
             
-            for summary in summaries:
-                summary_text = summary.get('summary_text', '')
-                timestamp = summary.get('prompt_generated_at', 'Unknown time')
-                
-                if summary.get('processed', False):
-                    processed_summaries_text += f"\n\n--- PROCESSED Summary from {timestamp} ---\n{summary_text}"
-                else:
-                    new_summaries_text += f"\n\n--- NEW Summary from {timestamp} ---\n{summary_text}"
+            unprocessed_ids = [s['id'] for s in unprocessed_summaries]
             
-            # Build conversation context from message history
-            conversation_context = ""
-            if message_history and message_history.get('success') and message_history.get('total_messages', 0) > 0:
-                recent_messages = message_history.get('messages', [])[:10]  # Last 10 messages
-                conversation_context = f"""
-                RECENT CONVERSATION HISTORY ({message_history.get('total_messages', 0)} total messages):
-                """
-                
-                for i, msg in enumerate(recent_messages):
-                    direction = "📤 User" if msg['direction'] == 'inbound' else "📥 Assistant"
-                    timestamp = msg.get('date_created', 'Unknown time')[:16] if msg.get('date_created') else 'Unknown time'
-                    # Preserve full message context for better AI understanding
-                    body = msg.get('body', '')[:500] + '...' if len(msg.get('body', '')) > 500 else msg.get('body', '')
-                    conversation_context += f"\n{i+1}. [{timestamp}] {direction}: {body}"
+            # Cheap local pre-filter: skip the agent when the new summaries mostly repeat covered ground
+            novelty = measure_summary_novelty(new_summaries_text, [processed_summaries_text])
             
-            # Create enhanced prompt for the agent with conversation context and smart messaging
-            agent_prompt = f"""You're their learning buddy who texts like Gen Z. Check their NEW learning and decide if it's worth texting about.
-
-                {conversation_context}
-
-                WHAT THEY'VE ALREADY COVERED:
-                {processed_summaries_text if processed_summaries_text else "Nothing processed yet"}
-
-                NEW STUFF THEY'VE BEEN LEARNING:
-                {new_summaries_text}
-
-                WHEN TO TEXT:
-                ✅ New topic they haven't studied
-                ✅ Cool progress in their learning  
-                ✅ Can offer helpful questions/tips
-                ✅ Haven't talked about this recently
-
-                ❌ Skip if it's repetitive/casual browsing
-
-                IF YOU TEXT:
-                - Send 2-4 short messages max
-                - Each text = one concept/question  
-                - Keep it casual & encouraging
-                - Use emojis & Gen Z language
-                - Ask engaging follow-ups
-
-                EXAMPLES:
-
-                Good texting:
-                "yo I saw you diving into React hooks! 🔥"  
-                "useState vs useEffect - which one's clicking for you?"
-                "that tutorial you found looks solid tbh"
-                "want me to explain any specific parts?"
-
-                Skip texting:
-                - Just casual browsing 
-                - Same topics as recent convos
-                - Nothing actionable to add
-
-                Only text if their new learning is actually worth discussing. Quality > quantity fr!
-                """
-
-            try:
-                agent_result = execute_cohere_agent(agent_prompt, user_phone)
-                user_result['agent_execution'] = agent_result
-                log_verbose(f"✅ [{thread_name}] Agent execution completed for {user_label}")
+            if novelty >= SUMMARY_NOVELTY_THRESHOLD:
+                # Fetch recent message history for context
+                log_verbose("📞 [%s] Fetching message history for %s to provide conversation context", thread_name, user_label)
+                message_history = message_history_context.get()
+                user_result['message_history_fetched'] = True
+                user_result['message_history_count'] = message_history.get('total_messages', 0) if message_history and message_history.get('success') else 0
+                
+                if message_history and message_history.get('success'):
+                    novelty = measure_summary_novelty(new_summaries_text, [processed_summaries_text] + recent_outbound_texts(message_history))
+            else:
+                message_history = None
+            
+            user_result['novelty_score'] = round(novelty, 3)
+            
+            # Build conversation context from message history
+            conversation_context = build_summary_conversation_context(message_history)
+            
+            agent_prompt = build_summary_agent_prompt(conversation_context, processed_summaries_text, new_summaries_text)
+            
+            if novelty < SUMMARY_NOVELTY_THRESHOLD:
+                tokens_saved = estimate_tokens(agent_prompt)
+                log_always("♻️ [%s] New summaries for %s are repetitive (novelty %.2f < %s), skipping Cohere (~%s tokens saved)", thread_name, user_label, novelty, SUMMARY_NOVELTY_THRESHOLD, tokens_saved)
+                user_result['novelty_skipped'] = True
+                user_result['novelty_tokens_saved'] = tokens_saved
+                user_result['summaries_marked_processed'] = mark_summaries_processed(user_id, unprocessed_ids, thread_name, user_label)
+            else:
+                budget = get_usage_budget(user_id, 'proactive')
+                user_result['usage_tier'] = budget['tier']
                 
-                sms_count = agent_result.get('sms_count', 0)
-                if sms_count > 0:
-                    log_always(f"📱 [{thread_name}] SMS messages sent: {sms_count}")
+                if not budget['proactive_allowed']:
+                    # Left unprocessed, not deferred: they leave the 24h window before the cap resets
+                    log_always("💸 [%s] %s reached today's usage cap, dropping proactive texts for these summaries", thread_name, user_label)
+                    user_result['usage_skipped'] = True
+                elif defer_for_open_circuit('summaries', 'cohere'):
+                    # Left unprocessed: the next cycle picks them up once Cohere recovers
+                    log_warning("⏸️ [%s] Cohere circuit open, deferring %s to the next cycle", thread_name, user_label)
+                    user_result['deferred'] = True
                 else:
-                    log_always(f"🤐 [{thread_name}] Agent decided not to send SMS (content may be repetitive or not substantial enough)")
-                
-                # Mark unprocessed summaries as processed after successful agent execution
-                if agent_result.get('success', False):
-                    try:
-                        unprocessed_ids = [s['id'] for s in unprocessed_summaries]
-                        if unprocessed_ids:
-                            update_response = supabase.table('summaries') \
-                                .update({'processed': True}) \
-                                .in_('id', unprocessed_ids) \
-                                .execute()
+                    routing = triage_proactive_summaries(new_summaries_text, processed_summaries_text)
+                    user_result['routing'] = routing
+                    
+                    if routing['route'] == 'skip':
+                        log_always("🧭 [%s] Triage model skipped %s (%s), not running the full agent", thread_name, user_label, routing['reason'])
+                        user_result['summaries_marked_processed'] = mark_summaries_processed(user_id, unprocessed_ids, thread_name, user_label)
+                    else:
+                        log_always("🤖 [%s] Executing Cohere agent for %s with %s unprocessed summaries", thread_name, user_label, unprocessed_count)
+                        try:
+                            agent_started_at = time.perf_counter()
+                            agent_result = execute_cohere_agent(agent_prompt, user_phone, model=budget['agent_model'])
+                            record_routing_latency('full_agent', time.perf_counter() - agent_started_at)
+                            user_result['agent_execution'] = agent_result
+                            log_verbose("✅ [%s] Agent execution completed for %s", thread_name, user_label)
                             
-                            if update_response.data:
-                                log_verbose(f"✅ [{thread_name}] Marked {len(unprocessed_ids)} summaries as processed for {user_label}")
-                                user_result['summaries_marked_processed'] = len(unprocessed_ids)
+                            sms_count = agent_result.get('sms_count', 0)
+                            if sms_count > 0:
+                                log_always("📱 [%s] SMS messages sent: %s", thread_name, sms_count)
                             else:
-                                log_verbose(f"⚠️ [{thread_name}] Failed to mark summaries as processed for {user_label}")
-                                user_result['summaries_marked_processed'] = 0
-                    except Exception as mark_error:
-                        log_verbose(f"❌ [{thread_name}] Error marking summaries as processed for {user_label}: {str(mark_error)}")
-                        user_result['summaries_marked_processed'] = 0
-                
-            except Exception as agent_error:
-                log_always(f"❌ [{thread_name}] Agent execution failed for {user_label}: {str(agent_error)}")
-                user_result['agent_execution'] = {
-                    'success': False,
-                    'error': str(agent_error)
-                }
+                                log_always("🤐 [%s] Agent decided not to send SMS (content may be repetitive or not substantial enough)", thread_name)
+                            
+                            # Mark unprocessed summaries as processed after successful agent execution
+                            if agent_result.get('success', False):
+                                user_result['summaries_marked_processed'] = mark_summaries_processed(user_id, unprocessed_ids, thread_name, user_label)
+                            
+                        except CircuitOpenError as agent_error:
+                            log_warning("⏸️ [%s] Deferred %s to the next cycle: %s", thread_name, user_label, agent_error)
+                            record_circuit_deferral('summaries', agent_error.service)
+                            user_result['deferred'] = True
+                        except Exception as agent_error:
+                            log_error("❌ [%s] Agent execution failed for %s: %s", thread_name, user_label, str(agent_error))
+                            user_result['agent_execution'] = {
+                                'success': False,
+                                'error': str(agent_error)
+                            }
         else:
-            log_always(f"⏩ [{thread_name}] No unprocessed summaries found for {user_label}, skipping agent execution")
+            log_always("⏩ [%s] No unprocessed summaries found for %s, skipping agent execution", thread_name, user_label)
         
+        message_history_context.close()
         results_dict[index] = user_result
         
     except Exception as e:
-        log_always(f'💥 [{thread_name}] Error processing summaries for {user_label}: {str(e)}')
+        log_error('💥 [%s] Error processing summaries for %s: %s', thread_name, user_label, str(e))
         results_dict[index] = {
             'user_id': user_id,
             'user_email': user_email,
@@ -1557,25 +3882,31 @@ def process_user_summaries():
     Returns:
         dict: Contains status and processing results
     """
+    bind_log_context(run_id=uuid.uuid4().hex[:8])
     log_always("🔍 Starting multi-threaded user summaries processing...")
     
     try:
         # Calculate 24 hours ago timestamp
-        from datetime import datetime, timedelta
+        from datetime import datetime, timedelta, timezone
         twenty_four_hours_ago = (datetime.now() - timedelta(hours=24)).isoformat()
         
-        log_verbose(f"📅 Looking for summaries created after: {twenty_four_hours_ago}")
+        # Shared summaries window for the batched page queries
+        window_end = datetime.now(timezone.utc)
+        window_start_timestamp = (window_end - timedelta(hours=24)).isoformat()
+        window_end_timestamp = window_end.isoformat()
+        
+        log_verbose("📅 Looking for summaries created after: %s", twenty_four_hours_ago)
         
         # Fetch all users with phone numbers
         log_verbose("📋 Fetching all users...")
         users_response = supabase.table('users').select('id, email, phone_number').execute()
         
         if users_response.data is None:
-            log_always('❌ Error fetching users:', users_response)
+            log_error('❌ Error fetching users: %s', users_response)
             return {'success': False, 'error': 'Error fetching users'}
             
         users = users_response.data
-        log_always(f"✅ Found {len(users)} users to process")
+        log_always("✅ Found %s users to process", len(users))
         
         if not users:
             return {'success': True, 'message': 'No users found', 'results': []}
@@ -1585,10 +3916,40 @@ def process_user_summaries():
         threads = []
         max_threads = min(len(users), 3)  # Limit to 3 concurrent threads to avoid overwhelming APIs
         
-        log_verbose(f"🧵 Creating up to {max_threads} threads for processing...")
+        log_verbose("🧵 Creating up to %s threads for processing...", max_threads)
+        
+        # Summaries for the current page of users, fetched with one query per page
+        page_summaries = {}
+        
+        # One Twilio sweep for the whole cycle, only made if some user needs history
+        history_since = window_end - timedelta(hours=MESSAGE_HISTORY_HARVEST_HOURS)
+        history_harvest = LazyContext('message_history_harvest', lambda: harvest_message_history(history_since))
+        
+        page_end = 0
         
         # Process users in batches to manage thread count
         for i, user in enumerate(users):
+            # Supabase or Cohere down: leave the rest unprocessed for the next cycle instead of queueing behind timeouts
+            deferred_by = defer_for_open_circuit('summaries', 'supabase', 'cohere')
+            if deferred_by:
+                results_dict[i] = {
+                    'user_id': user['id'],
+                    'user_email': user.get('email', 'No email'),
+                    'user_phone': user.get('phone_number'),
+                    'success': False,
+                    'deferred': True,
+                    'error': f"{deferred_by} circuit is open",
+                    'summaries_count': 0,
+                    'unprocessed_count': 0,
+                    'agent_execution': None
+                }
+                continue
+            
+            if i >= page_end:
+                page_end = i + SUMMARY_USER_PAGE_SIZE
+                page_users = [u for u in users[i:page_end] if u.get('phone_number')]
+                page_summaries = get_incremental_summaries_for_users(page_users, window_start_timestamp, window_end_timestamp)
+            
             # Wait for some threads to complete if we hit the limit
             if len(threads) >= max_threads:
                 # Wait for some threads to complete before starting new ones
@@ -1598,33 +3959,35 @@ def process_user_summaries():
             
             # Create and start thread for this user
             thread = threading.Thread(
-                target=process_single_user_summaries,
-                args=(user, twenty_four_hours_ago, results_dict, i),
+                target=contextvars.copy_context().run,
+                args=(process_single_user_summaries, user, twenty_four_hours_ago, results_dict, i, page_summaries.get(user['id']), history_harvest),
                 name=f"SummaryThread-{i+1}"
             )
             thread.start()
             threads.append(thread)
             
             # Small delay to stagger API calls
-            time.sleep(0.5)
+            time.sleep(PIPELINE_STAGGER_SECONDS)
         
         # Wait for all threads to complete
-        log_verbose(f"⏳ Waiting for all {len(threads)} threads to complete...")
+        log_verbose("⏳ Waiting for all %s threads to complete...", len(threads))
         for thread in threads:
             thread.join()
         
+        history_harvest.close()
+        
         # Convert results dict to list (preserving original order)
         results = [results_dict[i] for i in range(len(users)) if i in results_dict]
         
         # Check for any missing results due to thread failures
         missing_results = len(users) - len(results_dict)
         if missing_results > 0:
-            log_always(f"⚠️ Warning: {missing_results} users had no results (possible thread failures)")
+            log_always("⚠️ Warning: %s users had no results (possible thread failures)", missing_results)
         
         # Summary statistics - filter out any None results from threading issues
         valid_results = [r for r in results if r is not None]
         if len(valid_results) < len(results):
-            log_always(f"⚠️ Warning: Filtered out {len(results) - len(valid_results)} None results")
+            log_always("⚠️ Warning: Filtered out %s None results", len(results) - len(valid_results))
         total_summaries = sum(r.get('summaries_count', 0) for r in valid_results)
         total_unprocessed = sum(r.get('unprocessed_count', 0) for r in valid_results)
         successful_users = len([r for r in valid_results if r.get('success', False)])
@@ -1637,17 +4000,43 @@ def process_user_summaries():
         agent_decided_to_message = len([r for r in valid_results if r.get('agent_execution', {}) is not None and r.get('agent_execution', {}).get('sms_count', 0) > 0])
         agent_decided_to_skip = successful_agent_executions - agent_decided_to_message
         total_message_history_entries = sum(r.get('message_history_count', 0) for r in valid_results)
-        
-        log_always(f"🎉 Multi-threaded processing complete!")
-        log_always(f"📈 Total summaries found: {total_summaries}")
-        log_always(f"🔄 Total unprocessed summaries: {total_unprocessed}")
-        log_always(f"✅ Successful users: {successful_users}/{len(valid_results)} (processed {len(valid_results)}/{len(users)} total users)")
-        log_verbose(f"🤖 Successful agent executions: {successful_agent_executions}")
-        log_always(f"📱 Agent decided to send messages: {agent_decided_to_message}/{users_with_unprocessed} users with new content")
-        log_verbose(f"🤐 Agent decided to skip messaging: {agent_decided_to_skip} (smart filtering)")
-        log_always(f"📱 Total SMS messages sent: {total_sms_sent}")
-        log_verbose(f"💬 Total conversation history entries: {total_message_history_entries}")
-        log_verbose(f"✅ Summaries marked as processed: {total_summaries_marked_processed}")
+        message_history_fetches = len([r for r in valid_results if r.get('message_history_fetched', False)])
+        novelty_skipped = len([r for r in valid_results if r.get('novelty_skipped', False)])
+        novelty_tokens_saved = sum(r.get('novelty_tokens_saved', 0) for r in valid_results)
+        triage_skipped = len([r for r in valid_results if (r.get('routing') or {}).get('route') == 'skip'])
+        agent_runs = [r['agent_execution'] for r in valid_results if r.get('agent_execution')]
+        agent_iterations_saved = sum(a.get('iterations_saved', 0) for a in agent_runs)
+        agent_tokens_saved = sum(a.get('tokens_saved', 0) for a in agent_runs)
+        message_history_fetches_skipped = len([r for r in valid_results if r.get('user_phone') and not r.get('message_history_fetched', False)])
+        deferred_users = len([r for r in valid_results if r.get('deferred', False)])
+        
+        record_pipeline_cycle('summaries', {
+            'processed': len(valid_results),
+            'successful': successful_users,
+            'with_unprocessed': users_with_unprocessed,
+            'agent_runs': len(agent_runs),
+            'skipped_novelty': novelty_skipped,
+            'skipped_triage': triage_skipped,
+            'deferred': deferred_users
+        }, sms_sent=total_sms_sent)
+        flush_usage_ledger()
+        
+        log_always("🎉 Multi-threaded processing complete!")
+        log_always("📈 Total summaries found: %s", total_summaries)
+        log_always("🔄 Total unprocessed summaries: %s", total_unprocessed)
+        log_always("✅ Successful users: %s/%s (processed %s/%s total users)", successful_users, len(valid_results), len(valid_results), len(users))
+        log_verbose("🤖 Successful agent executions: %s", successful_agent_executions)
+        log_always("📱 Agent decided to send messages: %s/%s users with new content", agent_decided_to_message, users_with_unprocessed)
+        log_verbose("🤐 Agent decided to skip messaging: %s (smart filtering)", agent_decided_to_skip)
+        log_always("📱 Total SMS messages sent: %s", total_sms_sent)
+        log_verbose("💬 Total conversation history entries: %s", total_message_history_entries)
+        log_always("♻️ Novelty filter skipped %s/%s users with new content (~%s tokens saved)", novelty_skipped, users_with_unprocessed, novelty_tokens_saved)
+        log_always("🧭 Triage model skipped %s users before the full agent", triage_skipped)
+        log_always("🏁 Terminal conditions saved %s agent iterations (~%s tokens)", agent_iterations_saved, agent_tokens_saved)
+        log_always("📞 Message history fetches: %s (skipped %s users with nothing to process)", message_history_fetches, message_history_fetches_skipped)
+        if deferred_users:
+            log_warning("⏸️ Deferred %s users to the next cycle (open circuits)", deferred_users)
+        log_verbose("✅ Summaries marked as processed: %s", total_summaries_marked_processed)
         
         return {
             'success': True,
@@ -1662,7 +4051,19 @@ def process_user_summaries():
             'agent_decided_to_skip': agent_decided_to_skip,
             'total_sms_sent': total_sms_sent,
             'total_message_history_entries': total_message_history_entries,
+            'novelty_skipped': novelty_skipped,
+            'novelty_skip_rate': round(novelty_skipped / users_with_unprocessed, 3) if users_with_unprocessed else 0.0,
+            'novelty_tokens_saved': novelty_tokens_saved,
+            'triage_skipped': triage_skipped,
+            'agent_iterations_saved': agent_iterations_saved,
+            'agent_tokens_saved': agent_tokens_saved,
+            'routing_stats': get_routing_stats(),
+            'message_history_fetches': message_history_fetches,
+            'message_history_fetches_skipped': message_history_fetches_skipped,
+            'context_fetch_counters': get_context_fetch_counters(),
             'summaries_marked_processed': total_summaries_marked_processed,
+            'deferred_users': deferred_users,
+            'circuit_breakers': get_circuit_breaker_states(),
             'time_range': f"Past 24 hours (since {twenty_four_hours_ago})",
             'results': valid_results
         }
@@ -1670,8 +4071,8 @@ def process_user_summaries():
     except Exception as error:
         import traceback
         error_details = traceback.format_exc()
-        log_always('💥 Fatal error in process_user_summaries:', error)
-        log_verbose('📍 Error traceback:', error_details)
+        log_error('💥 Fatal error in process_user_summaries: %s', error)
+        log_verbose('📍 Error traceback: %s', error_details)
         return {
             'success': False,
             'error': f"Fatal error: {str(error)}",
@@ -1682,75 +4083,166 @@ def process_user_summaries():
 # Cohere Tool Use
 # =============================================================== #
 
-def execute_cohere_agent(user_prompt: str, to_number: str):
+def extract_response_text(response) -> str:
+    """Concatenate the text items of a co.chat response message"""
+    final_response = ""
+    if hasattr(response.message, 'content') and response.message.content:
+        if isinstance(response.message.content, list):
+            for item in response.message.content:
+                if hasattr(item, 'text'):
+                    final_response += item.text
+        else:
+            final_response = str(response.message.content)
+    return final_response
+
+# Tools available to the Cohere agent
+AGENT_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "send_sms",
+            "description": "Send short, Gen Z-style text messages. Break info into multiple digestible texts like actual texting. Each message should be under 160 chars when possible. Use casual language, emojis, and encouraging tone.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "message_body": {
+                        "type": "string",
+                        "description": "One short, focused text message. Use casual Gen Z language with emojis. Keep it under 160 chars when possible.",
+                    }
+                },
+                "required": ["message_body"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_youtube_transcript",
+            "description": "Extract transcript text from a YouTube video URL. Returns the full transcript as text.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "youtube_url": {
+                        "type": "string",
+                        "description": "The YouTube video URL to extract transcript from",
+                    }
+                },
+                "required": ["youtube_url"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "scrape_website_info",
+            "description": "Scrape website content and return the body text. Returns the website content as clean text.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "url": {
+                        "type": "string",
+                        "description": "The website URL to scrape content from",
+                    }
+                },
+                "required": ["url"],
+            },
+        },
+    }
+]
+
+# Explicit end-of-turn tool, offered when 'done_tool' is a terminal condition
+DONE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "done",
+        "description": "Call this in the same batch as your final send_sms calls once you've finished texting. Ends your turn without another round trip.",
+        "parameters": {
+            "type": "object",
+            "properties": {},
+            "required": [],
+        },
+    },
+}
+
+# Terminal-condition exits and what they saved
+_agent_loop_stats = {'runs': 0, 'exits': {}, 'iterations_saved': 0, 'tokens_saved': 0}
+_agent_loop_stats_lock = threading.Lock()
+
+def get_agent_tools() -> list:
+    """Tool schemas offered to the agent for the configured terminal conditions"""
+    if 'done_tool' in AGENT_TERMINAL_CONDITIONS:
+        return AGENT_TOOLS + [DONE_TOOL]
+    return AGENT_TOOLS
+
+def agent_terminal_condition(tool_names: list, sends_succeeded: bool, acknowledgement_pending: bool = False) -> str:
+    """
+    Decide whether a tool batch ends the agent's turn without another co.chat call
+    
+    A batch with a failed send_sms never ends the turn: the model gets to see
+    the error and retry, and callers don't mark the work as done.
+    
+    Args:
+        tool_names (list): Tool names in the batch just executed
+        sends_succeeded (bool): True when every send_sms in the batch returned success
+        acknowledgement_pending (bool): True for the first batch of a reply whose prompt asked
+            the agent to text its own acknowledgement (no server acknowledgement went out)
+        
+    Returns:
+        str: The terminal condition that fired, or None to keep looping
+    """
+    if not sends_succeeded:
+        return None
+    
+    if 'done_tool' in AGENT_TERMINAL_CONDITIONS and 'done' in tool_names:
+        return 'done_tool'
+    
+    # A texts-only batch is the final answer, unless it's the lone acknowledgement the prompt asked for
+    if 'sms_only_batch' in AGENT_TERMINAL_CONDITIONS and tool_names and all(name == 'send_sms' for name in tool_names):
+        if not (acknowledgement_pending and len(tool_names) == 1):
+            return 'sms_only_batch'
+    return None
+
+def record_agent_loop_exit(condition: str, tokens_saved: int = 0):
+    """Count how an agent run ended; terminal-condition exits also count the call they saved"""
+    with _agent_loop_stats_lock:
+        _agent_loop_stats['runs'] += 1
+        _agent_loop_stats['exits'][condition] = _agent_loop_stats['exits'].get(condition, 0) + 1
+        if condition in ('done_tool', 'sms_only_batch'):
+            _agent_loop_stats['iterations_saved'] += 1
+            _agent_loop_stats['tokens_saved'] += tokens_saved
+
+def get_agent_loop_stats() -> dict:
+    """Snapshot of agent loop exits for /health"""
+    with _agent_loop_stats_lock:
+        stats = dict(_agent_loop_stats)
+        stats['exits'] = dict(_agent_loop_stats['exits'])
+    stats['terminal_conditions'] = sorted(AGENT_TERMINAL_CONDITIONS)
+    return stats
+
+def estimate_skipped_call_tokens(last_input_tokens: int, batch_messages: list) -> int:
+    """Input tokens the skipped final co.chat would have cost: the last prompt plus this batch's turns"""
+    return (last_input_tokens or 0) + sum(estimate_tokens(str(message.get('content') or '')) for message in batch_messages)
+
+def execute_cohere_agent(user_prompt: str, to_number: str, max_iterations: int = 5, model: str = AGENT_MODEL, acknowledgement_pending: bool = False):
     """
     Execute Cohere agent with multi-tool capabilities based on user instruction
     
     Args:
         user_prompt (str): The instruction/prompt for the agent to execute
+        to_number (str): The phone number send_sms tool calls text
+        max_iterations (int): Maximum number of co.chat rounds (routing depth)
+        model (str): Cohere model (get_usage_budget() picks a cheaper one for heavy users)
+        acknowledgement_pending (bool): The prompt asks the agent to text an acknowledgement
+            first, so a lone first text doesn't end the turn
         
     Returns:
         dict: Contains execution status, results, and metadata
     """
     
-    # Define tools for Cohere
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "send_sms",
-                "description": "Send short, Gen Z-style text messages. Break info into multiple digestible texts like actual texting. Each message should be under 160 chars when possible. Use casual language, emojis, and encouraging tone.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "message_body": {
-                            "type": "string",
-                            "description": "One short, focused text message. Use casual Gen Z language with emojis. Keep it under 160 chars when possible.",
-                        }
-                    },
-                    "required": ["message_body"],
-                },
-            },
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "get_youtube_transcript",
-                "description": "Extract transcript text from a YouTube video URL. Returns the full transcript as text.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "youtube_url": {
-                            "type": "string",
-                            "description": "The YouTube video URL to extract transcript from",
-                        }
-                    },
-                    "required": ["youtube_url"],
-                },
-            },
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "scrape_website_info",
-                "description": "Scrape website content and return the body text. Returns the website content as clean text.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "url": {
-                            "type": "string",
-                            "description": "The website URL to scrape content from",
-                        }
-                    },
-                    "required": ["url"],
-                },
-            },
-        }
-    ]
     
     try:
-        print(f"🚀 Starting Cohere agent with user prompt...")
-        print(f"📝 User prompt: {user_prompt[:100]}{'...' if len(user_prompt) > 100 else ''}")
+        log_always("🚀 Starting Cohere agent with user prompt...")
+        log_verbose("📝 User prompt: %.100s", user_prompt)
         
         # Initialize the conversation
         messages = [
@@ -1761,7 +4253,6 @@ def execute_cohere_agent(user_prompt: str, to_number: str):
         ]
         
         # Track conversation state and token usage
-        max_iterations = 5  # Allow multiple iterations for multi-step tool use
         iteration = 0
         total_input_tokens = 0
         total_output_tokens = 0
@@ -1770,26 +4261,27 @@ def execute_cohere_agent(user_prompt: str, to_number: str):
         
         while iteration < max_iterations:
             iteration += 1
-            print(f"🔄 Iteration {iteration}...")
+            log_verbose("🔄 Iteration %d...", iteration)
             
             # Call Cohere with tools
-            response = co.chat(
-                model='command-a-03-2025',
+            response = cached_cohere_chat(
+                model=model,
                 messages=messages,
-                tools=tools,
+                tools=get_agent_tools(),
                 temperature=0.3
             )
             
-            print(f"📝 Response finish reason: {response.finish_reason}")
+            log_verbose("📝 Response finish reason: %s", response.finish_reason)
             
             # Track token usage
+            input_tokens = 0
             if hasattr(response, 'usage') and response.usage:
                 input_tokens = getattr(response.usage, 'input_tokens', 0)
                 output_tokens = getattr(response.usage, 'output_tokens', 0)
                 total_input_tokens += input_tokens
                 total_output_tokens += output_tokens
-                print(f"🪙 Token usage this call - Input: {input_tokens}, Output: {output_tokens}")
-                print(f"🪙 Total token usage so far - Input: {total_input_tokens}, Output: {total_output_tokens}")
+                log_verbose("🪙 Token usage this call - Input: %s, Output: %s", input_tokens, output_tokens)
+                log_verbose("🪙 Total token usage so far - Input: %s, Output: %s", total_input_tokens, total_output_tokens)
             
             # Add assistant's response to messages
             assistant_message = {
@@ -1802,18 +4294,23 @@ def execute_cohere_agent(user_prompt: str, to_number: str):
                 assistant_message['tool_calls'] = response.message.tool_calls
                 
             messages.append(assistant_message)
+            batch_start = len(messages) - 1
             
             # Handle tool calls
             if response.message.tool_calls:
-                print(f"🛠️  Found {len(response.message.tool_calls)} tool call(s)")
+                log_verbose("🛠️  Found %d tool call(s)", len(response.message.tool_calls))
                 
+                sends_succeeded = True
                 for tool_call in response.message.tool_calls:
                     tool_name = tool_call.function.name
                     tool_args = tool_call.function.arguments
                     
-                    print(f"🔧 Executing tool: {tool_name}")
-                    print(f"📋 Arguments: {tool_args}")
+                    log_always("🔧 Executing tool: %s", tool_name)
+                    log_verbose("📋 Arguments: %s", tool_args)
                     
+                    tool_started_at = time.perf_counter()
+                    if tool_name != "done":
+                        record_usage(tool_calls=1)
                     try:
                         # Parse arguments if they're a string
                         if isinstance(tool_args, str):
@@ -1829,6 +4326,8 @@ def execute_cohere_agent(user_prompt: str, to_number: str):
                                     'message_sid': result.get('message_sid'),
                                     'status': result.get('status')
                                 })
+                            else:
+                                sends_succeeded = False
                             tools_used.append(tool_name)
                             
                         elif tool_name == "get_youtube_transcript":
@@ -1839,10 +4338,14 @@ def execute_cohere_agent(user_prompt: str, to_number: str):
                             result = scrape_website_info(tool_args.get("url", ""))
                             tools_used.append(tool_name)
                             
+                        elif tool_name == "done":
+                            result = "ok"
+                            
                         else:
                             result = f"Unknown tool: {tool_name}"
                         
-                        print(f"✅ Tool result preview: {str(result)[:200]}...")
+                        observe_latency('twin_external_call_duration_seconds', time.perf_counter() - tool_started_at, service='tool', operation=tool_name)
+                        log_verbose("✅ Tool result preview: %.200s...", result)
                         
                         # Add tool results to conversation
                         messages.append({
@@ -1852,26 +4355,49 @@ def execute_cohere_agent(user_prompt: str, to_number: str):
                         })
                         
                     except Exception as e:
-                        print(f"❌ Error executing {tool_name}: {str(e)}")
+                        observe_latency('twin_external_call_duration_seconds', time.perf_counter() - tool_started_at, service='tool', operation=tool_name)
+                        increment_counter('twin_external_call_errors_total', service='tool', operation=tool_name, error=type(e).__name__)
+                        log_error("❌ Error executing %s: %s", tool_name, e)
+                        if tool_name == "send_sms":
+                            sends_succeeded = False
                         messages.append({
                             'role': 'tool',
                             'tool_call_id': tool_call.id,
                             'content': f"Error executing {tool_name}: {str(e)}"
                         })
                 
+                # End the turn here when the batch was final, instead of asking for an empty turn
+                terminal_condition = agent_terminal_condition([tc.function.name for tc in response.message.tool_calls], sends_succeeded, acknowledgement_pending and iteration == 1)
+                if terminal_condition:
+                    tokens_saved = estimate_skipped_call_tokens(input_tokens, messages[batch_start:])
+                    record_agent_loop_exit(terminal_condition, tokens_saved)
+                    log_always("🏁 Agent turn ended by %s (skipped one co.chat, ~%d tokens)", terminal_condition, tokens_saved)
+                    
+                    return {
+                        'success': True,
+                        'iterations': iteration,
+                        'final_response': extract_response_text(response),
+                        'conversation_length': len(messages),
+                        'tools_used': list(set(tools_used)),
+                        'sms_messages_sent': sms_messages_sent,
+                        'sms_count': len(sms_messages_sent),
+                        'terminated_by': terminal_condition,
+                        'iterations_saved': 1,
+                        'tokens_saved': tokens_saved,
+                        'token_usage': {
+                            'input_tokens': total_input_tokens,
+                            'output_tokens': total_output_tokens,
+                            'total_tokens': total_input_tokens + total_output_tokens
+                        }
+                    }
+                
             else:
                 # No more tool calls, conversation is complete
-                print("🎉 Agent execution complete!")
+                log_always("🎉 Agent execution complete!")
                 
                 # Extract final response text
-                final_response = ""
-                if hasattr(response.message, 'content') and response.message.content:
-                    if isinstance(response.message.content, list):
-                        for item in response.message.content:
-                            if hasattr(item, 'text'):
-                                final_response += item.text
-                    else:
-                        final_response = str(response.message.content)
+                final_response = extract_response_text(response)
+                record_agent_loop_exit('no_tool_calls')
                 
                 return {
                     'success': True,
@@ -1881,6 +4407,9 @@ def execute_cohere_agent(user_prompt: str, to_number: str):
                     'tools_used': list(set(tools_used)),
                     'sms_messages_sent': sms_messages_sent,
                     'sms_count': len(sms_messages_sent),
+                    'terminated_by': 'no_tool_calls',
+                    'iterations_saved': 0,
+                    'tokens_saved': 0,
                     'token_usage': {
                         'input_tokens': total_input_tokens,
                         'output_tokens': total_output_tokens,
@@ -1888,6 +4417,7 @@ def execute_cohere_agent(user_prompt: str, to_number: str):
                     }
                 }
         
+        record_agent_loop_exit('max_iterations')
         return {
             'success': False,
             'error': 'Max iterations reached',
@@ -1903,18 +4433,386 @@ def execute_cohere_agent(user_prompt: str, to_number: str):
             }
         }
         
+    except CircuitOpenError:
+        raise  # Callers defer the work (pipelines) or send the fallback text (sms_reply)
     except Exception as e:
-        print(f"💥 Error in execute_cohere_agent: {str(e)}")
+        log_error("💥 Error in execute_cohere_agent: %s", e)
         return {
             'success': False,
             'error': str(e)
         }
 
+# =============================================================== #
+# Model Routing
+# =============================================================== #
+
+ROUTING_TRIAGE_MODEL = 'command-r7b-12-2024'  # Small, cheap model for triage and light replies
+
+# Inbound texts that only need a quick friendly reply, never the full agent
+TRIVIAL_MESSAGE_PATTERN = re.compile(
+    r'^(ok(ay)?|k+|kk|thanks?|thx|ty|thank you|lol+|lmao|haha+|cool|nice|great|word|'
+    r'got it|gn|good night|bye|cya|see ya|np)'
+    r'([\s!.,]+(ok(ay)?|thanks?|thx|ty|lol+|haha+|so much|man|bro|fr|!+))*[\s!.]*$',
+    re.IGNORECASE
+)
+
+# Short answers whose meaning depends on what we last texted ("yes" to "want more videos?")
+SHORT_ANSWER_PATTERN = re.compile(
+    r'^(yes|yep|yup|yeah|ya|no|nope|nah|sure|ok(ay)?|k+|bet|sounds good|definitely|of course|please|pls)\b'
+    r'[\s\w!.,]{0,30}$',
+    re.IGNORECASE
+)
+URL_PATTERN = re.compile(r'(https?://\S+|www\.\S+|\b[\w-]+\.(com|org|dev|io|net|edu|be)\b\S*)', re.IGNORECASE)
+
+QUESTION_MESSAGE_PATTERN = re.compile(
+    r'\?|^\s*(what|why|how|when|where|who|which|can|could|should|would|is|are|do|does|did|explain|tell me)\b',
+    re.IGNORECASE
+)
+
+# Canned first texts sent by the server instead of the agent (same lines the prompt used to ask for)
+ACKNOWLEDGEMENT_TEMPLATES = {
+    'link': "got it! checking that out for you 👀",
+    'question': "ooh good question! let me help ✨",
+    'greeting': "yo! 👋",
+}
+
+# Routing decisions and per-tier latency: populated by record_routing_decision / record_routing_latency
+_routing_stats = {'decisions': {}, 'latency': {}}
+_routing_stats_lock = threading.Lock()
+
+def record_routing_decision(pipeline: str, route: str):
+    """Count one routing decision for a pipeline"""
+    with _routing_stats_lock:
+        key = f"{pipeline}:{route}"
+        _routing_stats['decisions'][key] = _routing_stats['decisions'].get(key, 0) + 1
+
+def record_routing_latency(tier: str, seconds: float):
+    """Add one latency sample (seconds) for a routing tier"""
+    with _routing_stats_lock:
+        stats = _routing_stats['latency'].setdefault(tier, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['count'] += 1
+        stats['total_ms'] += seconds * 1000
+        stats['max_ms'] = max(stats['max_ms'], seconds * 1000)
+
+def get_routing_stats() -> dict:
+    """Return routing decision counts and average/max latency per tier"""
+    with _routing_stats_lock:
+        return {
+            'decisions': dict(_routing_stats['decisions']),
+            'latency': {
+                tier: {
+                    'count': stats['count'],
+                    'avg_ms': round(stats['total_ms'] / stats['count'], 1) if stats['count'] else 0.0,
+                    'max_ms': round(stats['max_ms'], 1)
+                }
+                for tier, stats in _routing_stats['latency'].items()
+            }
+        }
+
+def last_outbound_message(message_history: dict) -> str:
+    """Return the body of the most recent text we sent in a get_message_history() result, or ''"""
+    if not message_history or not message_history.get('messages'):
+        return ''
+    for msg in message_history['messages']:  # Newest first
+        if msg.get('direction') != 'inbound':
+            return msg.get('body') or ''
+    return ''
+
+def _triage_chat(prompt: str) -> str:
+    """Single tool-less call to the triage model, returning its text"""
+    response = cached_cohere_chat(
+        model=ROUTING_TRIAGE_MODEL,
+        messages=[{'role': 'user', 'content': prompt}],
+        temperature=0
+    )
+    return extract_response_text(response).strip()
+
+def route_inbound_message(incoming_msg: str, last_outbound: str = '') -> dict:
+    """
+    Decide how much model work an inbound text needs
+    
+    Local rules handle the clear cases (links and questions go to the full
+    agent, acknowledgements get a light reply, a short answer to a question
+    we asked goes to the full agent); only short ambiguous texts pay for a
+    triage-model call, which sees our last text for context.
+    
+    Args:
+        incoming_msg (str): The incoming SMS message
+        last_outbound (str): Our most recent text to this user, if any
+        
+    Returns:
+        dict: {
+            'route': 'light' | 'full',
+            'tier': 'rules' | 'triage',
+            'max_iterations': int,
+            'reason': str
+        }
+    """
+    started_at = time.perf_counter()
+    message = incoming_msg.strip()
+    last_outbound = (last_outbound or '').strip()
+    
+    if URL_PATTERN.search(message):
+        decision = {'route': 'full', 'tier': 'rules', 'max_iterations': 5, 'reason': 'link'}
+    elif last_outbound.endswith('?') and SHORT_ANSWER_PATTERN.match(message):
+        decision = {'route': 'full', 'tier': 'rules', 'max_iterations': 3, 'reason': 'answer to our question'}
+    elif not message or TRIVIAL_MESSAGE_PATTERN.match(message) or not re.search(r'[a-zA-Z0-9]', message):
+        decision = {'route': 'light', 'tier': 'rules', 'max_iterations': 0, 'reason': 'acknowledgement'}
+    elif '?' in message or len(message.split()) > 6:
+        decision = {'route': 'full', 'tier': 'rules', 'max_iterations': 3, 'reason': 'question or long message'}
+    else:
+        decision = None
+    
+    record_routing_latency('rules', time.perf_counter() - started_at)
+    
+    if decision is None:
+        triage_started_at = time.perf_counter()
+        try:
+            answer = _triage_chat(
+                "Classify this text a student sent to their AI learning buddy.\n"
+                + (f"BUDDY'S LAST TEXT: \"{last_outbound[:300]}\"\n" if last_outbound else "")
+                + f"TEXT: \"{message}\"\n"
+                "Reply LIGHT if a short friendly reply is enough (small talk, reactions, thanks).\n"
+                "Reply FULL if it needs their learning history, research or a real explanation, "
+                "or accepts or declines something the buddy offered.\n"
+                "Answer with exactly one word: LIGHT or FULL."
+            ).upper()
+            route = 'light' if answer.startswith('LIGHT') else 'full'
+            decision = {'route': route, 'tier': 'triage', 'max_iterations': 0 if route == 'light' else 3, 'reason': f'triage model said {answer[:10]}'}
+        except Exception as e:
+            decision = {'route': 'full', 'tier': 'triage', 'max_iterations': 3, 'reason': f'triage failed: {e}'}
+        record_routing_latency('triage', time.perf_counter() - triage_started_at)
+    
+    record_routing_decision('inbound', decision['route'])
+    return decision
+
+def send_light_reply(incoming_msg: str, sender_number: str, message_history: dict = None) -> dict:
+    """
+    Reply to a trivial inbound text with one short message from the triage model
+    
+    Args:
+        incoming_msg (str): The incoming SMS message
+        sender_number (str): The phone number of the sender
+        message_history (dict): Optional recent history for tone/continuity
+        
+    Returns:
+        dict: Result of send_sms()
+    """
+    started_at = time.perf_counter()
+    recent_lines = ""
+    if message_history and message_history.get('messages'):
+        for msg in reversed(message_history['messages'][:4]):
+            speaker = "User" if msg['direction'] == 'inbound' else "You"
+            recent_lines += f"\n{speaker}: {msg['body'][:200]}"
+    
+    try:
+        reply = _triage_chat(
+            "You're a friendly learning buddy who texts like Gen Z (casual, emojis, lowercase).\n"
+            f"Recent texts:{recent_lines or ' (none)'}\n"
+            f"They just texted: \"{incoming_msg}\"\n"
+            "Write ONE short text back (under 100 chars). Only the text, no quotes."
+        ).strip('"')
+    except Exception as e:
+        log_warning("⚠️ Light reply generation failed, using fallback: %s", e)
+        reply = ""
+    
+    result = send_sms(reply or "🙌", sender_number)
+    record_routing_latency('light_reply', time.perf_counter() - started_at)
+    return result
+
+def classify_acknowledgement(incoming_msg: str) -> str:
+    """Pick the acknowledgement template for an inbound text: 'link', 'question' or 'greeting'"""
+    if extract_message_urls(incoming_msg):
+        return 'link'
+    if QUESTION_MESSAGE_PATTERN.search(incoming_msg or ''):
+        return 'question'
+    return 'greeting'
+
+def send_instant_acknowledgement(incoming_msg: str, sender_number: str) -> dict:
+    """
+    Text a rule-selected acknowledgement before the full agent runs
+    
+    Replaces the agent's own first send_sms iteration, so the user hears back
+    after one Twilio call instead of a full co.chat round trip.
+    
+    Args:
+        incoming_msg (str): The incoming SMS message
+        sender_number (str): The phone number of the sender
+        
+    Returns:
+        dict: {'sent': bool, 'kind': str, 'text': str} - text is None unless it was sent
+    """
+    kind = classify_acknowledgement(incoming_msg)
+    text = ACKNOWLEDGEMENT_TEMPLATES[kind]
+    if not INSTANT_ACK_ENABLED:
+        return {'sent': False, 'kind': kind, 'text': None}
+    
+    result = send_sms(text, sender_number)
+    record_routing_decision('acknowledgement', kind if result.get('success') else 'failed')
+    return {'sent': bool(result.get('success')), 'kind': kind, 'text': text if result.get('success') else None}
+
+def build_proactive_triage_prompt(new_summaries_text: str, processed_summaries_text: str) -> str:
+    """Compact TEXT/SKIP classification prompt for the triage model"""
+    return (
+        "A learning buddy texts a student only about NEW, substantial learning "
+        "(new topics, real progress, something to ask or tip about). Casual browsing "
+        "and repeats of covered topics are skipped.\n\n"
+        f"ALREADY COVERED:\n{(processed_summaries_text or 'Nothing yet')[-1500:]}\n\n"
+        f"NEW:\n{new_summaries_text[:2500]}\n\n"
+        "Answer with exactly one word: TEXT or SKIP."
+    )
+
+def parse_proactive_triage_answer(answer: str) -> dict:
+    """Turn the triage model's TEXT/SKIP answer into a routing decision"""
+    answer = answer.strip().upper()
+    route = 'skip' if answer.startswith('SKIP') else 'full'
+    return {'route': route, 'tier': 'triage', 'reason': f'triage model said {answer[:10]}'}
+
+def triage_proactive_summaries(new_summaries_text: str, processed_summaries_text: str) -> dict:
+    """
+    Ask the triage model whether new learning summaries are worth a proactive text
+    
+    Args:
+        new_summaries_text (str): The new (unprocessed) summaries
+        processed_summaries_text (str): Summaries already covered
+        
+    Returns:
+        dict: {'route': 'skip' | 'full', 'tier': 'triage', 'reason': str}
+    """
+    started_at = time.perf_counter()
+    try:
+        answer = _triage_chat(build_proactive_triage_prompt(new_summaries_text, processed_summaries_text))
+        decision = parse_proactive_triage_answer(answer)
+    except Exception as e:
+        decision = {'route': 'full', 'tier': 'triage', 'reason': f'triage failed: {e}'}
+    
+    record_routing_latency('triage', time.perf_counter() - started_at)
+    record_routing_decision('proactive', decision['route'])
+    return decision
+
+def respond_with_full_agent(incoming_msg: str, sender_number: str, message_history: dict, max_iterations: int = 5, acknowledgement_sent: str = None, budget: dict = None):
+    """
+    Answer an inbound text with the full tool-using agent and the user's learning context
+    
+    Args:
+        incoming_msg (str): The incoming SMS message
+        sender_number (str): The phone number of the sender
+        message_history (dict): Result of get_message_history() for the sender
+        max_iterations (int): Agent depth chosen by the router
+        acknowledgement_sent (str): Acknowledgement already texted by send_instant_acknowledgement()
+        budget (dict): get_usage_budget() result for the sender (looked up when not given)
+        
+    Returns:
+        dict: Result of execute_cohere_agent()
+    """
+    # Existing flow: Fetch user summaries and create intelligent context
+    user_lookup = get_user_by_phone_number(sender_number)
+    
+    if budget is None:
+        user_found = user_lookup['success'] and user_lookup['user_found']
+        budget = get_usage_budget(user_lookup['user_info']['id'] if user_found else None, 'inbound')
+    
+    if user_lookup['success'] and user_lookup['user_found']:
+        # Calculate timestamps for past 36 hours
+        from datetime import datetime, timedelta, timezone
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(hours=36)
+    
+        start_timestamp = start_time.isoformat()
+        end_timestamp = end_time.isoformat()
+    
+        user_id = user_lookup['user_info']['id']
+        user_summaries = get_user_summaries_between_dates(user_id, start_timestamp, end_timestamp)
+    
+        if user_summaries['success']:
+            summaries_count = user_summaries['summaries_count']
+            user_info = user_lookup['user_info']
+    
+            log_verbose("🧠 User Learning Context:")
+            log_verbose("   User: %s (%s)", user_info.get('email', 'No email'), sender_number)
+            log_verbose("   Learning summaries: %s in past 36 hours", summaries_count)
+    
+            # Show recent learning topics
+            if user_summaries['summaries'] and is_verbose_logging():
+                log_verbose("📝 Recent learning summaries:")
+                for i, summary in enumerate(user_summaries['summaries'][:3]):  # Show last 3 summaries
+                    log_verbose("   %d. %.10s: %.100s", i + 1, summary['prompt_generated_at'], summary['summary_text'])
+        else:
+            log_always("ℹ️  No learning summaries available for user %s", user_lookup['user_info']['email'])
+            user_summaries = None
+    else:
+        log_always("ℹ️  No user found for phone number %s", sender_number)
+        user_summaries = None
+    
+    # Create intelligent prompt for Cohere agent
+    context_prompt = create_intelligent_response_prompt(
+        incoming_message=incoming_msg,
+        sender_number=sender_number,
+        message_history=message_history if message_history['success'] else None,
+        user_summaries=user_summaries if user_summaries and user_summaries['success'] else None,
+        token_budget=budget['context_token_budget'],
+        acknowledgement_sent=acknowledgement_sent
+    )
+    
+    # Execute intelligent agent with context
+    agent_started_at = time.perf_counter()
+    agent_result = execute_cohere_agent(context_prompt, to_number=sender_number, max_iterations=max_iterations, model=budget['agent_model'], acknowledgement_pending=not acknowledgement_sent)
+    record_routing_latency('full_agent', time.perf_counter() - agent_started_at)
+    return agent_result
+
+
+# =============================================================== #
+# Webhook Capture
+# =============================================================== #
+
+WEBHOOK_CAPTURE_FIELDS = ('Body', 'From', 'To', 'MessageSid')
+
+_webhook_capture_lock = threading.Lock()
+
+def capture_webhook(form) -> bool:
+    """
+    Append one inbound /sms payload and its arrival time to WEBHOOK_CAPTURE_PATH
+    
+    Each record is one JSON line ({"received_at": epoch seconds, "form": {...}}), so
+    several workers can append to the same file. Does nothing unless capture is enabled.
+    
+    Args:
+        form: The request's form values (request.values)
+        
+    Returns:
+        bool: True if the payload was written
+    """
+    if not WEBHOOK_CAPTURE_PATH:
+        return False
+    
+    record = {
+        'received_at': round(time.time(), 6),
+        'form': {field: form.get(field, '') for field in WEBHOOK_CAPTURE_FIELDS}
+    }
+    try:
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with _webhook_capture_lock:
+            with open(WEBHOOK_CAPTURE_PATH, 'a', encoding='utf-8') as capture_file:
+                capture_file.write(line)
+        return True
+    except OSError as e:
+        log_warning("⚠️ Could not capture webhook to %s: %s", WEBHOOK_CAPTURE_PATH, e)
+        return False
+
+
 # =============================================================== #
 # Twilio API Listen
 # =============================================================== #
 
-@app.route('/sms', methods=['GET', 'POST'])
+def circuit_fallback_reply(service: str) -> str:
+    """TwiML answering with CIRCUIT_FALLBACK_SMS while a dependency's circuit is open (no Twilio API call needed)"""
+    log_warning("⏸️ %s circuit open, replying with the fallback text", service)
+    record_routing_decision('inbound', 'fallback')
+    resp = deferred_import('twilio.twiml.messaging_response').MessagingResponse()
+    resp.message(CIRCUIT_FALLBACK_SMS)
+    return str(resp)
+
+@routes.route('/sms', methods=['GET', 'POST'])
 def sms_reply():
     """Handle incoming SMS messages from Twilio webhook"""
     try:
@@ -1923,104 +4821,101 @@ def sms_reply():
         sender_number = request.values.get('From', '')
         twilio_number = request.values.get('To', '')
         message_sid = request.values.get('MessageSid', '')
+        bind_log_context(message_sid=message_sid)
+        capture_webhook(request.values)
         
-        print(f"📱 Received SMS from {sender_number} to {twilio_number}")
-        print(f"📝 Message: {incoming_msg}")
-        print(f"🆔 Message SID: {message_sid}")
+        log_always("📱 Received SMS from %s to %s", sender_number, twilio_number)
+        log_verbose("📝 Message: %s", incoming_msg)
+        log_verbose("🆔 Message SID: %s", message_sid)
         
-        # Fetch message history with this caller
-        message_history = get_message_history(sender_number, limit=50)
+        # A failed user lookup would look like a brand-new user, so don't guess while Supabase is down
+        if defer_for_open_circuit('inbound', 'supabase'):
+            return circuit_fallback_reply('supabase')
         
-        if message_history['success']:
-            total_msgs = message_history['total_messages']
-            inbound_count = message_history['inbound_messages']
-            outbound_count = message_history['outbound_messages']
-            
-            print(f"📚 Message History Summary:")
-            print(f"   Total messages with {sender_number}: {total_msgs}")
-            print(f"   Inbound: {inbound_count}, Outbound: {outbound_count}")
-            
-            # Show last few messages for context
-            if message_history['messages']:
-                print(f"📜 Recent conversation history:")
-                for i, msg in enumerate(message_history['messages'][:5]):  # Show last 5 messages
-                    direction_emoji = "📤" if msg['direction'] == 'inbound' else "📥"
-                    print(f"   {i+1}. {direction_emoji} {msg['from']} → {msg['to']}: {msg['body'][:50]}{'...' if len(msg['body']) > 50 else ''}")
-        
-        # CHECK ONBOARDING GATES FIRST
-        print(f"🚪 Checking onboarding gates...")
+        # Gates first: onboarding replies need neither conversation history nor a model
+        log_verbose("🚪 Checking onboarding gates...")
         gate_status = check_onboarding_gates(sender_number)
+        if gate_status.get('user_info'):
+            bind_log_context(user_id=gate_status['user_info'].get('id'))
         
-        if gate_status['onboarding_complete']:
-            print(f"✅ Onboarding complete - proceeding with normal flow")
+        if not gate_status['onboarding_complete']:
+            log_always("🚪 Onboarding required - handling gate: %s", gate_status['next_gate'])
+            onboarding_started_at = time.perf_counter()
+            record_context_fetch('message_history', fetched=False)
+            handle_onboarding_flow(incoming_msg, sender_number, gate_status)
+            record_routing_decision('inbound', 'onboarding')
+            record_routing_latency('onboarding', time.perf_counter() - onboarding_started_at)
+        else:
+            log_verbose("✅ Onboarding complete - proceeding with normal flow")
             
-            # Existing flow: Fetch user summaries and create intelligent context
-            user_lookup = get_user_by_phone_number(sender_number)
+            if defer_for_open_circuit('inbound', 'cohere'):
+                return circuit_fallback_reply('cohere')
             
-            if user_lookup['success'] and user_lookup['user_found']:
-                # Calculate timestamps for past 36 hours
-                from datetime import datetime, timedelta, timezone
-                end_time = datetime.now(timezone.utc)
-                start_time = end_time - timedelta(hours=36)
-                
-                start_timestamp = start_time.isoformat()
-                end_timestamp = end_time.isoformat()
-                
-                user_id = user_lookup['user_info']['id']
-                user_summaries = get_user_summaries_between_dates(user_id, start_timestamp, end_timestamp)
+            # Start fetching any links now so the agent's tool calls find them warm
+            speculative_urls = speculative_prefetch_message_urls(incoming_msg)
+            if speculative_urls:
+                log_always("🔥 Speculatively fetching %d link(s) from the message", len(speculative_urls))
+            
+            # Fetch message history with this caller
+            message_history = get_message_history(sender_number, limit=50)
+            record_context_fetch('message_history', fetched=True)
+            
+            if message_history['success'] and is_verbose_logging():
+                log_verbose("📚 Message History Summary:")
+                log_verbose("   Total messages with %s: %s", sender_number, message_history['total_messages'])
+                log_verbose("   Inbound: %s, Outbound: %s", message_history['inbound_messages'], message_history['outbound_messages'])
                 
-                if user_summaries['success']:
-                    summaries_count = user_summaries['summaries_count']
-                    user_info = user_lookup['user_info']
-                    
-                    print(f"🧠 User Learning Context:")
-                    print(f"   User: {user_info.get('email', 'No email')} ({sender_number})")
-                    print(f"   Learning summaries: {summaries_count} in past 36 hours")
-                    
-                    # Show recent learning topics
-                    if user_summaries['summaries']:
-                        print(f"📝 Recent learning summaries:")
-                        for i, summary in enumerate(user_summaries['summaries'][:3]):  # Show last 3 summaries
-                            summary_preview = summary['summary_text'][:100] + '...' if len(summary['summary_text']) > 100 else summary['summary_text']
-                            print(f"   {i+1}. {summary['prompt_generated_at'][:10]}: {summary_preview}")
-                else:
-                    print(f"ℹ️  No learning summaries available for user {user_lookup['user_info']['email']}")
-                    user_summaries = None
-            else:
-                print(f"ℹ️  No user found for phone number {sender_number}")
-                user_summaries = None
-
-            # Create intelligent prompt for Cohere agent
-            context_prompt = create_intelligent_response_prompt(
-                incoming_message=incoming_msg,
-                sender_number=sender_number,
-                message_history=message_history if message_history['success'] else None,
-                user_summaries=user_summaries if user_summaries and user_summaries['success'] else None
-            )
+                # Show last few messages for context
+                if message_history['messages']:
+                    log_verbose("📜 Recent conversation history:")
+                    for i, msg in enumerate(message_history['messages'][:5]):  # Show last 5 messages
+                        direction_emoji = "📤" if msg['direction'] == 'inbound' else "📥"
+                        log_verbose("   %d. %s %s → %s: %.50s", i + 1, direction_emoji, msg['from'], msg['to'], msg['body'])
             
-            # Execute intelligent agent with context
-            execute_cohere_agent(context_prompt, to_number=sender_number)
+            routing = route_inbound_message(incoming_msg, last_outbound_message(message_history) if message_history['success'] else '')
             
-        else:
-            print(f"🚪 Onboarding required - handling gate: {gate_status['next_gate']}")
-            # Handle onboarding flow
-            handle_onboarding_flow(incoming_msg, sender_number, gate_status)
+            # Over today's cap: the triage model's light reply instead of the full agent
+            budget = get_usage_budget((gate_status.get('user_info') or {}).get('id'), 'inbound')
+            if budget['tier'] == 'exhausted' and routing['route'] == 'full':
+                routing = {**routing, 'route': 'light', 'max_iterations': 0, 'reason': 'usage cap reached'}
+            
+            log_always("🧭 Routing: %s via %s (%s)", routing['route'], routing['tier'], routing['reason'])
+            
+            if routing['route'] == 'light':
+                send_light_reply(incoming_msg, sender_number, message_history if message_history['success'] else None)
+            else:
+                # Canned acknowledgement goes out now instead of costing the agent an iteration
+                acknowledgement = send_instant_acknowledgement(incoming_msg, sender_number)
+                if acknowledgement['sent']:
+                    log_always("👋 Sent instant %s acknowledgement", acknowledgement['kind'])
+                
+                if PIPELINE_ENGINE == 'async':
+                    # The full agent finishes on the engine loop; Twilio gets its TwiML right away
+                    engine = get_async_engine()
+                    engine.submit(engine.respond_with_full_agent(incoming_msg, sender_number, message_history, max_iterations=routing['max_iterations'], acknowledgement_sent=acknowledgement['text'], budget=budget))
+                else:
+                    respond_with_full_agent(incoming_msg, sender_number, message_history, max_iterations=routing['max_iterations'], acknowledgement_sent=acknowledgement['text'], budget=budget)
+        
+        maybe_flush_usage_ledger()
 
         # Create a TwiML response
-        resp = MessagingResponse()
+        resp = deferred_import('twilio.twiml.messaging_response').MessagingResponse()
         
-        print(f"✅ Sending TwiML response back to Twilio")
+        log_verbose("✅ Sending TwiML response back to Twilio")
         
         # Return TwiML response
         return str(resp)
         
+    except CircuitOpenError as e:
+        record_circuit_deferral('inbound', e.service)
+        return circuit_fallback_reply(e.service)
     except Exception as e:
-        print(f"💥 Error handling SMS webhook: {e}")
+        log_error("💥 Error handling SMS webhook: %s", e)
         # Return empty TwiML response in case of error
-        return str(MessagingResponse()), 500
+        return str(deferred_import('twilio.twiml.messaging_response').MessagingResponse()), 500
 
 
-@app.route('/')
+@routes.route('/')
 def home():
     return jsonify({
         'message': 'Flask + Cohere Agent API',
@@ -2030,6 +4925,8 @@ def home():
             'process_summaries': '/api/process-summaries (POST) - Process user summaries with agent',
             'analyze_users': '/api/analyze-users (POST) - Analyze all users with Cohere',
             'health': '/health (GET) - Health check',
+            'metrics': '/metrics (GET) - Prometheus metrics',
+            'usage': '/api/usage?user_id=...&days=7 (GET) - Per-user daily token/SMS/tool usage and budget tier',
             'sms_webhook': '/sms (POST) - Twilio SMS webhook'
         },
         'tools_available': ['send_sms', 'get_youtube_transcript', 'scrape_website_info'],
@@ -2053,25 +4950,61 @@ def home():
         }
     })
 
-@app.route('/health')
+@routes.route('/health')
 def health_check():
     """Health check endpoint"""
+    circuits = get_circuit_breaker_states()
     return jsonify({
-        'status': 'healthy',
+        'status': 'degraded' if any(state['state'] != 'closed' for state in circuits.values()) else 'healthy',
         'timestamp': datetime.now().isoformat(),
         'services': {
             'cohere': 'connected' if COHERE_API_KEY else 'missing_key',
             'supabase': 'connected' if SUPABASE_URL and SUPABASE_PUBLISHABLE_KEY else 'missing_config',
             'twilio': 'connected' if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN else 'missing_config'
+        },
+        'circuit_breakers': circuits,
+        'context_fetches': get_context_fetch_counters(),
+        'routing': get_routing_stats(),
+        'cohere_cache': get_cohere_cache_stats(),
+        'resource_cache': get_resource_cache_stats(),
+        'agent_loop': get_agent_loop_stats(),
+        'pipeline_engine': PIPELINE_ENGINE,
+        'webhook_capture': bool(WEBHOOK_CAPTURE_PATH),
+        'startup': get_startup_report(),
+        'process': {
+            'pid': os.getpid(),
+            'clients_initialized': {client._name: client.initialized for client in _lazy_clients}
         }
     })
 
 
-@app.route('/api/process-summaries', methods=['POST'])
+@routes.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint (per worker process)"""
+    return Response(render_prometheus_metrics(), mimetype='text/plain; version=0.0.4')
+
+@routes.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+    reset_log_context()
+
+@routes.after_request
+def record_request_latency(response):
+    started_at = g.get('request_started_at')
+    if started_at is not None and request.endpoint != 'twin.metrics':
+        observe_latency('twin_http_request_duration_seconds', time.perf_counter() - started_at,
+                        endpoint=request.endpoint, status=response.status_code)
+    return response
+
+@routes.route('/api/process-summaries', methods=['POST'])
 def api_process_summaries():
     """API endpoint to process user summaries with Cohere agent"""
     try:
-        result = process_user_summaries()
+        if PIPELINE_ENGINE == 'async':
+            engine = get_async_engine()
+            result = engine.run(engine.process_user_summaries())
+        else:
+            result = process_user_summaries()
         return jsonify(result), 200 if result.get('success') else 400
     except Exception as e:
         return jsonify({
@@ -2080,6 +5013,77 @@ def api_process_summaries():
         }), 500
 
 
+@routes.route('/api/usage', methods=['GET'])
+def api_usage():
+    """API endpoint to read a user's usage ledger (by user_id or phone_number) and current budget tier"""
+    try:
+        user_id = request.args.get('user_id')
+        phone_number = request.args.get('phone_number')
+        days = max(1, min(int(request.args.get('days', '1')), 90))
+        
+        if not user_id and phone_number:
+            user_lookup = get_user_by_phone_number(phone_number)
+            if user_lookup['success'] and user_lookup['user_found']:
+                user_id = user_lookup['user_info']['id']
+        if not user_id:
+            return jsonify({
+                'success': False,
+                'error': 'user_id or a known phone_number is required'
+            }), 400
+        
+        history = get_usage_history(user_id, days=days)
+        if not history['success']:
+            return jsonify(history), 500
+        
+        budget = get_usage_budget(user_id)
+        return jsonify({
+            **history,
+            'tier': budget['tier'],
+            'caps': {
+                'daily_tokens': USAGE_DAILY_TOKEN_CAP or None,
+                'daily_sms_segments': USAGE_DAILY_SMS_SEGMENT_CAP or None,
+                'degrade_at': USAGE_DEGRADE_AT
+            }
+        }), 200
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'days must be an integer'
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+# =============================================================== #
+# App Factory
+# =============================================================== #
+
+def create_app():
+    """
+    Build the Flask app for a WSGI server
+    
+    API clients are created lazily in each worker on first use, so a pre-forking
+    server can import this module once and fork safely. Multi-worker serving:
+    
+        gunicorn -w 4 --threads 8 -b 0.0.0.0:3067 'app:create_app()'
+    
+    Returns:
+        Flask: App with all routes registered
+    """
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(routes)
+    return flask_app
+
+# Module-level app for `python app.py` and existing imports
+app = create_app()
+
+APP_IMPORT_SECONDS = round(time.perf_counter() - _APP_IMPORT_STARTED_AT, 4)
+log_verbose("🚀 app.py imported in %ss (SDKs deferred until first use)", APP_IMPORT_SECONDS)
+
+
 # Test function for development
 def test_cohere_agent():
     """Test the agent with a sample prompt"""
@@ -2131,6 +5135,7 @@ if __name__ == '__main__':
     elif test_mode == "analyze":
         test_analyze_users()
     elif test_mode == "server":
+        print(f"🚀 Startup report: {get_startup_report()}")
         app.run(debug=False, host='0.0.0.0', port=3067, threaded=True)
     else:
         print("Invalid test mode. Choose 'agent', 'summaries', 'analyze', 'intelligent', or 'server'")
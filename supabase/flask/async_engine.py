@@ -0,0 +1,816 @@
+"""
+Asyncio execution engine for the Twin pipelines
+
+Runs analyze_all_users, process_user_summaries and the inbound SMS agent on
+async clients (cohere.AsyncClientV2, the async Supabase client, Twilio's
+AsyncTwilioHttpClient and httpx for scraping) inside one long-lived event
+loop. Concurrency is bounded per dependency by semaphores instead of by a
+hand-managed thread count, so a single process can keep hundreds of users'
+I/O in flight.
+
+The engine never imports app.py itself: app.py hands its own module in
+(get_async_engine()), and the pure helpers there (prompt builders, response
+parsers, formatters) are reused so both engines produce identical prompts
+and results.
+
+Enable with PIPELINE_ENGINE=async.
+"""
+
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+
+# Per-dependency concurrency limits
+ASYNC_COHERE_CONCURRENCY = int(os.getenv('ASYNC_COHERE_CONCURRENCY', '32'))
+ASYNC_SUPABASE_CONCURRENCY = int(os.getenv('ASYNC_SUPABASE_CONCURRENCY', '64'))
+ASYNC_TWILIO_CONCURRENCY = int(os.getenv('ASYNC_TWILIO_CONCURRENCY', '16'))
+ASYNC_SCRAPE_CONCURRENCY = int(os.getenv('ASYNC_SCRAPE_CONCURRENCY', '16'))
+ASYNC_TRANSCRIPT_CONCURRENCY = int(os.getenv('ASYNC_TRANSCRIPT_CONCURRENCY', '8'))  # Runs in worker threads (no async client)
+ASYNC_USER_CONCURRENCY = int(os.getenv('ASYNC_USER_CONCURRENCY', '200'))  # Users in flight per pipeline run
+
+
+class AsyncEngine:
+    """
+    Event loop running in a daemon thread plus lazily created async clients
+
+    Synchronous code (Flask views) drives it with run() to wait for a result
+    or submit() to fire and forget.
+    """
+
+    def __init__(self, twin):
+        self.twin = twin
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._clients = {}
+        self._semaphores = {}
+
+    # ----------------------------------------------------------- #
+    # Loop management
+    # ----------------------------------------------------------- #
+
+    def start(self):
+        """Start the event loop thread if it isn't running yet"""
+        with self._start_lock:
+            if self._loop is not None:
+                return
+
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                self._semaphores = {
+                    'cohere': asyncio.Semaphore(ASYNC_COHERE_CONCURRENCY),
+                    'supabase': asyncio.Semaphore(ASYNC_SUPABASE_CONCURRENCY),
+                    'twilio': asyncio.Semaphore(ASYNC_TWILIO_CONCURRENCY),
+                    'scrape': asyncio.Semaphore(ASYNC_SCRAPE_CONCURRENCY),
+                    'transcript': asyncio.Semaphore(ASYNC_TRANSCRIPT_CONCURRENCY),
+                    'users': asyncio.Semaphore(ASYNC_USER_CONCURRENCY),
+                }
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=run_loop, name="AsyncEngineLoop", daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+
+    def run(self, coro, timeout: float = None):
+        """Run a coroutine on the engine loop and block until it finishes"""
+        return self.submit(coro).result(timeout)
+
+    def submit(self, coro):
+        """Schedule a coroutine on the engine loop and return its concurrent Future"""
+        self.start()
+        # Carry the caller's log correlation ids (MessageSid, user id, run id) onto the task
+        caller_context = contextvars.copy_context()
+        
+        async def run_in_caller_context():
+            for var, value in caller_context.items():
+                var.set(value)
+            return await coro
+        
+        return asyncio.run_coroutine_threadsafe(run_in_caller_context(), self._loop)
+
+    # ----------------------------------------------------------- #
+    # Lazy async clients (created on the engine loop)
+    # ----------------------------------------------------------- #
+
+    async def _cohere(self):
+        if 'cohere' not in self._clients:
+            cohere = self.twin.deferred_import('cohere')
+            self._clients['cohere'] = cohere.AsyncClientV2(api_key=self.twin.COHERE_API_KEY)
+        return self._clients['cohere']
+
+    async def _supabase(self):
+        if 'supabase' not in self._clients:
+            acreate_client = self.twin.deferred_import('supabase').acreate_client
+            client = await acreate_client(
+                supabase_url=self.twin.SUPABASE_URL,
+                supabase_key=self.twin.SUPABASE_PUBLISHABLE_KEY
+            )
+            self._clients['supabase'] = self.twin.InstrumentedSupabase(client, is_async=True)
+        return self._clients['supabase']
+
+    async def _twilio(self):
+        if 'twilio' not in self._clients:
+            TwilioClient = self.twin.deferred_import('twilio.rest').Client
+            AsyncTwilioHttpClient = self.twin.deferred_import('twilio.http.async_http_client').AsyncTwilioHttpClient
+            self._clients['twilio'] = TwilioClient(
+                self.twin.TWILIO_ACCOUNT_SID,
+                self.twin.TWILIO_AUTH_TOKEN,
+                http_client=AsyncTwilioHttpClient()
+            )
+        return self._clients['twilio']
+
+    async def _http(self):
+        if 'http' not in self._clients:
+            httpx = self.twin.deferred_import('httpx')
+            self._clients['http'] = httpx.AsyncClient(timeout=self.twin.SCRAPE_TIMEOUT_SECONDS, follow_redirects=True)
+        return self._clients['http']
+
+    # ----------------------------------------------------------- #
+    # I/O primitives
+    # ----------------------------------------------------------- #
+
+    async def cohere_chat(self, **chat_kwargs):
+        """Async co.chat sharing the synchronous engine's response cache"""
+        twin = self.twin
+        key = None
+        if twin.COHERE_CACHE_ENABLED:
+            key = twin.cohere_cache_key(**chat_kwargs)
+            cached = twin.cohere_cache_get(key)
+            if cached is not None:
+                return cached
+
+        async with self._semaphores['cohere']:
+            client = await self._cohere()
+            with twin.timed_call('cohere', 'chat', model=chat_kwargs.get('model')):
+                response = await client.chat(**chat_kwargs)
+        twin.record_cohere_tokens(chat_kwargs.get('model'), response)
+
+        if key:
+            twin.cohere_cache_put(key, response)
+        return response
+
+    async def supabase_execute(self, build_query):
+        """
+        Execute a Supabase query
+
+        Args:
+            build_query: Callable taking the async client and returning a query builder,
+                e.g. lambda db: db.table('users').select('id')
+        """
+        async with self._semaphores['supabase']:
+            client = await self._supabase()
+            return await build_query(client).execute()
+
+    async def send_sms(self, message_body: str, to_number: str) -> dict:
+        """Async send_sms() with the same result shape"""
+        twin = self.twin
+        try:
+            async with self._semaphores['twilio']:
+                client = await self._twilio()
+                with twin.timed_call('twilio', 'messages.create'):
+                    message = await client.messages.create_async(
+                        body=message_body,
+                        from_=twin.TWILIO_PHONE_NUMBER,
+                        to=to_number
+                    )
+            twin.record_usage(sms_segments=twin.count_sms_segments(message_body))
+            return {
+                'success': True,
+                'message_sid': message.sid,
+                'status': message.status,
+                'to': to_number,
+                'from': twin.TWILIO_PHONE_NUMBER,
+                'error': None
+            }
+        except Exception as e:
+            return {
+                'success': False,
+                'message_sid': None,
+                'status': 'failed',
+                'to': to_number,
+                'from': twin.TWILIO_PHONE_NUMBER,
+                'error': str(e)
+            }
+
+    async def get_message_history(self, phone_number: str, limit: int = 50) -> dict:
+        """Async get_message_history(): both directions are listed concurrently"""
+        twin = self.twin
+        try:
+            client = await self._twilio()
+            async with self._semaphores['twilio']:
+                with twin.timed_call('twilio', 'messages.list'):
+                    messages_from, messages_to = await asyncio.gather(
+                        client.messages.list_async(from_=phone_number, limit=limit),
+                        client.messages.list_async(to=phone_number, limit=limit)
+                    )
+
+            unique_messages = {msg.sid: msg for msg in messages_from + messages_to}
+            sorted_messages = sorted(
+                unique_messages.values(),
+                key=lambda x: x.date_created,
+                reverse=True
+            )[:limit]
+
+            formatted_history = [twin.format_twilio_message(msg) for msg in sorted_messages]
+            return twin.build_message_history_result(phone_number, formatted_history)
+        except Exception as e:
+            twin.log_error("💥 Error fetching message history for %s: %s", phone_number, e)
+            return {
+                'success': False,
+                'error': str(e),
+                'phone_number': phone_number,
+                'total_messages': 0,
+                'messages': []
+            }
+
+    async def scrape_website_info(self, url: str):
+        """Async scrape_website_info(): same byte cap and allowlist, extraction runs off the loop"""
+        twin = self.twin
+        try:
+            if not url.startswith(('http://', 'https://')):
+                url = 'https://' + url
+            cache_key = twin.normalize_resource_url(url)
+            cached = twin.resource_cache_get('page', cache_key)
+            if cached is not None:
+                return cached
+            inflight = twin.get_inflight_resource('page', cache_key)
+            if inflight is not None:
+                # A speculative or prefetch fetch is already running in a thread
+                return await asyncio.wait_for(asyncio.wrap_future(inflight), twin.RESOURCE_INFLIGHT_WAIT_SECONDS)
+            async with self._semaphores['scrape']:
+                client = await self._http()
+                async with client.stream('GET', url, headers=twin.SCRAPE_HEADERS) as response:
+                    response.raise_for_status()
+                    content_type = response.headers.get('Content-Type', '')
+                    if not twin.is_scrapable_content_type(content_type):
+                        twin.log_always("⏩ Not scraping %s: content type %s is not text", url, content_type)
+                        return None
+
+                    body = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        body.extend(chunk)
+                        if len(body) >= twin.SCRAPE_MAX_BYTES:
+                            break
+            page_text = await asyncio.to_thread(twin.decode_scraped_body, bytes(body[:twin.SCRAPE_MAX_BYTES]), content_type)
+            twin.resource_cache_put('page', cache_key, page_text)
+            return page_text
+        except Exception as e:
+            twin.log_error("Error scraping website: %s", e)
+            return None
+
+    async def get_youtube_transcript(self, youtube_url: str):
+        """The transcript library is blocking, so it runs in a bounded worker thread"""
+        async with self._semaphores['transcript']:
+            return await asyncio.to_thread(self.twin.get_youtube_transcript, youtube_url)
+
+    # ----------------------------------------------------------- #
+    # Agent
+    # ----------------------------------------------------------- #
+
+    async def execute_agent_tool(self, tool_name: str, tool_args: dict, to_number: str):
+        """Dispatch one agent tool call to its async implementation"""
+        if tool_name != "done":
+            self.twin.record_usage(tool_calls=1)
+        if tool_name == "send_sms":
+            return await self.send_sms(tool_args.get("message_body", ""), to_number=to_number)
+        if tool_name == "get_youtube_transcript":
+            return await self.get_youtube_transcript(tool_args.get("youtube_url", ""))
+        if tool_name == "scrape_website_info":
+            return await self.scrape_website_info(tool_args.get("url", ""))
+        if tool_name == "done":
+            return "ok"
+        return f"Unknown tool: {tool_name}"
+
+    async def execute_cohere_agent(self, user_prompt: str, to_number: str, max_iterations: int = 5, model: str = None, acknowledgement_pending: bool = False) -> dict:
+        """Async execute_cohere_agent() with the same loop and result shape"""
+        twin = self.twin
+        try:
+            messages = [{'role': 'user', 'content': user_prompt}]
+            iteration = 0
+            total_input_tokens = 0
+            total_output_tokens = 0
+            tools_used = []
+            sms_messages_sent = []
+
+            def token_usage():
+                return {
+                    'input_tokens': total_input_tokens,
+                    'output_tokens': total_output_tokens,
+                    'total_tokens': total_input_tokens + total_output_tokens
+                }
+
+            while iteration < max_iterations:
+                iteration += 1
+                response = await self.cohere_chat(
+                    model=model or twin.AGENT_MODEL,
+                    messages=messages,
+                    tools=twin.get_agent_tools(),
+                    temperature=0.3
+                )
+
+                input_tokens = 0
+                if hasattr(response, 'usage') and response.usage:
+                    input_tokens = getattr(response.usage, 'input_tokens', 0) or 0
+                    total_input_tokens += input_tokens
+                    total_output_tokens += getattr(response.usage, 'output_tokens', 0) or 0
+
+                assistant_message = {'role': 'assistant', 'content': response.message.content}
+                if response.message.tool_calls:
+                    assistant_message['tool_calls'] = response.message.tool_calls
+                messages.append(assistant_message)
+                batch_start = len(messages) - 1
+
+                if not response.message.tool_calls:
+                    twin.record_agent_loop_exit('no_tool_calls')
+                    return {
+                        'success': True,
+                        'iterations': iteration,
+                        'final_response': twin.extract_response_text(response),
+                        'conversation_length': len(messages),
+                        'tools_used': list(set(tools_used)),
+                        'sms_messages_sent': sms_messages_sent,
+                        'sms_count': len(sms_messages_sent),
+                        'terminated_by': 'no_tool_calls',
+                        'iterations_saved': 0,
+                        'tokens_saved': 0,
+                        'token_usage': token_usage()
+                    }
+
+                # Tool calls run in order: texts must arrive in the sequence the model chose
+                sends_succeeded = True
+                for tool_call in response.message.tool_calls:
+                    tool_name = tool_call.function.name
+                    try:
+                        tool_args = tool_call.function.arguments
+                        if isinstance(tool_args, str):
+                            tool_args = json.loads(tool_args)
+
+                        with twin.timed_call('tool', tool_name):
+                            result = await self.execute_agent_tool(tool_name, tool_args, to_number)
+                        if tool_name in ('send_sms', 'get_youtube_transcript', 'scrape_website_info'):
+                            tools_used.append(tool_name)
+                        if tool_name == 'send_sms' and result.get('success'):
+                            sms_messages_sent.append({
+                                'message_body': tool_args.get("message_body", ""),
+                                'message_sid': result.get('message_sid'),
+                                'status': result.get('status')
+                            })
+                        elif tool_name == 'send_sms':
+                            sends_succeeded = False
+                        content = str(result)
+                    except Exception as e:
+                        if tool_name == 'send_sms':
+                            sends_succeeded = False
+                        content = f"Error executing {tool_name}: {str(e)}"
+
+                    messages.append({'role': 'tool', 'tool_call_id': tool_call.id, 'content': content})
+
+                terminal_condition = twin.agent_terminal_condition([tc.function.name for tc in response.message.tool_calls], sends_succeeded, acknowledgement_pending and iteration == 1)
+                if terminal_condition:
+                    tokens_saved = twin.estimate_skipped_call_tokens(input_tokens, messages[batch_start:])
+                    twin.record_agent_loop_exit(terminal_condition, tokens_saved)
+                    return {
+                        'success': True,
+                        'iterations': iteration,
+                        'final_response': twin.extract_response_text(response),
+                        'conversation_length': len(messages),
+                        'tools_used': list(set(tools_used)),
+                        'sms_messages_sent': sms_messages_sent,
+                        'sms_count': len(sms_messages_sent),
+                        'terminated_by': terminal_condition,
+                        'iterations_saved': 1,
+                        'tokens_saved': tokens_saved,
+                        'token_usage': token_usage()
+                    }
+
+            twin.record_agent_loop_exit('max_iterations')
+            return {
+                'success': False,
+                'error': 'Max iterations reached',
+                'iterations': iteration,
+                'conversation_length': len(messages),
+                'tools_used': list(set(tools_used)),
+                'sms_messages_sent': sms_messages_sent,
+                'sms_count': len(sms_messages_sent),
+                'token_usage': token_usage()
+            }
+
+        except twin.CircuitOpenError:
+            raise  # Callers defer the work or send the fallback text
+        except Exception as e:
+            twin.log_error("💥 Error in async execute_cohere_agent: %s", e)
+            return {'success': False, 'error': str(e)}
+
+    # ----------------------------------------------------------- #
+    # Analyze pipeline
+    # ----------------------------------------------------------- #
+
+    async def process_user_with_cohere(self, user_id, user_email=None, check_recent_activity=True, minimum_inactivity=20):
+        """Async process_user_with_cohere(): returns 'summarized', 'skipped', 'deferred' or 'error'"""
+        from datetime import datetime, timezone
+        twin = self.twin
+        user_label = user_email or user_id[:8] + "..."
+        twin.bind_log_context(user_id=user_id)
+
+        try:
+            unprocessed_response = await self.supabase_execute(
+                lambda db: db.table('activities')
+                    .select('id, timestamp, domain, title, url')
+                    .eq('user_id', user_id)
+                    .eq('processed', False)
+            )
+            unprocessed_activities = unprocessed_response.data
+            if not unprocessed_activities:
+                twin.log_verbose("⏩ [async] No unprocessed activities for %s, skipping", user_label)
+                return 'skipped'
+
+            if check_recent_activity:
+                most_recent_timestamp = twin.get_most_recent_activity_time(unprocessed_activities, 'async')
+                if most_recent_timestamp:
+                    seconds_since = (datetime.now(timezone.utc) - most_recent_timestamp).total_seconds()
+                    if seconds_since < minimum_inactivity:
+                        twin.log_verbose("⏰ [async] Skipping %s - most recent activity was %.1f seconds ago", user_label, seconds_since)
+                        return 'skipped'
+
+            prompt, key_urls = twin.build_learning_graph_prompt(unprocessed_activities)
+            budget = await asyncio.to_thread(twin.get_usage_budget, user_id, 'analyze')
+            response = await self.cohere_chat(
+                model=budget['learning_graph_model'],
+                messages=[{'role': 'user', 'content': prompt}],
+                response_format={"type": "json_object"},
+            )
+
+            summary_text, summary_content_serializable = twin.serialize_cohere_content(response)
+            twin.schedule_resource_prefetch(twin.rank_prefetch_urls(summary_text, key_urls, twin.extract_summary_urls(summary_text)))
+            activity_ids = [a['id'] for a in unprocessed_activities]
+            summary_payload = {
+                'user_id': user_id,
+                'summary': summary_content_serializable,
+                'cohere_finish_reason': getattr(response, 'finish_reason', None),
+                'cohere_usage': twin.serialize_cohere_usage(response),
+                'cohere_prompt': prompt,
+                'source_activity_ids': activity_ids,
+                'prompt_generated_at': datetime.now().isoformat(),
+            }
+
+            insert_response = await self.supabase_execute(lambda db: db.table('summaries').insert([summary_payload]))
+            if not insert_response.data:
+                twin.log_error('❌ [async] Error saving summary for %s', user_label)
+                return 'error'
+
+            await self.supabase_execute(
+                lambda db: db.table('activities').update({'processed': True}).in_('id', activity_ids)
+            )
+            twin.log_verbose('✅ [async] Summary saved and %s activities processed for %s', len(activity_ids), user_label)
+            return 'summarized'
+
+        except twin.CircuitOpenError as e:
+            twin.log_warning("⏸️ [async] Deferred %s: %s", user_label, e)
+            twin.record_circuit_deferral('analyze', e.service)
+            return 'deferred'
+        except Exception as e:
+            twin.log_error('💥 [async] Error processing user %s: %s', user_label, str(e))
+            return 'error'
+
+    async def analyze_all_users(self) -> str:
+        """Async analyze_all_users(): every user is scheduled at once, bounded by semaphores"""
+        twin = self.twin
+        twin.log_always("🔍 Starting async user analysis...")
+        try:
+            users_response = await self.supabase_execute(lambda db: db.table('users').select('id, email'))
+            users = users_response.data or []
+            twin.log_always("✅ Found %s users to process", len(users))
+            if not users:
+                return "No users found to process"
+
+            async def bounded(user):
+                async with self._semaphores['users']:
+                    # Users still waiting when a circuit opens are left for the next cycle
+                    if twin.defer_for_open_circuit('analyze', 'supabase', 'cohere'):
+                        return 'deferred'
+                    return await self.process_user_with_cohere(user['id'], user.get('email'))
+
+            outcomes = await asyncio.gather(*(bounded(user) for user in users))
+            twin.record_pipeline_cycle('analyze', {outcome: outcomes.count(outcome) for outcome in ('summarized', 'skipped', 'deferred', 'error')})
+            await asyncio.to_thread(twin.flush_usage_ledger)
+            if outcomes.count('deferred'):
+                twin.log_warning("⏸️ Deferred %d/%d users to the next cycle (open circuits)", outcomes.count('deferred'), len(users))
+            twin.log_always("🎉 All users processed!")
+            return f"✅ Successfully processed {len(users)} users with asyncio"
+        except Exception as error:
+            twin.log_error('💥 Fatal error in async analyze_all_users: %s', error)
+            return f"Fatal error: {error}"
+
+    # ----------------------------------------------------------- #
+    # Summaries pipeline
+    # ----------------------------------------------------------- #
+
+    async def mark_summaries_processed(self, user_id: str, summary_ids: list) -> int:
+        if not summary_ids:
+            return 0
+        try:
+            update_response = await self.supabase_execute(
+                lambda db: db.table('summaries').update({'processed': True}).in_('id', summary_ids)
+            )
+            if update_response.data:
+                self.twin.mark_watermark_summaries_processed(user_id, summary_ids)
+                return len(summary_ids)
+        except Exception as e:
+            self.twin.log_verbose("❌ [async] Error marking summaries as processed for %s...: %s", user_id[:8], e)
+        return 0
+
+    async def process_single_user_summaries(self, user: dict, user_summaries: dict, history_harvest) -> dict:
+        """Async process_single_user_summaries() on a prefetched page result"""
+        twin = self.twin
+        user_id = user['id']
+        user_email = user.get('email', 'No email')
+        user_phone = user.get('phone_number')
+        user_label = user_email if user_email != 'No email' else user_id[:8] + "..."
+        twin.bind_log_context(user_id=user_id)
+
+        base_result = {
+            'user_id': user_id,
+            'user_email': user_email,
+            'user_phone': user_phone,
+            'summaries_count': 0,
+            'unprocessed_count': 0,
+            'agent_execution': None
+        }
+        if not user_phone:
+            return {**base_result, 'success': False, 'error': 'No phone number available'}
+        if not user_summaries or not user_summaries.get('success'):
+            return {**base_result, 'success': False, 'error': (user_summaries or {}).get('error', 'Error fetching summaries')}
+
+        try:
+            summaries = user_summaries['summaries']
+            unprocessed_summaries = user_summaries['unprocessed_summaries']
+            user_result = {
+                **base_result,
+                'success': True,
+                'summaries_count': user_summaries['summaries_count'],
+                'unprocessed_count': user_summaries['unprocessed_count'],
+                'message_history_count': 0,
+                'message_history_fetched': False,
+                'summaries': summaries
+            }
+
+            if not unprocessed_summaries:
+                twin.record_context_fetch('message_history', fetched=False)
+                return user_result
+
+            unprocessed_ids = [s['id'] for s in unprocessed_summaries]
+            new_summaries_text = twin.build_summary_context_texts(unprocessed_summaries)['new_summaries_text']
+            processed_summaries_text = user_summaries.get('processed_summaries_text')
+            if processed_summaries_text is None:
+                processed_summaries_text = twin.build_summary_context_texts(summaries)['processed_summaries_text']
+
+            novelty = twin.measure_summary_novelty(new_summaries_text, [processed_summaries_text])
+            message_history = None
+            if novelty >= twin.SUMMARY_NOVELTY_THRESHOLD:
+                harvest = await asyncio.to_thread(history_harvest.get)
+                message_history = twin.get_message_history_from_harvest(harvest, user_phone, limit=20) \
+                    if twin.harvest_covers_history(harvest, user_phone, 20) else await self.get_message_history(user_phone, limit=20)
+                twin.record_context_fetch('message_history', fetched=True)
+                user_result['message_history_fetched'] = True
+                user_result['message_history_count'] = message_history.get('total_messages', 0) if message_history.get('success') else 0
+                if message_history.get('success'):
+                    novelty = twin.measure_summary_novelty(
+                        new_summaries_text,
+                        [processed_summaries_text] + twin.recent_outbound_texts(message_history)
+                    )
+            else:
+                twin.record_context_fetch('message_history', fetched=False)
+            user_result['novelty_score'] = round(novelty, 3)
+
+            agent_prompt = twin.build_summary_agent_prompt(
+                twin.build_summary_conversation_context(message_history),
+                processed_summaries_text,
+                new_summaries_text
+            )
+
+            if novelty < twin.SUMMARY_NOVELTY_THRESHOLD:
+                user_result['novelty_skipped'] = True
+                user_result['novelty_tokens_saved'] = twin.estimate_tokens(agent_prompt)
+                user_result['summaries_marked_processed'] = await self.mark_summaries_processed(user_id, unprocessed_ids)
+                return user_result
+
+            budget = await asyncio.to_thread(twin.get_usage_budget, user_id, 'proactive')
+            user_result['usage_tier'] = budget['tier']
+            if not budget['proactive_allowed']:
+                # Left unprocessed, not deferred: they leave the 24h window before the cap resets
+                twin.log_always("💸 [async] %s reached today's usage cap, dropping proactive texts for these summaries", user_label)
+                user_result['usage_skipped'] = True
+                return user_result
+            if twin.defer_for_open_circuit('summaries', 'cohere'):
+                # Left unprocessed: the next cycle picks them up once Cohere recovers
+                twin.log_warning("⏸️ [async] Cohere circuit open, deferring %s to the next cycle", user_label)
+                user_result['deferred'] = True
+                return user_result
+
+            started_at = time.perf_counter()
+            try:
+                answer = twin.extract_response_text(await self.cohere_chat(
+                    model=twin.ROUTING_TRIAGE_MODEL,
+                    messages=[{'role': 'user', 'content': twin.build_proactive_triage_prompt(new_summaries_text, processed_summaries_text)}],
+                    temperature=0
+                )).strip()
+                routing = twin.parse_proactive_triage_answer(answer)
+            except Exception as e:
+                routing = {'route': 'full', 'tier': 'triage', 'reason': f'triage failed: {e}'}
+            twin.record_routing_latency('triage', time.perf_counter() - started_at)
+            twin.record_routing_decision('proactive', routing['route'])
+            user_result['routing'] = routing
+
+            if routing['route'] == 'skip':
+                user_result['summaries_marked_processed'] = await self.mark_summaries_processed(user_id, unprocessed_ids)
+                return user_result
+
+            twin.log_always("🤖 [async] Executing Cohere agent for %s with %s unprocessed summaries", user_label, len(unprocessed_ids))
+            started_at = time.perf_counter()
+            agent_result = await self.execute_cohere_agent(agent_prompt, user_phone, model=budget['agent_model'])
+            twin.record_routing_latency('full_agent', time.perf_counter() - started_at)
+            user_result['agent_execution'] = agent_result
+            if agent_result.get('success', False):
+                user_result['summaries_marked_processed'] = await self.mark_summaries_processed(user_id, unprocessed_ids)
+            return user_result
+
+        except twin.CircuitOpenError as e:
+            twin.log_warning("⏸️ [async] Deferred %s to the next cycle: %s", user_label, e)
+            twin.record_circuit_deferral('summaries', e.service)
+            return {**base_result, 'success': False, 'deferred': True, 'error': str(e)}
+        except Exception as e:
+            twin.log_error('💥 [async] Error processing summaries for %s: %s', user_label, str(e))
+            return {**base_result, 'success': False, 'error': str(e)}
+
+    async def process_user_summaries(self) -> dict:
+        """Async process_user_summaries(): pages of users are fetched and processed concurrently"""
+        from datetime import datetime, timedelta, timezone
+        twin = self.twin
+        twin.log_always("🔍 Starting async user summaries processing...")
+
+        try:
+            window_end = datetime.now(timezone.utc)
+            window_start_timestamp = (window_end - timedelta(hours=24)).isoformat()
+            window_end_timestamp = window_end.isoformat()
+
+            users_response = await self.supabase_execute(lambda db: db.table('users').select('id, email, phone_number'))
+            users = users_response.data or []
+            twin.log_always("✅ Found %s users to process", len(users))
+            if not users:
+                return {'success': True, 'message': 'No users found', 'results': []}
+
+            history_since = window_end - timedelta(hours=twin.MESSAGE_HISTORY_HARVEST_HOURS)
+            history_harvest = twin.LazyContext('message_history_harvest', lambda: twin.harvest_message_history(history_since))
+
+            async def run_page(page_users):
+                # Watermark bookkeeping is shared with the threaded engine, so page reads reuse it
+                page_summaries = await asyncio.to_thread(
+                    twin.get_incremental_summaries_for_users,
+                    [u for u in page_users if u.get('phone_number')],
+                    window_start_timestamp,
+                    window_end_timestamp
+                )
+
+                async def bounded(user):
+                    async with self._semaphores['users']:
+                        deferred_by = twin.defer_for_open_circuit('summaries', 'supabase', 'cohere')
+                        if deferred_by:
+                            return {
+                                'user_id': user['id'],
+                                'user_email': user.get('email', 'No email'),
+                                'user_phone': user.get('phone_number'),
+                                'success': False,
+                                'deferred': True,
+                                'error': f"{deferred_by} circuit is open",
+                                'summaries_count': 0,
+                                'unprocessed_count': 0,
+                                'agent_execution': None
+                            }
+                        return await self.process_single_user_summaries(user, page_summaries.get(user['id']), history_harvest)
+
+                return await asyncio.gather(*(bounded(user) for user in page_users))
+
+            page_size = twin.SUMMARY_USER_PAGE_SIZE
+            pages = await asyncio.gather(*(
+                run_page(users[i:i + page_size]) for i in range(0, len(users), page_size)
+            ))
+            history_harvest.close()
+            results = [result for page in pages for result in page]
+
+            agent_runs = [r['agent_execution'] for r in results if r.get('agent_execution')]
+            total_sms_sent = sum(a.get('sms_count', 0) for a in agent_runs)
+            deferred_users = len([r for r in results if r.get('deferred')])
+            twin.record_pipeline_cycle('summaries', {
+                'processed': len(results),
+                'successful': len([r for r in results if r.get('success')]),
+                'with_unprocessed': len([r for r in results if r.get('unprocessed_count', 0) > 0]),
+                'agent_runs': len(agent_runs),
+                'skipped_novelty': len([r for r in results if r.get('novelty_skipped')]),
+                'skipped_triage': len([r for r in results if (r.get('routing') or {}).get('route') == 'skip']),
+                'deferred': deferred_users
+            }, sms_sent=total_sms_sent)
+            await asyncio.to_thread(twin.flush_usage_ledger)
+            if deferred_users:
+                twin.log_warning("⏸️ Deferred %s users to the next cycle (open circuits)", deferred_users)
+            twin.log_always("🎉 Async processing complete! %s agent runs, %s SMS sent", len(agent_runs), total_sms_sent)
+
+            return {
+                'success': True,
+                'engine': 'async',
+                'total_users': len(users),
+                'processed_users': len(results),
+                'successful_users': len([r for r in results if r.get('success')]),
+                'total_summaries': sum(r.get('summaries_count', 0) for r in results),
+                'total_unprocessed': sum(r.get('unprocessed_count', 0) for r in results),
+                'users_with_unprocessed': len([r for r in results if r.get('unprocessed_count', 0) > 0]),
+                'successful_agent_executions': len([a for a in agent_runs if a.get('success')]),
+                'total_sms_sent': total_sms_sent,
+                'novelty_skipped': len([r for r in results if r.get('novelty_skipped')]),
+                'triage_skipped': len([r for r in results if (r.get('routing') or {}).get('route') == 'skip']),
+                'summaries_marked_processed': sum(r.get('summaries_marked_processed', 0) for r in results),
+                'deferred_users': deferred_users,
+                'circuit_breakers': twin.get_circuit_breaker_states(),
+                'context_fetch_counters': twin.get_context_fetch_counters(),
+                'time_range': f"Past 24 hours (since {window_start_timestamp})",
+                'results': results
+            }
+        except Exception as error:
+            twin.log_error('💥 Fatal error in async process_user_summaries: %s', error)
+            return {'success': False, 'error': f"Fatal error: {str(error)}"}
+
+    # ----------------------------------------------------------- #
+    # Inbound SMS
+    # ----------------------------------------------------------- #
+
+    async def respond_with_full_agent(self, incoming_msg: str, sender_number: str, message_history: dict, max_iterations: int = 5, acknowledgement_sent: str = None, budget: dict = None) -> dict:
+        """Async respond_with_full_agent(): learning context is read concurrently with nothing blocking the webhook"""
+        from datetime import datetime, timedelta, timezone
+        twin = self.twin
+
+        user_summaries = None
+        try:
+            # sms_reply's gate check has normally just cached this row
+            user = twin.cached_user_record(sender_number)
+            if user is None:
+                user_response = await self.supabase_execute(
+                    lambda db: db.table('users').select('id, email, phone_number').eq('phone_number', sender_number)
+                )
+                user = user_response.data[0] if user_response.data else None
+            if user:
+                twin.bind_log_context(user_id=user['id'])
+                if budget is None:
+                    budget = await asyncio.to_thread(twin.get_usage_budget, user['id'], 'inbound')
+                end_time = datetime.now(timezone.utc)
+                start_timestamp = (end_time - timedelta(hours=36)).isoformat()
+                summaries_response = await self.supabase_execute(
+                    lambda db: db.table('summaries')
+                        .select('id, user_id, summary, prompt_generated_at, cohere_finish_reason, cohere_usage, source_activity_ids, processed')
+                        .eq('user_id', user['id'])
+                        .gte('prompt_generated_at', start_timestamp)
+                        .lte('prompt_generated_at', end_time.isoformat())
+                        .order('prompt_generated_at', desc=True)
+                )
+                formatted = twin.format_summary_rows(summaries_response.data or [])
+                user_summaries = {
+                    'success': True,
+                    'user_found': True,
+                    'user_info': user,
+                    'summaries_count': len(formatted['summaries']),
+                    'unprocessed_count': len(formatted['unprocessed_summaries']),
+                    **formatted
+                }
+        except Exception as e:
+            twin.log_warning("⚠️ [async] Could not load learning context for %s: %s", sender_number, e)
+
+        if budget is None:
+            budget = twin.get_usage_budget(None)
+
+        context_prompt = twin.create_intelligent_response_prompt(
+            incoming_message=incoming_msg,
+            sender_number=sender_number,
+            message_history=message_history if message_history and message_history.get('success') else None,
+            user_summaries=user_summaries,
+            token_budget=budget['context_token_budget'],
+            acknowledgement_sent=acknowledgement_sent
+        )
+
+        started_at = time.perf_counter()
+        try:
+            agent_result = await self.execute_cohere_agent(context_prompt, to_number=sender_number, max_iterations=max_iterations, model=budget['agent_model'], acknowledgement_pending=not acknowledgement_sent)
+        except twin.CircuitOpenError as e:
+            # The TwiML already went out, so the fallback goes by the API instead
+            twin.log_warning("⏸️ [async] %s, texting the fallback reply", e)
+            twin.record_circuit_deferral('inbound', e.service)
+            twin.record_routing_decision('inbound', 'fallback')
+            await self.send_sms(twin.CIRCUIT_FALLBACK_SMS, sender_number)
+            return {'success': False, 'deferred': True, 'error': str(e)}
+        twin.record_routing_latency('full_agent', time.perf_counter() - started_at)
+        return agent_result
@@ -0,0 +1,1127 @@
+#!/usr/bin/env python3
+"""
+Offline Benchmark Harness for the Twin pipelines
+
+Runs analyze_all_users, process_user_summaries and the /sms webhook against
+in-process stand-ins for Supabase, Cohere, Twilio and the web. The stand-ins
+return realistic payloads after log-normal latencies, so throughput, p50/p99
+latency and external calls per user can be measured without live services
+or API spend.
+
+Usage:
+    python benchmark.py                                  # every scenario
+    python benchmark.py --scenario sms-burst --engine async
+    python benchmark.py --users 500 --latency-scale 0.05 --json results.json
+    python benchmark.py --baseline results.json          # exit 1 on a regression
+
+Scenarios and their data are seeded (--seed), so two runs of the same
+revision see the same users, backlogs and inbound texts.
+
+Dependencies:
+    - flask (app.py is imported; its API clients are replaced before first use)
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+# Keep the pipelines' own logging out of the report; nothing below talks to a real service
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('TWILIO_PHONE_NUMBER', '+15550000000')
+
+import app as twin
+
+# Median and p99 latency (milliseconds) per dependency, before --latency-scale
+LATENCY_PROFILES = {
+    'supabase': (25, 150),
+    'cohere': (2200, 7000),
+    'cohere_triage': (300, 1100),
+    'twilio_create': (180, 650),
+    'twilio_list': (220, 900),
+    'web': (450, 2500),
+}
+
+SCENARIOS = {
+    'mixed-backlog-10k': {
+        'pipeline': 'analyze',
+        'description': '10k users with mixed activity backlogs (analyze_all_users)',
+        'users': 10000,
+        # (share of users, min activities, max activities)
+        'backlog_mix': [(0.45, 0, 0), (0.35, 1, 6), (0.15, 7, 25), (0.05, 26, 80)],
+        'recently_active_share': 0.1,  # Skipped by the inactivity check
+    },
+    'summaries-10k': {
+        'pipeline': 'summaries',
+        'description': '10k users with new, repeated and no summaries (process_user_summaries)',
+        'users': 10000,
+        # (share of users, new summaries, processed summaries, repeat processed text)
+        'summary_mix': [(0.40, 0, 2, False), (0.35, 2, 2, False), (0.15, 2, 3, True), (0.10, 5, 0, False)],
+        'history_messages': (0, 30),
+    },
+    'sms-burst': {
+        'pipeline': 'sms',
+        'description': 'Bursty inbound SMS through the /sms webhook',
+        'users': 500,
+        'messages': 2000,
+        'burst_size': 50,
+        'burst_gap_seconds': 1.0,
+        'new_number_share': 0.02,  # Unknown senders go through onboarding
+        'message_mix': {'acknowledgement': 0.30, 'question': 0.40, 'link': 0.15, 'ambiguous': 0.15},
+        'history_messages': (0, 30),
+    },
+}
+
+LEARNING_RESOURCES = [
+    ('react.dev', 'Synchronizing with Effects', 'https://react.dev/learn/synchronizing-with-effects'),
+    ('react.dev', 'useLayoutEffect', 'https://react.dev/reference/react/useLayoutEffect'),
+    ('youtube.com', 'React Hooks Explained', 'https://www.youtube.com/watch?v=TNhaISOUy6Q'),
+    ('developer.mozilla.org', 'Using Promises', 'https://developer.mozilla.org/en-US/docs/Web/JavaScript/Guide/Using_promises'),
+    ('docs.python.org', 'asyncio — Asynchronous I/O', 'https://docs.python.org/3/library/asyncio.html'),
+    ('youtube.com', 'Python Asyncio Tutorial', 'https://www.youtube.com/watch?v=t5Bo1Je9EmE'),
+    ('postgresql.org', 'Indexes', 'https://www.postgresql.org/docs/current/indexes.html'),
+    ('en.wikipedia.org', 'B-tree', 'https://en.wikipedia.org/wiki/B-tree'),
+    ('khanacademy.org', 'Eigenvalues and eigenvectors', 'https://www.khanacademy.org/math/linear-algebra/alternate-bases'),
+    ('youtube.com', 'Essence of linear algebra', 'https://www.youtube.com/watch?v=fNk_zzaMoSs'),
+    ('stackoverflow.com', 'What is a closure?', 'https://stackoverflow.com/questions/111102/how-do-javascript-closures-work'),
+    ('kubernetes.io', 'Pods', 'https://kubernetes.io/docs/concepts/workloads/pods/'),
+]
+
+LEARNING_TOPICS = [
+    'React effect cleanup and dependency arrays', 'useLayoutEffect versus useEffect timing',
+    'JavaScript promise chaining and error propagation', 'Python asyncio event loops and tasks',
+    'PostgreSQL B-tree and partial indexes', 'eigenvectors as invariant directions of a transform',
+    'closures capturing loop variables', 'Kubernetes pod scheduling and probes',
+    'CSS grid auto-placement', 'gradient descent learning rates', 'TCP congestion control',
+    'Rust ownership and borrowing', 'SQL window functions', 'binary search invariants',
+]
+
+INBOUND_MESSAGES = {
+    'acknowledgement': ['ok thanks', 'lol', 'bet', 'thank you!!', 'got it', 'nice', 'kk'],
+    'question': [
+        "what's the difference between useEffect and useLayoutEffect?",
+        'why does my promise chain swallow errors?',
+        'how do partial indexes work in postgres?',
+        'can you explain eigenvectors like im 5?',
+        'should i use asyncio.gather or TaskGroup?',
+    ],
+    'link': [
+        'check this out https://react.dev/learn/synchronizing-with-effects',
+        'is this video any good https://www.youtube.com/watch?v=t5Bo1Je9EmE',
+        'reading https://www.postgresql.org/docs/current/indexes.html rn',
+    ],
+    'ambiguous': ['hmm hooks', 'react again', 'still stuck', 'closures tho', 'ugh indexes'],
+}
+
+
+# =============================================================== #
+# Latency & call accounting
+# =============================================================== #
+
+class LatencyModel:
+    """Log-normal latency fitted to a median and p99 (milliseconds), scaled for faster runs"""
+
+    def __init__(self, median_ms: float, p99_ms: float, rng: random.Random, scale: float = 1.0):
+        self.mu = math.log(median_ms / 1000)
+        self.sigma = math.log(p99_ms / median_ms) / 2.326
+        self.scale = scale
+        self._rng = rng
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        with self._lock:
+            return self._rng.lognormvariate(self.mu, self.sigma) * self.scale
+
+    def wait(self):
+        time.sleep(self.sample())
+
+    async def wait_async(self):
+        await asyncio.sleep(self.sample())
+
+class CallCounter:
+    """Thread-safe tally of external calls ('service.operation') and Cohere tokens"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.tokens = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, key: str, tokens: dict = None):
+        with self._lock:
+            self.calls[key] += 1
+            for direction, count in (tokens or {}).items():
+                self.tokens[direction] += count
+
+def percentile(samples: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of seconds, returned in milliseconds"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return round(ordered[index] * 1000, 1)
+
+
+# =============================================================== #
+# Supabase stand-in (in-memory PostgREST table layer)
+# =============================================================== #
+
+def split_top_level(expression: str) -> list:
+    """Split a PostgREST filter list on commas that are not inside parentheses or quotes"""
+    parts, depth, quoted, current = [], 0, False, ''
+    for char in expression:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        if char == ',' and depth == 0 and not quoted:
+            parts.append(current)
+            current = ''
+        else:
+            current += char
+    if current:
+        parts.append(current)
+    return parts
+
+def parse_or_filter(expression: str) -> list:
+    """
+    Parse a PostgREST or=(...) expression
+
+    Returns:
+        list: One list of (column, op, value) conditions per OR branch
+    """
+    def parse_condition(condition):
+        column, op, value = condition.split('.', 2)
+        if op == 'in':
+            return (column, 'in', value.strip('()').split(','))
+        return (column, op, value.strip('"'))
+
+    branches = []
+    for term in split_top_level(expression):
+        if term.startswith('and(') and term.endswith(')'):
+            branches.append([parse_condition(c) for c in split_top_level(term[4:-1])])
+        else:
+            branches.append([parse_condition(term)])
+    return branches
+
+def matches_condition(row: dict, column: str, op: str, value) -> bool:
+    """Evaluate one PostgREST operator against a row"""
+    row_value = row.get(column)
+    if isinstance(row_value, bool) and isinstance(value, str):
+        row_value = 'true' if row_value else 'false'
+    if op == 'eq':
+        return row_value == value
+    if op == 'neq':
+        return row_value != value
+    if op == 'in':
+        return row_value in value
+    if row_value is None:
+        return False
+    if op == 'gt':
+        return row_value > value
+    if op == 'gte':
+        return row_value >= value
+    if op == 'lt':
+        return row_value < value
+    if op == 'lte':
+        return row_value <= value
+    raise ValueError(f"Unsupported filter operator: {op}")
+
+class FakeSupabase:
+    """
+    In-memory stand-in for the Supabase client's table() query builder
+
+    Rows live in per-table lists with hash indexes on id, user_id and
+    phone_number, so 10k-user scenarios don't degrade into full scans.
+    An async view shares the same tables for the asyncio engine.
+    """
+
+    INDEXED_COLUMNS = ('id', 'user_id', 'phone_number')
+
+    def __init__(self, latency: LatencyModel, counter: CallCounter, is_async: bool = False, _shared=None):
+        self.latency = latency
+        self.counter = counter
+        self.is_async = is_async
+        self._state = _shared or {'tables': {}, 'indexes': {}, 'lock': threading.Lock()}
+
+    def async_view(self):
+        return FakeSupabase(self.latency, self.counter, is_async=True, _shared=self._state)
+
+    def table(self, name: str):
+        return FakeQuery(self, name)
+
+    def load(self, name: str, rows: list):
+        with self._state['lock']:
+            self._state['tables'].setdefault(name, []).extend(rows)
+            self._rebuild_indexes(name)
+
+    def rows(self, name: str) -> list:
+        return self._state['tables'].get(name, [])
+
+    def _rebuild_indexes(self, name: str):
+        indexes = {column: {} for column in self.INDEXED_COLUMNS}
+        for row in self._state['tables'].get(name, []):
+            for column, index in indexes.items():
+                if row.get(column) is not None:
+                    index.setdefault(row[column], []).append(row)
+        self._state['indexes'][name] = indexes
+
+    def _candidates(self, name: str, filters: list) -> list:
+        indexes = self._state['indexes'].get(name, {})
+        for column, op, value in filters:
+            if column in indexes and op == 'eq':
+                return list(indexes[column].get(value, []))
+            if column in indexes and op == 'in':
+                return [row for v in dict.fromkeys(value) for row in indexes[column].get(v, [])]
+        return list(self._state['tables'].get(name, []))
+
+class FakeQuery:
+    """Chainable query matching the subset of postgrest-py the app uses"""
+
+    def __init__(self, db: FakeSupabase, table_name: str):
+        self.db = db
+        self.table_name = table_name
+        self.operation = 'select'
+        self.payload = None
+        self.filters = []
+        self.or_branches = None
+        self.order_by = []
+        self.row_limit = None
+        self.row_range = None
+
+    def select(self, columns: str = '*', **kwargs):
+        return self
+
+    def insert(self, payload):
+        self.operation, self.payload = 'insert', payload
+        return self
+
+    def update(self, payload: dict):
+        self.operation, self.payload = 'update', payload
+        return self
+
+    def upsert(self, payload, **kwargs):
+        self.operation, self.payload = 'upsert', payload
+        return self
+
+    def delete(self):
+        self.operation = 'delete'
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, 'eq', value))
+        return self
+
+    def neq(self, column, value):
+        self.filters.append((column, 'neq', value))
+        return self
+
+    def in_(self, column, values):
+        self.filters.append((column, 'in', list(values)))
+        return self
+
+    def gt(self, column, value):
+        self.filters.append((column, 'gt', value))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append((column, 'gte', value))
+        return self
+
+    def lt(self, column, value):
+        self.filters.append((column, 'lt', value))
+        return self
+
+    def lte(self, column, value):
+        self.filters.append((column, 'lte', value))
+        return self
+
+    def or_(self, expression: str):
+        self.or_branches = parse_or_filter(expression)
+        return self
+
+    def order(self, column, desc: bool = False):
+        self.order_by.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self.row_limit = count
+        return self
+
+    def range(self, start: int, end: int):
+        self.row_range = (start, end)
+        return self
+
+    def execute(self):
+        self.db.counter.add(f"supabase.{self.operation}")
+        if self.db.is_async:
+            return self._execute_async()
+        self.db.latency.wait()
+        return self._apply()
+
+    async def _execute_async(self):
+        await self.db.latency.wait_async()
+        return self._apply()
+
+    def _matches(self, row: dict) -> bool:
+        if not all(matches_condition(row, *condition) for condition in self.filters):
+            return False
+        if self.or_branches is not None:
+            return any(all(matches_condition(row, *c) for c in branch) for branch in self.or_branches)
+        return True
+
+    def _apply(self):
+        state = self.db._state
+        with state['lock']:
+            rows = state['tables'].setdefault(self.table_name, [])
+
+            if self.operation in ('insert', 'upsert'):
+                payload = self.payload if isinstance(self.payload, list) else [self.payload]
+                inserted = []
+                for item in payload:
+                    row = dict(item)
+                    row.setdefault('id', str(uuid.uuid4()))
+                    rows.append(row)
+                    inserted.append(dict(row))
+                if len(payload) == 1:
+                    self._index_row(rows[-1])
+                else:
+                    self.db._rebuild_indexes(self.table_name)
+                return SimpleNamespace(data=inserted, count=None)
+
+            matched = [row for row in self.db._candidates(self.table_name, self.filters) if self._matches(row)]
+
+            if self.operation == 'update':
+                for row in matched:
+                    row.update(self.payload)
+                if any(column in self.payload for column in FakeSupabase.INDEXED_COLUMNS):
+                    self.db._rebuild_indexes(self.table_name)
+            elif self.operation == 'delete':
+                doomed = {id(row) for row in matched}
+                state['tables'][self.table_name] = [row for row in rows if id(row) not in doomed]
+                self.db._rebuild_indexes(self.table_name)
+
+            for column, desc in reversed(self.order_by):  # Stable sorts, last key first
+                matched.sort(key=lambda row: (row.get(column) is not None, row.get(column) or ''), reverse=desc)
+            if self.row_range is not None:
+                matched = matched[self.row_range[0]:self.row_range[1] + 1]
+            if self.row_limit is not None:
+                matched = matched[:self.row_limit]
+
+            return SimpleNamespace(data=[dict(row) for row in matched], count=len(matched))
+
+    def _index_row(self, row: dict):
+        indexes = self.db._state['indexes'].setdefault(self.table_name, {c: {} for c in FakeSupabase.INDEXED_COLUMNS})
+        for column, index in indexes.items():
+            if row.get(column) is not None:
+                index.setdefault(row[column], []).append(row)
+
+
+# =============================================================== #
+# Cohere stand-in (chat and tool-call simulator)
+# =============================================================== #
+
+URL_IN_TEXT_PATTERN = re.compile(r'https?://[^\s"\'<>)\]]+')
+
+def _text_content(text: str) -> list:
+    return [SimpleNamespace(type='text', text=text)]
+
+def _tool_call(name: str, arguments: dict):
+    return SimpleNamespace(
+        id=f"call_{uuid.uuid4().hex[:12]}",
+        type='function',
+        function=SimpleNamespace(name=name, arguments=json.dumps(arguments))
+    )
+
+class FakeCohere:
+    """
+    Stand-in for cohere.ClientV2 / AsyncClientV2 chat()
+
+    Answers the triage prompts (LIGHT/FULL, TEXT/SKIP), returns learning-graph
+    JSON for json_object requests, and plays a short agent turn when tools are
+    offered: optionally research a link, send one or two texts, then call
+    done (or answer in text when no done tool is offered).
+    """
+
+    def __init__(self, latencies: dict, counter: CallCounter, rng: random.Random, is_async: bool = False):
+        self.latencies = latencies
+        self.counter = counter
+        self._rng = rng
+        self._rng_lock = threading.Lock()
+        if is_async:
+            self.chat = self._chat_async
+
+    def chat(self, model: str, messages: list, tools: list = None, **kwargs):
+        self._latency(model).wait()
+        return self._respond(model, messages, tools, kwargs)
+
+    async def _chat_async(self, model: str, messages: list, tools: list = None, **kwargs):
+        await self._latency(model).wait_async()
+        return self._respond(model, messages, tools, kwargs)
+
+    def _latency(self, model: str) -> LatencyModel:
+        return self.latencies['cohere_triage' if model == twin.ROUTING_TRIAGE_MODEL else 'cohere']
+
+    def _random(self) -> float:
+        with self._rng_lock:
+            return self._rng.random()
+
+    def _respond(self, model, messages, tools, kwargs):
+        prompt = '\n'.join(str(m.get('content') or '') for m in messages if isinstance(m, dict) and m.get('role') == 'user')
+
+        if tools:
+            content, tool_calls = self._agent_step(prompt, messages, tools)
+        elif (kwargs.get('response_format') or {}).get('type') == 'json_object':
+            content, tool_calls = _text_content(self._learning_graph(prompt)), None
+        elif 'LIGHT or FULL' in prompt:
+            content, tool_calls = _text_content('LIGHT' if self._random() < 0.4 else 'FULL'), None
+        elif 'TEXT or SKIP' in prompt:
+            content, tool_calls = _text_content('SKIP' if self._random() < 0.3 else 'TEXT'), None
+        else:
+            content, tool_calls = _text_content('haha np!! lmk if anything else comes up 🙌'), None
+
+        input_tokens = sum(len(str(m.get('content') or '')) for m in messages if isinstance(m, dict)) // 4
+        output_tokens = 40 + int(self._random() * 260)
+        self.counter.add('cohere.chat', {'input': input_tokens, 'output': output_tokens})
+        usage = SimpleNamespace(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens,
+            billed_units=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens)
+        )
+        return SimpleNamespace(
+            message=SimpleNamespace(content=content, tool_calls=tool_calls, tool_plan='Answering the student.' if tool_calls else None),
+            finish_reason='TOOL_CALL' if tool_calls else 'COMPLETE',
+            usage=usage
+        )
+
+    def _agent_step(self, prompt: str, messages: list, tools: list):
+        tool_names = {(t.get('function') or t).get('name') for t in tools if isinstance(t, dict)}
+        called = [
+            call.function.name
+            for m in messages if isinstance(m, dict) and m.get('role') == 'assistant'
+            for call in (m.get('tool_calls') or [])
+        ]
+        texts = [
+            "ok so here's the tea on that 👀",
+            'basically the cleanup runs before the next effect fires ✨',
+            'try it with a tiny example first, it clicks fast 💡',
+        ]
+
+        if not called:
+            urls = URL_IN_TEXT_PATTERN.findall(prompt)
+            if urls and self._random() < 0.6:
+                url = urls[0]
+                if 'youtube.com' in url or 'youtu.be' in url:
+                    if 'get_youtube_transcript' in tool_names:
+                        return None, [_tool_call('get_youtube_transcript', {'youtube_url': url})]
+                elif 'scrape_website_info' in tool_names:
+                    return None, [_tool_call('scrape_website_info', {'url': url})]
+            if self._random() < 0.15:
+                return _text_content("Nothing new worth texting about right now."), None
+
+        if 'send_sms' not in called:
+            count = 1 if self._random() < 0.5 else 2
+            return None, [_tool_call('send_sms', {'message_body': body}) for body in texts[:count]]
+
+        if 'done' in tool_names:
+            return None, [_tool_call('done', {})]
+        return _text_content('Sent!'), None
+
+    def _learning_graph(self, prompt: str) -> str:
+        urls = list(dict.fromkeys(URL_IN_TEXT_PATTERN.findall(prompt)))[:3]
+        return json.dumps({
+            'learning_graph': {
+                'main_topics': ['effects and lifecycles', 'async control flow'],
+                'connections': ['cleanup semantics ↔ resource ownership'],
+            },
+            'key_resources': {
+                'for_ai_analysis': [{'url': url, 'priority': 'high' if i == 0 else 'medium'} for i, url in enumerate(urls)],
+                'high_value': [{'url': url} for url in urls[:1]],
+            },
+            'summary': 'The student moved from React effect timing into cleanup and dependency arrays.',
+        })
+
+
+# =============================================================== #
+# Twilio stand-in (messages resource)
+# =============================================================== #
+
+class FakeTwilioMessage:
+    """The MessageInstance attributes format_twilio_message() reads"""
+
+    def __init__(self, body: str, from_: str, to: str, direction: str, date_created: datetime):
+        self.sid = f"SM{uuid.uuid4().hex}"
+        self.body = body
+        self.from_ = from_
+        self.to = to
+        self.direction = direction
+        self.status = 'delivered' if direction == 'inbound' else 'queued'
+        self.date_created = date_created
+        self.date_sent = date_created
+        self.num_media = '0'
+
+class FakeTwilioMessages:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def __getattr__(self, name):
+        return getattr(self._owner, f"messages_{name}")
+
+class FakeTwilio:
+    """
+    Stand-in for twilio.rest.Client's messages resource (create, list, page)
+
+    Messages are kept newest-last and indexed by sender and recipient.
+    """
+
+    def __init__(self, latencies: dict, counter: CallCounter, _shared=None):
+        self.latencies = latencies
+        self.counter = counter
+        self._state = _shared or {'all': [], 'from': {}, 'to': {}, 'lock': threading.Lock()}
+        self.messages = FakeTwilioMessages(self)
+
+    def async_view(self):
+        return FakeTwilio(self.latencies, self.counter, _shared=self._state)
+
+    def add(self, message: FakeTwilioMessage):
+        with self._state['lock']:
+            self._state['all'].append(message)
+            self._state['from'].setdefault(message.from_, []).append(message)
+            self._state['to'].setdefault(message.to, []).append(message)
+
+    def sent_count(self) -> int:
+        return self.counter.calls['twilio.messages.create']
+
+    def _create(self, body: str, from_: str, to: str):
+        message = FakeTwilioMessage(body, from_, to, 'outbound-api', datetime.now(timezone.utc))
+        self.add(message)
+        return message
+
+    def _list(self, from_: str = None, to: str = None, limit: int = 50, **kwargs):
+        with self._state['lock']:
+            if from_:
+                found = self._state['from'].get(from_, [])
+            elif to:
+                found = self._state['to'].get(to, [])
+            else:
+                found = self._state['all']
+            return list(reversed(found[-limit:] if limit else found))
+
+    def messages_create(self, body: str, from_: str, to: str, **kwargs):
+        self.counter.add('twilio.messages.create')
+        self.latencies['twilio_create'].wait()
+        return self._create(body, from_, to)
+
+    async def messages_create_async(self, body: str, from_: str, to: str, **kwargs):
+        self.counter.add('twilio.messages.create')
+        await self.latencies['twilio_create'].wait_async()
+        return self._create(body, from_, to)
+
+    def messages_list(self, **kwargs):
+        self.counter.add('twilio.messages.list')
+        self.latencies['twilio_list'].wait()
+        return self._list(**kwargs)
+
+    async def messages_list_async(self, **kwargs):
+        self.counter.add('twilio.messages.list')
+        await self.latencies['twilio_list'].wait_async()
+        return self._list(**kwargs)
+
+    def messages_page(self, date_sent_after: datetime = None, page_size: int = 50, **kwargs):
+        with self._state['lock']:
+            found = [m for m in self._state['all'] if date_sent_after is None or m.date_sent > date_sent_after]
+        found.reverse()
+        return FakeTwilioPage(self, found, 0, page_size)
+
+class FakeTwilioPage:
+    """One page of a messages.page() sweep; next_page() fetches the following one or returns None"""
+
+    def __init__(self, owner: FakeTwilio, found: list, start: int, page_size: int):
+        owner.counter.add('twilio.messages.page')
+        owner.latencies['twilio_list'].wait()
+        self._owner = owner
+        self._found = found
+        self._start = start
+        self._page_size = page_size
+
+    def __iter__(self):
+        return iter(self._found[self._start:self._start + self._page_size])
+
+    def next_page(self):
+        next_start = self._start + self._page_size
+        if next_start >= len(self._found):
+            return None
+        return FakeTwilioPage(self._owner, self._found, next_start, self._page_size)
+
+
+# =============================================================== #
+# Web stand-in (pages and transcripts)
+# =============================================================== #
+
+class FakeWeb:
+    """Serves generated page text and transcripts for the scrape/transcript fetchers"""
+
+    def __init__(self, latency: LatencyModel, counter: CallCounter):
+        self.latency = latency
+        self.counter = counter
+
+    @staticmethod
+    def page_text(url: str) -> str:
+        topic = LEARNING_TOPICS[sum(map(ord, url)) % len(LEARNING_TOPICS)]
+        return ' '.join(f"Section {i}: notes on {topic}, with worked examples and caveats." for i in range(60))
+
+    def fetch_page(self, url: str) -> str:
+        self.counter.add('web.page')
+        self.latency.wait()
+        return self.page_text(url)
+
+    def fetch_transcript(self, video_id: str) -> str:
+        self.counter.add('web.transcript')
+        self.latency.wait()
+        return self.page_text(video_id)
+
+    def stream(self, method: str, url: str, **kwargs):
+        return FakeStreamResponse(self, url)
+
+class FakeStreamResponse:
+    """httpx.AsyncClient.stream() response used by the async engine's scraper"""
+
+    def __init__(self, web: FakeWeb, url: str):
+        self.web = web
+        self.url = url
+        self.headers = {'Content-Type': 'text/html; charset=utf-8'}
+
+    async def __aenter__(self):
+        self.web.counter.add('web.page')
+        await self.web.latency.wait_async()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        return None
+
+    async def aiter_bytes(self):
+        yield f"<html><body><main><p>{FakeWeb.page_text(self.url)}</p></main></body></html>".encode()
+
+
+# =============================================================== #
+# Scenario data
+# =============================================================== #
+
+def _uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def _pick_mix(rng: random.Random, mix: list):
+    roll, total = rng.random(), 0.0
+    for entry in mix:
+        total += entry[0]
+        if roll < total:
+            return entry
+    return mix[-1]
+
+def make_users(rng: random.Random, count: int) -> list:
+    return [
+        {
+            'id': _uuid(rng),
+            'email': f"student{i}@example.edu",
+            'phone_number': f"+1555{i:07d}",
+            'name': f"Student {i}",
+            'onboarding_state': 'complete',
+        }
+        for i in range(count)
+    ]
+
+def make_history(rng: random.Random, twilio: FakeTwilio, users: list, message_range: tuple, now: datetime):
+    low, high = message_range
+    for user in users:
+        for i in range(rng.randint(low, high)):
+            inbound = i % 2 == 0
+            sent_at = now - timedelta(minutes=rng.randint(5, 60 * 70))
+            twilio.add(FakeTwilioMessage(
+                rng.choice(INBOUND_MESSAGES['question'] if inbound else ['oh nice, try the docs example first ✨']),
+                user['phone_number'] if inbound else twin.TWILIO_PHONE_NUMBER,
+                twin.TWILIO_PHONE_NUMBER if inbound else user['phone_number'],
+                'inbound' if inbound else 'outbound-api',
+                sent_at
+            ))
+
+def make_summary_text(rng: random.Random) -> str:
+    topics = rng.sample(LEARNING_TOPICS, 3)
+    resource = rng.choice(LEARNING_RESOURCES)
+    return (f"The student studied {topics[0]}, then {topics[1]}, and briefly {topics[2]}. "
+            f"Key resource: {resource[2]} ({resource[1]}). Next step: practice {topics[0]} with a small example.")
+
+def build_dataset(name: str, config: dict, rng: random.Random, db: FakeSupabase, twilio: FakeTwilio) -> dict:
+    """Load a scenario's seeded users, activities, summaries and message history into the fakes"""
+    now = datetime.now(timezone.utc)
+    users = make_users(rng, config['users'])
+    db.load('users', users)
+
+    if config['pipeline'] == 'analyze':
+        activities = []
+        for user in users:
+            _, low, high = _pick_mix(rng, config['backlog_mix'])
+            recent = rng.random() < config['recently_active_share']
+            for i in range(rng.randint(low, high)):
+                domain, title, url = rng.choice(LEARNING_RESOURCES)
+                age = timedelta(seconds=rng.randint(0, 5)) if recent and i == 0 else timedelta(minutes=rng.randint(2, 600))
+                activities.append({
+                    'id': _uuid(rng), 'user_id': user['id'], 'timestamp': (now - age).isoformat(),
+                    'domain': domain, 'title': title, 'url': url, 'processed': False,
+                })
+        db.load('activities', activities)
+        return {'units': len(users), 'unit': 'users'}
+
+    if config['pipeline'] == 'summaries':
+        summaries = []
+        for user in users:
+            _, new_count, processed_count, repeated = _pick_mix(rng, config['summary_mix'])
+            processed_texts = [make_summary_text(rng) for _ in range(processed_count)]
+            for i, text in enumerate(processed_texts):
+                summaries.append({'text': text, 'processed': True, 'user_id': user['id'], 'age': 600 + i * 90})
+            for i in range(new_count):
+                text = processed_texts[i % len(processed_texts)] if repeated and processed_texts else make_summary_text(rng)
+                summaries.append({'text': text, 'processed': False, 'user_id': user['id'], 'age': 5 + i * 30})
+        db.load('summaries', [
+            {
+                'id': _uuid(rng), 'user_id': s['user_id'],
+                'summary': [{'type': 'text', 'text': s['text']}],
+                'prompt_generated_at': (now - timedelta(minutes=s['age'])).isoformat(),
+                'processed': s['processed'], 'cohere_finish_reason': 'COMPLETE',
+                'cohere_usage': None, 'source_activity_ids': [],
+            }
+            for s in summaries
+        ])
+        make_history(rng, twilio, users, config['history_messages'], now)
+        return {'units': len(users), 'unit': 'users'}
+
+    # sms: inbound texts from known (and a few unknown) numbers
+    make_history(rng, twilio, users, config['history_messages'], now)
+    kinds = list(config['message_mix'].items())
+    inbound = []
+    for i in range(config['messages']):
+        kind = _pick_mix(rng, [(share, kind) for kind, share in kinds])[1]
+        if rng.random() < config['new_number_share']:
+            sender = f"+1666{i:07d}"
+        else:
+            sender = rng.choice(users)['phone_number']
+        inbound.append({'Body': rng.choice(INBOUND_MESSAGES[kind]), 'From': sender,
+                        'To': twin.TWILIO_PHONE_NUMBER, 'MessageSid': f"SM{uuid.UUID(int=rng.getrandbits(128)).hex}"})
+    return {'units': len(inbound), 'unit': 'messages', 'inbound': inbound}
+
+
+# =============================================================== #
+# Runner
+# =============================================================== #
+
+class Patch:
+    """Swap module/object attributes for one scenario and put them back afterwards"""
+
+    def __init__(self):
+        self._saved = []
+
+    def set(self, target, name: str, value):
+        self._saved.append((target, name, name in vars(target), getattr(target, name, None)))
+        setattr(target, name, value)
+
+    def restore(self):
+        for target, name, existed, value in reversed(self._saved):
+            if existed:
+                setattr(target, name, value)
+            else:
+                delattr(target, name)
+        self._saved = []
+
+def timed(fn, samples: list, outcomes: Counter):
+    def wrapper(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+            outcomes[result if isinstance(result, str) else 'done'] += 1
+            return result
+        finally:
+            samples.append(time.perf_counter() - started_at)
+    return wrapper
+
+def timed_async(fn, samples: list, outcomes: Counter):
+    async def wrapper(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            result = await fn(*args, **kwargs)
+            outcomes[result if isinstance(result, str) else 'done'] += 1
+            return result
+        finally:
+            samples.append(time.perf_counter() - started_at)
+    return wrapper
+
+def summarize_user_results(result: dict, outcomes: Counter):
+    """Bucket process_user_summaries() per-user results into outcomes"""
+    outcomes.clear()
+    for user_result in (result or {}).get('results', []) or []:
+        if not user_result.get('success'):
+            outcomes['error'] += 1
+        elif user_result.get('agent_execution'):
+            outcomes['agent'] += 1
+        elif user_result.get('novelty_skipped'):
+            outcomes['novelty_skipped'] += 1
+        elif (user_result.get('routing') or {}).get('route') == 'skip':
+            outcomes['triage_skipped'] += 1
+        else:
+            outcomes['no_new_summaries'] += 1
+
+def install_stand_ins(patch: Patch, seed: int, name: str, latency_scale: float, engine_name: str):
+    """
+    Point app.py (and the async engine, if used) at fresh seeded stand-ins
+
+    Args:
+        patch (Patch): Records the swapped attributes; call patch.restore() when done
+        seed (int): Base seed; latencies and Cohere choices are derived from it and name
+        name (str): Scenario name mixed into the seeds
+        latency_scale (float): Multiplier for every simulated latency
+        engine_name (str): 'threads' or 'async'
+
+    Returns:
+        SimpleNamespace: counter, db, twilio, web and engine (None for threads)
+    """
+    counter = CallCounter()
+    latencies = {key: LatencyModel(median, p99, random.Random(f"{seed}:{name}:{key}"), latency_scale)
+                 for key, (median, p99) in LATENCY_PROFILES.items()}
+
+    db = FakeSupabase(latencies['supabase'], counter)
+    twilio = FakeTwilio(latencies, counter)
+    web = FakeWeb(latencies['web'], counter)
+
+    patch.set(twin, 'supabase', twin.InstrumentedSupabase(db))
+    patch.set(twin, 'co', FakeCohere(latencies, counter, random.Random(f"{seed}:{name}:cohere")))
+    patch.set(twin, 'twilio_client', twilio)
+    patch.set(twin, '_fetch_website_info', web.fetch_page)
+    patch.set(twin, '_fetch_youtube_transcript', web.fetch_transcript)
+    patch.set(twin, 'PIPELINE_ENGINE', engine_name)
+    patch.set(twin, 'SYSTEM_PROMPT_DUMP_PATH', '')  # No per-message disk write in the timed path
+
+    engine = None
+    if engine_name == 'async':
+        engine = twin.get_async_engine()
+        engine._clients.update(
+            supabase=twin.InstrumentedSupabase(db.async_view(), is_async=True),
+            cohere=FakeCohere(latencies, counter, random.Random(f"{seed}:{name}:cohere"), is_async=True),
+            twilio=twilio.async_view(),
+            http=web
+        )
+
+    return SimpleNamespace(counter=counter, db=db, twilio=twilio, web=web, engine=engine)
+
+def run_scenario(name: str, config: dict, engine_name: str, seed: int, latency_scale: float) -> dict:
+    """
+    Build one scenario's fakes and data, run its pipeline and measure it
+
+    Returns:
+        dict: throughput, p50/p99 latency, calls and tokens per unit, and outcomes
+    """
+    patch = Patch()
+    stand_ins = install_stand_ins(patch, seed, name, latency_scale, engine_name)
+    counter, engine = stand_ins.counter, stand_ins.engine
+    dataset = build_dataset(name, config, random.Random(f"{seed}:{name}"), stand_ins.db, stand_ins.twilio)
+
+    samples, outcomes = [], Counter()
+    started_at = time.perf_counter()
+    try:
+        if config['pipeline'] == 'analyze':
+            if engine:
+                patch.set(engine, 'process_user_with_cohere', timed_async(engine.process_user_with_cohere, samples, outcomes))
+                engine.run(engine.analyze_all_users())
+            else:
+                patch.set(twin, 'process_user_with_cohere', timed(twin.process_user_with_cohere, samples, outcomes))
+                twin.analyze_all_users()
+
+        elif config['pipeline'] == 'summaries':
+            if engine:
+                patch.set(engine, 'process_single_user_summaries', timed_async(engine.process_single_user_summaries, samples, Counter()))
+                result = engine.run(engine.process_user_summaries())
+            else:
+                patch.set(twin, 'process_single_user_summaries', timed(twin.process_single_user_summaries, samples, Counter()))
+                result = twin.process_user_summaries()
+            summarize_user_results(result, outcomes)
+
+        else:
+            samples = run_sms_burst(dataset['inbound'], config, engine, patch, outcomes)
+    finally:
+        elapsed = time.perf_counter() - started_at
+        with twin._usage_lock:
+            twin._usage_totals.clear()  # Synthetic usage must not reach the real ledger via the atexit flush
+        patch.restore()
+        if engine:
+            engine._clients.clear()
+
+    units = dataset['units']
+    return {
+        'scenario': name,
+        'description': config['description'],
+        'engine': engine_name,
+        'unit': dataset['unit'],
+        'units': units,
+        'latency_scale': latency_scale,
+        'wall_seconds': round(elapsed, 2),
+        'throughput_per_second': round(units / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {'p50': percentile(samples, 50), 'p99': percentile(samples, 99), 'samples': len(samples)},
+        'calls_per_unit': {key: round(count / units, 3) for key, count in sorted(counter.calls.items())},
+        'tokens_per_unit': {key: round(count / units, 1) for key, count in sorted(counter.tokens.items())},
+        'outcomes': dict(outcomes),
+    }
+
+def run_sms_burst(inbound: list, config: dict, engine, patch: Patch, outcomes: Counter) -> list:
+    """
+    Post inbound texts to /sms in bursts and time each from arrival to reply
+
+    With the async engine the webhook returns before the agent finishes, so the
+    sample is taken when the submitted agent task completes.
+    """
+    samples = []
+    pending = []
+    local = threading.local()
+
+    if engine:
+        submit = engine.submit
+
+        def tracked_submit(coro):
+            arrived_at = local.arrived_at
+            future = submit(coro)
+            future.add_done_callback(lambda f: samples.append(time.perf_counter() - arrived_at))
+            pending.append(future)
+            return future
+        patch.set(engine, 'submit', tracked_submit)
+
+    def post(form: dict, arrived_at: float):
+        local.arrived_at = arrived_at
+        if not hasattr(local, 'client'):
+            local.client = twin.app.test_client()
+        before = len(pending)
+        response = local.client.post('/sms', data=form)
+        outcomes[f"http_{response.status_code}"] += 1
+        if not engine or len(pending) == before:
+            samples.append(time.perf_counter() - arrived_at)
+
+    burst_size = config['burst_size']
+    with ThreadPoolExecutor(max_workers=burst_size, thread_name_prefix='InboundSMS') as pool:
+        futures = []
+        for start in range(0, len(inbound), burst_size):
+            arrived_at = time.perf_counter()
+            futures.extend(pool.submit(post, form, arrived_at) for form in inbound[start:start + burst_size])
+            if start + burst_size < len(inbound):
+                time.sleep(config['burst_gap_seconds'])
+        for future in futures:
+            future.result()
+
+    for future in list(pending):
+        future.result()
+    return samples
+
+
+# =============================================================== #
+# Reporting
+# =============================================================== #
+
+def print_report(result: dict):
+    print(f"📊 {result['scenario']} — {result['description']}")
+    print(f"   Engine: {result['engine']}, {result['units']} {result['unit']}, latency x{result['latency_scale']}")
+    print(f"   Wall time: {result['wall_seconds']}s   Throughput: {result['throughput_per_second']} {result['unit']}/s")
+    print(f"   Latency per {result['unit'][:-1]}: p50 {result['latency_ms']['p50']} ms, p99 {result['latency_ms']['p99']} ms")
+    print(f"   Calls per {result['unit'][:-1]}: " + ', '.join(f"{k} {v}" for k, v in result['calls_per_unit'].items()))
+    if result['tokens_per_unit']:
+        print(f"   Cohere tokens per {result['unit'][:-1]}: " + ', '.join(f"{k} {v}" for k, v in result['tokens_per_unit'].items()))
+    print(f"   Outcomes: {result['outcomes']}")
+    print("-" * 80)
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    List regressions against a previous --json report
+
+    Throughput may not drop, p99 latency may not rise, and no call count per
+    unit may grow by more than the tolerance (a fraction, e.g. 0.1).
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if not previous or any(previous.get(key) != result[key] for key in ('engine', 'units', 'latency_scale')):
+            continue  # Not comparable
+        if result['throughput_per_second'] < previous['throughput_per_second'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput_per_second']} < baseline {previous['throughput_per_second']}")
+        if result['latency_ms']['p99'] > previous['latency_ms']['p99'] * (1 + tolerance):
+            regressions.append(f"{name}: p99 {result['latency_ms']['p99']} ms > baseline {previous['latency_ms']['p99']} ms")
+        for key, value in result['calls_per_unit'].items():
+            before = previous.get('calls_per_unit', {}).get(key, 0.0)
+            if value > before * (1 + tolerance) + 0.01:
+                regressions.append(f"{name}: {key} per unit {value} > baseline {before}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark for the Twin pipelines')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS) + ['all'], default='all')
+    parser.add_argument('--engine', choices=['threads', 'async'], default=twin.PIPELINE_ENGINE)
+    parser.add_argument('--users', type=int, help='Override the scenario user count')
+    parser.add_argument('--messages', type=int, help='Override the sms-burst message count')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='Multiply every simulated latency (e.g. 0.05 for quick runs)')
+    parser.add_argument('--stagger', type=float, help='Override PIPELINE_STAGGER_SECONDS for the threads engine')
+    parser.add_argument('--json', dest='json_path', help='Write the results to this file')
+    parser.add_argument('--baseline', help='Compare against a previous --json report and exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Allowed regression as a fraction of the baseline')
+    args = parser.parse_args()
+
+    if args.stagger is not None:
+        twin.PIPELINE_STAGGER_SECONDS = args.stagger
+
+    names = sorted(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    results = {}
+
+    print(f"🏁 Twin offline benchmark (seed {args.seed}, engine {args.engine})")
+    print("=" * 80)
+    for name in names:
+        config = dict(SCENARIOS[name])
+        if args.users:
+            config['users'] = args.users
+        if args.messages and config['pipeline'] == 'sms':
+            config['messages'] = args.messages
+        if args.engine == 'threads' and config['pipeline'] != 'sms':
+            estimate = config['users'] * twin.PIPELINE_STAGGER_SECONDS
+            if estimate > 60:
+                print(f"⚠️ {name}: the threads engine staggers user threads by {twin.PIPELINE_STAGGER_SECONDS}s, so this run takes at least {estimate:.0f}s (see --stagger)")
+        results[name] = run_scenario(name, config, args.engine, args.seed, args.latency_scale)
+        print_report(results[name])
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'seed': args.seed, 'generated_at': datetime.now(timezone.utc).isoformat(), 'results': results}, f, indent=2)
+        print(f"💾 Results written to {args.json_path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print("❌ Regressions against baseline:")
+            for regression in regressions:
+                print(f"   - {regression}")
+            twin.flush_logs()
+            sys.exit(1)
+        print("✅ No regressions against baseline")
+
+    twin.flush_logs()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Webhook Replay Load Generator
+
+Replays /sms traffic recorded with WEBHOOK_CAPTURE_PATH against a running
+server, or in-process against the benchmark stand-ins for Supabase, Cohere
+and Twilio, keeping the captured inter-arrival timing at 1x, 10x or 100x
+speed. Reports latency percentiles, error rates and queue saturation
+(how long requests waited for a free sender).
+
+Usage:
+    WEBHOOK_CAPTURE_PATH=sms_capture.jsonl python app.py      # capture
+    python replay_webhooks.py sms_capture.jsonl --target http://127.0.0.1:3067/sms --speed 10
+    python replay_webhooks.py sms_capture.jsonl --target https://staging.example.com/sms --i-know
+    python replay_webhooks.py sms_capture.jsonl --stand-ins --speed 100 --concurrency 32
+
+Dependencies:
+    - requests (for --target)
+    - flask (for --stand-ins; see benchmark.py)
+"""
+
+import argparse
+import json
+import math
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+
+
+def load_capture(path: str, limit: int = None) -> list:
+    """
+    Read a capture file into replay events
+
+    Args:
+        path (str): JSONL file written by app.capture_webhook()
+        limit (int): Only replay the first N payloads
+
+    Returns:
+        list: (offset_seconds, form) tuples ordered by arrival, offsets from the first payload
+    """
+    records = []
+    with open(path, encoding='utf-8') as capture_file:
+        for line_number, line in enumerate(capture_file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                records.append((float(record['received_at']), record['form']))
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"⚠️ Skipping malformed line {line_number}: {e}")
+
+    records.sort(key=lambda record: record[0])
+    if limit:
+        records = records[:limit]
+    if not records:
+        return []
+    first_at = records[0][0]
+    return [(received_at - first_at, form) for received_at, form in records]
+
+def percentile(samples: list, pct: float) -> float:
+    """Nearest-rank percentile of a list of seconds, returned in milliseconds"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return round(ordered[index] * 1000, 1)
+
+class HttpSender:
+    """Posts payloads to a live /sms endpoint, one requests.Session per sender thread"""
+
+    def __init__(self, target: str, timeout: float):
+        import requests
+        self.requests = requests
+        self.target = target
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def send(self, form: dict) -> int:
+        if not hasattr(self._local, 'session'):
+            self._local.session = self.requests.Session()
+        return self._local.session.post(self.target, data=form, timeout=self.timeout).status_code
+
+class StandInSender:
+    """
+    Posts payloads to app.py in-process with the benchmark stand-ins installed
+
+    Every captured sender is seeded as an onboarded user, since the capture
+    came from real users; stand-in latencies follow --latency-scale.
+    """
+
+    def __init__(self, events: list, seed: int, latency_scale: float, engine_name: str):
+        import benchmark
+        self.twin = benchmark.twin
+        self.patch = benchmark.Patch()
+        self.stand_ins = benchmark.install_stand_ins(self.patch, seed, 'replay', latency_scale, engine_name)
+
+        senders = sorted({form.get('From', '') for _, form in events} - {''})
+        self.stand_ins.db.load('users', [
+            {
+                'id': f"00000000-0000-4000-8000-{i:012d}",
+                'email': f"replay{i}@example.edu",
+                'phone_number': phone_number,
+                'name': f"Replay {i}",
+                'onboarding_state': 'complete',
+            }
+            for i, phone_number in enumerate(senders)
+        ])
+        self._local = threading.local()
+
+    def send(self, form: dict) -> int:
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.twin.app.test_client()
+        return self._local.client.post('/sms', data=form).status_code
+
+    def close(self):
+        self.patch.restore()
+
+def replay(events: list, sender, speed: float, concurrency: int) -> dict:
+    """
+    Send captured payloads on their original schedule, compressed by speed
+
+    A request that finds every sender busy waits in the queue; that wait is
+    reported separately from the server's response time.
+
+    Args:
+        events (list): (offset_seconds, form) tuples from load_capture()
+        sender: Object with send(form) -> HTTP status code
+        speed (float): Time compression factor (10 replays an hour in 6 minutes)
+        concurrency (int): Maximum requests in flight
+
+    Returns:
+        dict: Latency percentiles, error rate, queue saturation and throughput
+    """
+    response_times, end_to_end, queue_waits = [], [], []
+    statuses = Counter()
+    state = {'in_flight': 0, 'max_in_flight': 0, 'queued': 0, 'max_queued': 0, 'scheduler_lag': []}
+    lock = threading.Lock()
+
+    def send(form, scheduled_at):
+        started_at = time.perf_counter()
+        with lock:
+            state['queued'] -= 1
+            state['in_flight'] += 1
+            state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+        outcome = 'interrupted'
+        try:
+            outcome = str(sender.send(form))
+        except Exception as e:
+            outcome = type(e).__name__
+        finally:
+            finished_at = time.perf_counter()
+            with lock:
+                state['in_flight'] -= 1
+                statuses[outcome] += 1
+            queue_waits.append(started_at - scheduled_at)
+            response_times.append(finished_at - started_at)
+            end_to_end.append(finished_at - scheduled_at)
+
+    replay_started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='Replay') as pool:
+        futures = []
+        for offset, form in events:
+            scheduled_at = replay_started_at + offset / speed
+            delay = scheduled_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                state['scheduler_lag'].append(-delay)
+            with lock:
+                state['queued'] += 1
+                state['max_queued'] = max(state['max_queued'], state['queued'])
+            futures.append(pool.submit(send, form, scheduled_at))
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - replay_started_at
+
+    total = len(events)
+    errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+    waited = sum(1 for wait in queue_waits if wait > 0.01)
+    captured_span = events[-1][0] if events else 0.0
+    return {
+        'requests': total,
+        'speed': speed,
+        'concurrency': concurrency,
+        'captured_span_seconds': round(captured_span, 2),
+        'wall_seconds': round(elapsed, 2),
+        'throughput_per_second': round(total / elapsed, 2) if elapsed else 0.0,
+        'offered_per_second': round(total / (captured_span / speed), 2) if captured_span else None,
+        'response_ms': {p: percentile(response_times, p) for p in (50, 90, 99)},
+        'end_to_end_ms': {p: percentile(end_to_end, p) for p in (50, 90, 99)},
+        'statuses': dict(statuses),
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'queue': {
+            'max_in_flight': state['max_in_flight'],
+            'max_queued': state['max_queued'],
+            'waited_share': round(waited / total, 4) if total else 0.0,  # Requests that found every sender busy
+            'wait_p99_ms': percentile(queue_waits, 99),
+            'scheduler_behind': len(state['scheduler_lag']),
+        },
+    }
+
+def print_report(result: dict):
+    print(f"📊 Replayed {result['requests']} webhooks at {result['speed']}x with {result['concurrency']} senders")
+    print(f"   Captured span: {result['captured_span_seconds']}s   Wall time: {result['wall_seconds']}s")
+    offered = f" (offered {result['offered_per_second']}/s)" if result['offered_per_second'] else ''
+    print(f"   Throughput: {result['throughput_per_second']} req/s{offered}")
+    print(f"   Response time: p50 {result['response_ms'][50]} ms, p90 {result['response_ms'][90]} ms, p99 {result['response_ms'][99]} ms")
+    print(f"   End-to-end (incl. queue): p50 {result['end_to_end_ms'][50]} ms, p99 {result['end_to_end_ms'][99]} ms")
+    print(f"   Errors: {result['error_rate'] * 100:.2f}%   Statuses: {result['statuses']}")
+    queue = result['queue']
+    print(f"   Queue: max in flight {queue['max_in_flight']}/{result['concurrency']}, max queued {queue['max_queued']}, "
+          f"{queue['waited_share'] * 100:.1f}% waited for a sender (p99 wait {queue['wait_p99_ms']} ms)")
+    if queue['waited_share'] > 0.05:
+        print("   ⚠️ Senders saturated: latency above includes queueing; raise --concurrency or lower --speed to isolate the server")
+    print("-" * 80)
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured /sms webhooks')
+    parser.add_argument('capture', help='JSONL file written with WEBHOOK_CAPTURE_PATH')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--target', help='URL of a running /sms endpoint, e.g. http://127.0.0.1:3067/sms')
+    target.add_argument('--stand-ins', action='store_true', help='Replay in-process against local Supabase/Cohere/Twilio stand-ins')
+    parser.add_argument('--speed', type=float, default=1.0, help='Time compression, e.g. 1, 10 or 100')
+    parser.add_argument('--concurrency', type=int, default=16, help='Maximum requests in flight')
+    parser.add_argument('--limit', type=int, help='Only replay the first N payloads')
+    parser.add_argument('--timeout', type=float, default=30.0, help='HTTP timeout per request (--target)')
+    parser.add_argument('--engine', choices=['threads', 'async'], default='threads', help='Pipeline engine (--stand-ins)')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='Stand-in latency multiplier (--stand-ins)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--json', dest='json_path', help='Write the report to this file')
+    parser.add_argument('--i-know', action='store_true', help='Allow a --target that is not localhost (it will text the captured numbers)')
+    args = parser.parse_args()
+
+    if args.target:
+        # The capture holds real From numbers: a server with live Twilio credentials will text them
+        if (urlparse(args.target).hostname or '') not in LOCAL_HOSTS and not args.i_know:
+            print(f"❌ {args.target} is not localhost. Replaying there texts the real senders in the capture; "
+                  "use --stand-ins, or pass --i-know if that server is safe")
+            sys.exit(2)
+        print("⚠️ Replaying real captured senders: make sure the target server is not using live Twilio credentials")
+
+    events = load_capture(args.capture, args.limit)
+    if not events:
+        print(f"❌ No webhooks found in {args.capture}")
+        sys.exit(1)
+
+    if args.stand_ins:
+        sender = StandInSender(events, args.seed, args.latency_scale, args.engine)
+    else:
+        sender = HttpSender(args.target, args.timeout)
+
+    print(f"🔁 Replaying {len(events)} webhooks from {args.capture} → {args.target or 'local stand-ins'}")
+    print("=" * 80)
+    try:
+        result = replay(events, sender, args.speed, args.concurrency)
+    finally:
+        if args.stand_ins:
+            sender.close()
+    print_report(result)
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"💾 Report written to {args.json_path}")
+
+
+if __name__ == '__main__':
+    main()
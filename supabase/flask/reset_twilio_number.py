@@ -5,16 +5,36 @@ Twilio SMS Message History Deletion Utility
 This script provides functionality to delete all SMS message history 
 with a specific phone number from Twilio.
 
+The purge command streams every page of history, deletes with a bounded,
+rate-limited worker pool and records progress in a checkpoint file, so an
+interrupted purge picks up where it stopped when re-run. The stats and
+export commands also stream, so memory stays flat for any history size.
+
 Usage:
     python reset_twilio_number.py
+    python reset_twilio_number.py stats +15551234567
+    python reset_twilio_number.py export --numbers-file numbers.txt --output-dir archive/
+    python reset_twilio_number.py purge +15551234567 --dry-run
+    python reset_twilio_number.py purge --numbers-file numbers.txt --workers 8 --rate 25 --archive-dir archive/
 
 Dependencies:
     - twilio
     - python-dotenv
 """
 
+import argparse
+import gzip
+import heapq
+import json
 import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from twilio.rest import Client as TwilioClient
+from twilio.base.exceptions import TwilioRestException
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
@@ -28,6 +48,16 @@ TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER')
 # Initialize Twilio client
 twilio_client = TwilioClient(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 
+# Bulk purge configuration
+PURGE_PAGE_SIZE = 1000  # Messages per Twilio list page while streaming
+PURGE_WORKERS = 8  # Concurrent delete requests
+PURGE_RATE_PER_SECOND = 25  # Delete requests started per second, across all workers
+PURGE_MAX_ATTEMPTS = 5  # Tries per message on 429/5xx/network errors, with exponential backoff
+PURGE_CHECKPOINT_PATH = 'purge_checkpoint.json'
+PURGE_CHECKPOINT_EVERY = 200  # Deletions between checkpoint writes
+STATS_PREVIEW_COUNT = 5  # Most recent messages kept for the stats preview
+STATS_PROGRESS_EVERY = 10000  # Messages between progress lines while streaming
+
 
 def delete_message_history_with_number(phone_number: str, dry_run: bool = True):
     """
@@ -167,12 +197,289 @@ def delete_message_history_with_number(phone_number: str, dry_run: bool = True):
         }
 
 
-def get_message_stats_for_number(phone_number: str):
+class RateLimiter:
+    """Spaces calls evenly at up to `rate` per second across threads"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            start_at = max(now, self.next_at)
+            self.next_at = start_at + self.interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+class PurgeCheckpoint:
+    """
+    Per-number purge progress, saved atomically as JSON
+    
+    A direction (inbound/outbound) is only marked done once its stream is
+    exhausted and every delete has finished. Deleted messages no longer show
+    up in Twilio's list, so resuming a half-done direction simply streams
+    what is left.
+    """
+    
+    def __init__(self, path: str = None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {'version': 1, 'numbers': {}}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.data = json.load(f)
+    
+    def number(self, phone_number: str) -> dict:
+        with self.lock:
+            return self.data['numbers'].setdefault(phone_number, {
+                'inbound_done': False,
+                'outbound_done': False,
+                'deleted': 0,
+                'failed': {},
+            })
+    
+    def save(self):
+        if not self.path:
+            return
+        with self.lock:
+            self.data['updated_at'] = datetime.now().isoformat()
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(temp_path, self.path)
+
+def delete_message_with_retry(sid: str, limiter: RateLimiter):
+    """
+    Delete one message, backing off on rate limits and transient errors
+    
+    Returns:
+        tuple: (deleted (bool), error (str or None)); a 404 counts as deleted
+    """
+    last_error = None
+    for attempt in range(PURGE_MAX_ATTEMPTS):
+        limiter.wait()
+        try:
+            twilio_client.messages(sid).delete()
+            return True, None
+        except TwilioRestException as e:
+            if e.status == 404:
+                return True, None  # Already gone, e.g. deleted just before an interrupted run saved
+            if e.status != 429 and e.status < 500:
+                return False, str(e)
+            last_error = e
+        except Exception as e:
+            last_error = e
+        time.sleep(min(0.5 * 2 ** attempt, 8.0))
+    return False, str(last_error)
+
+def purge_direction(phone_number: str, direction: str, state: dict, checkpoint: PurgeCheckpoint,
+                    pool: ThreadPoolExecutor, limiter: RateLimiter, workers: int, dry_run: bool) -> dict:
+    """
+    Stream one direction of a number's history and delete it through the pool
+    
+    At most 2 x workers deletes are queued at a time, so memory stays flat
+    however long the history is.
+    
+    Returns:
+        dict: 'found', 'deleted' and 'failed' counts for this direction
+    """
+    filters = {'from_': phone_number} if direction == 'inbound' else {'to': phone_number}
+    counts = {'found': 0, 'deleted': 0, 'failed': 0}
+    slots = threading.Semaphore(workers * 2)
+    pending = set()
+    pending_changed = threading.Condition()
+    
+    def on_done(sid, future):
+        deleted, error = future.result()
+        with checkpoint.lock:
+            if deleted:
+                counts['deleted'] += 1
+                state['deleted'] += 1
+                state['failed'].pop(sid, None)
+            else:
+                counts['failed'] += 1
+                state['failed'][sid] = error
+            save_now = deleted and state['deleted'] % PURGE_CHECKPOINT_EVERY == 0
+        if save_now:
+            checkpoint.save()
+            print(f"   💾 {phone_number}: {state['deleted']} deleted so far")
+        slots.release()
+        with pending_changed:
+            pending.discard(future)
+            pending_changed.notify_all()
+    
+    try:
+        for msg in twilio_client.messages.stream(page_size=PURGE_PAGE_SIZE, **filters):
+            counts['found'] += 1
+            if dry_run:
+                continue
+            slots.acquire()
+            future = pool.submit(delete_message_with_retry, msg.sid, limiter)
+            with pending_changed:
+                pending.add(future)
+            future.add_done_callback(lambda f, sid=msg.sid: on_done(sid, f))
+    finally:
+        # Let in-flight deletes land (and be counted) before the checkpoint is written, even on Ctrl+C
+        with pending_changed:
+            pending_changed.wait_for(lambda: not pending)
+    
+    return counts
+
+def purge_message_history(phone_numbers: list, checkpoint_path: str = PURGE_CHECKPOINT_PATH,
+                          workers: int = PURGE_WORKERS, rate: float = PURGE_RATE_PER_SECOND, dry_run: bool = True,
+                          archive_dir: str = None) -> dict:
+    """
+    Delete the full message history with each number, resumably
+    
+    Unlike delete_message_history_with_number(), nothing is capped at 1000
+    and nothing is held in memory: both directions are streamed page by page
+    and deleted concurrently. Numbers and directions finished in an earlier
+    run (per the checkpoint) are skipped.
+    
+    Args:
+        phone_numbers (list): Numbers to purge, in order
+        checkpoint_path (str): Progress file; re-run with the same path to resume
+        workers (int): Concurrent delete requests
+        rate (float): Maximum delete requests per second
+        dry_run (bool): If True, only count what would be deleted (no checkpoint is written)
+        archive_dir (str): If given, each number's full history is exported there as
+            .jsonl.gz before any of it is deleted; a number whose export fails is not purged
+        
+    Returns:
+        dict: Per-number results and totals
+    """
+    checkpoint = PurgeCheckpoint(None if dry_run else checkpoint_path)
+    limiter = RateLimiter(rate)
+    results = []
+    
+    print(f"{'🧪 DRY RUN MODE - No messages will be deleted' if dry_run else '🔥 DELETION MODE - Messages will be permanently deleted'}")
+    print(f"📱 {len(phone_numbers)} number(s), {workers} workers, up to {rate} deletes/s")
+    print("-" * 80)
+    
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='Purge') as pool:
+        try:
+            for index, phone_number in enumerate(phone_numbers, 1):
+                state = checkpoint.number(phone_number)
+                if state['inbound_done'] and state['outbound_done']:
+                    print(f"⏩ [{index}/{len(phone_numbers)}] {phone_number}: already purged ({state['deleted']} deleted)")
+                    results.append({'phone_number': phone_number, 'success': True, 'resumed': True, 'messages_found': 0, 'messages_deleted': 0, 'failed_deletions': 0})
+                    continue
+                
+                print(f"🔍 [{index}/{len(phone_numbers)}] {phone_number}")
+                result = {'phone_number': phone_number, 'messages_found': 0, 'messages_deleted': 0, 'failed_deletions': 0}
+                
+                # Archive before the first delete; a resumed purge keeps the original, complete archive
+                if archive_dir and not dry_run and not state.get('archive_path'):
+                    export_path = archive_path_for(archive_dir, phone_number)
+                    stats = get_message_stats_for_number(phone_number, export_path=export_path)
+                    if not stats['success']:
+                        print(f"   ❌ Archive failed, not purging {phone_number}: {stats['error']}")
+                        results.append({**result, 'success': False, 'error': f"archive failed: {stats['error']}"})
+                        continue
+                    state['archive_path'] = export_path
+                    checkpoint.save()
+                result['archive_path'] = state.get('archive_path')
+                for direction in ('inbound', 'outbound'):
+                    if state[f'{direction}_done']:
+                        continue
+                    counts = purge_direction(phone_number, direction, state, checkpoint, pool, limiter, workers, dry_run)
+                    result['messages_found'] += counts['found']
+                    result['messages_deleted'] += counts['deleted']
+                    result['failed_deletions'] += counts['failed']
+                    print(f"   {'📥' if direction == 'inbound' else '📤'} {direction}: {counts['found']} found, {counts['deleted']} deleted, {counts['failed']} failed")
+                    if not dry_run and counts['failed'] == 0:
+                        state[f'{direction}_done'] = True
+                    checkpoint.save()
+                
+                result['success'] = result['failed_deletions'] == 0
+                results.append(result)
+        except KeyboardInterrupt:
+            checkpoint.save()
+            print(f"\n⏸️  Interrupted. Progress saved to {checkpoint_path}; run the same command again to resume.")
+            raise
+    
+    elapsed = time.perf_counter() - started_at
+    deleted = sum(r['messages_deleted'] for r in results)
+    summary = {
+        'success': all(r['success'] for r in results),
+        'dry_run': dry_run,
+        'numbers': len(phone_numbers),
+        'messages_found': sum(r['messages_found'] for r in results),
+        'messages_deleted': deleted,
+        'failed_deletions': sum(r['failed_deletions'] for r in results),
+        'elapsed_seconds': round(elapsed, 1),
+        'checkpoint_path': None if dry_run else checkpoint_path,
+        'results': results,
+    }
+    
+    print("-" * 80)
+    print(f"🎯 Purge Summary:")
+    print(f"   - Messages found: {summary['messages_found']}")
+    print(f"   - Successfully deleted: {deleted} ({deleted / elapsed:.1f}/s)" if elapsed and deleted else f"   - Successfully deleted: {deleted}")
+    print(f"   - Failed deletions: {summary['failed_deletions']}")
+    if summary['failed_deletions']:
+        print(f"   ⚠️ Failed messages are listed in {checkpoint_path} and retried on the next run")
+    return summary
+
+def load_numbers_file(path: str) -> list:
+    """Read phone numbers one per line (blank lines and # comments ignored), '+'-prefixed and de-duplicated"""
+    numbers = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            number = line.split('#', 1)[0].strip()
+            if number:
+                number = '+' + number.lstrip('+')
+                if number not in numbers:
+                    numbers.append(number)
+    return numbers
+
+def iter_message_history(phone_number: str):
+    """
+    Yield every message with a number as (direction, message), one page at a time
+    
+    Inbound (from the number) is streamed first, then outbound (to it). A
+    message the number sent to itself is only yielded once, as inbound.
+    """
+    for msg in twilio_client.messages.stream(from_=phone_number, page_size=PURGE_PAGE_SIZE):
+        yield 'inbound', msg
+    for msg in twilio_client.messages.stream(to=phone_number, page_size=PURGE_PAGE_SIZE):
+        if msg.from_ != phone_number:
+            yield 'outbound', msg
+
+def serialize_message(direction: str, msg) -> dict:
+    """Archive record for one message"""
+    return {
+        'sid': msg.sid,
+        'direction': direction,
+        'from': msg.from_,
+        'to': msg.to,
+        'body': msg.body,
+        'status': msg.status,
+        'date_created': str(msg.date_created) if msg.date_created else None,
+        'date_sent': str(msg.date_sent) if msg.date_sent else None,
+        'num_segments': msg.num_segments,
+        'num_media': msg.num_media,
+        'price': msg.price,
+        'price_unit': msg.price_unit,
+        'error_code': msg.error_code,
+        'error_message': msg.error_message,
+    }
+
+def get_message_stats_for_number(phone_number: str, export_path: str = None):
     """
     Get statistics about message history with a specific phone number
     
+    Both directions are streamed page by page, so counts are exact for any
+    history size and memory stays constant; only the few most recent
+    messages are kept for the preview.
+    
     Args:
         phone_number (str): The phone number to get stats for
+        export_path (str): Optional .jsonl.gz file to archive every message to
+            (written to a temporary file and renamed once complete)
         
     Returns:
         dict: Contains message statistics and summary
@@ -180,37 +487,57 @@ def get_message_stats_for_number(phone_number: str):
     try:
         print(f"📊 Getting message statistics for: {phone_number}")
         
-        # Get messages from target number to our Twilio number
-        messages_from_target = list(twilio_client.messages.list(
-            from_=phone_number,
-            limit=1000
-        ))
+        direction_counts = Counter()
+        status_counts = Counter()
+        total_segments = 0
+        first_message_date = None
+        last_message_date = None
+        recent = []  # Min-heap of (date_created, sid, preview) holding the newest messages
         
-        # Get messages from our Twilio number to target number
-        messages_to_target = list(twilio_client.messages.list(
-            to=phone_number,
-            limit=1000
-        ))
+        export_file = None
+        temp_path = f"{export_path}.partial" if export_path else None
+        if export_path:
+            os.makedirs(os.path.dirname(os.path.abspath(export_path)), exist_ok=True)
+            export_file = gzip.open(temp_path, 'wt', encoding='utf-8')
         
-        # Combine and deduplicate
-        all_messages = messages_from_target + messages_to_target
-        unique_messages = {}
-        for msg in all_messages:
-            unique_messages[msg.sid] = msg
-        
-        messages = list(unique_messages.values())
-        
-        # Sort by date (most recent first)
-        messages.sort(key=lambda x: x.date_created, reverse=True)
+        try:
+            for direction, msg in iter_message_history(phone_number):
+                direction_counts[direction] += 1
+                status_counts[msg.status] += 1
+                total_segments += int(msg.num_segments or 0)
+                
+                created = msg.date_created
+                if created is not None:
+                    first_message_date = created if first_message_date is None else min(first_message_date, created)
+                    last_message_date = created if last_message_date is None else max(last_message_date, created)
+                    item = (created, msg.sid, {
+                        'sid': msg.sid,
+                        'direction': direction,
+                        'date_created': str(created),
+                        'body_preview': (msg.body[:100] + "...") if len(msg.body) > 100 else msg.body,
+                        'status': msg.status
+                    })
+                    if len(recent) < STATS_PREVIEW_COUNT:
+                        heapq.heappush(recent, item)
+                    elif item[:2] > recent[0][:2]:
+                        heapq.heapreplace(recent, item)
+                
+                if export_file:
+                    export_file.write(json.dumps(serialize_message(direction, msg), ensure_ascii=False) + '\n')
+                
+                scanned = sum(direction_counts.values())
+                if scanned % STATS_PROGRESS_EVERY == 0:
+                    print(f"   ... {scanned} messages scanned")
+        finally:
+            if export_file:
+                export_file.close()
         
-        # Calculate stats
-        inbound_count = len(messages_from_target)
-        outbound_count = len(messages_to_target)
-        total_count = len(messages)
+        if export_path:
+            os.replace(temp_path, export_path)
         
-        # Date range
-        first_message_date = messages[-1].date_created if messages else None
-        last_message_date = messages[0].date_created if messages else None
+        inbound_count = direction_counts['inbound']
+        outbound_count = direction_counts['outbound']
+        total_count = inbound_count + outbound_count
         
         print(f"📈 Message Statistics for {phone_number}:")
         print(f"   - Total unique messages: {total_count}")
@@ -219,6 +546,8 @@ def get_message_stats_for_number(phone_number: str):
         if first_message_date and last_message_date:
             print(f"   - First message: {first_message_date}")
             print(f"   - Last message: {last_message_date}")
+        if export_path:
+            print(f"   - 💾 Archived {total_count} messages to {export_path}")
         
         return {
             'success': True,
@@ -226,28 +555,28 @@ def get_message_stats_for_number(phone_number: str):
             'total_messages': total_count,
             'inbound_messages': inbound_count,
             'outbound_messages': outbound_count,
+            'status_counts': dict(status_counts),
+            'total_segments': total_segments,
             'first_message_date': str(first_message_date) if first_message_date else None,
             'last_message_date': str(last_message_date) if last_message_date else None,
-            'messages_preview': [
-                {
-                    'sid': msg.sid,
-                    'direction': 'inbound' if msg.from_ == phone_number else 'outbound',
-                    'date_created': str(msg.date_created),
-                    'body_preview': (msg.body[:100] + "...") if len(msg.body) > 100 else msg.body,
-                    'status': msg.status
-                }
-                for msg in messages[:5]  # First 5 messages as preview
-            ]
+            'export_path': export_path,
+            'messages_preview': [preview for _, _, preview in sorted(recent, key=lambda item: item[:2], reverse=True)]
         }
         
     except Exception as e:
         print(f"💥 Error getting stats for {phone_number}: {str(e)}")
+        if export_path and os.path.exists(temp_path):
+            os.remove(temp_path)  # Never leave a partial archive that looks complete
         return {
             'success': False,
             'error': str(e),
             'phone_number': phone_number
         }
 
+def archive_path_for(output_dir: str, phone_number: str) -> str:
+    """Archive file for a number inside output_dir, e.g. archive/15551234567.jsonl.gz"""
+    return os.path.join(output_dir, f"{phone_number.lstrip('+')}.jsonl.gz")
+
 
 def interactive_deletion():
     """
@@ -346,7 +675,78 @@ def main():
     interactive_deletion()
 
 
+def run_cli(argv: list) -> int:
+    """
+    Command-line entry point for bulk operations
+    
+    Returns:
+        int: Process exit code
+    """
+    parser = argparse.ArgumentParser(description='Twilio message history tools')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    stats = commands.add_parser('stats', help='Exact message counts, date range and direction split (streamed)')
+    stats.add_argument('numbers', nargs='*', help='Phone numbers, e.g. +15551234567')
+    stats.add_argument('--numbers-file', help='File with one phone number per line')
+    stats.add_argument('--json', dest='json_path', help='Write the statistics to this file')
+    
+    export = commands.add_parser('export', help='Archive full message history to compressed JSONL')
+    export.add_argument('numbers', nargs='*', help='Phone numbers, e.g. +15551234567')
+    export.add_argument('--numbers-file', help='File with one phone number per line')
+    export.add_argument('--output-dir', required=True, help='Directory for <number>.jsonl.gz archives')
+    
+    purge = commands.add_parser('purge', help='Delete all message history with one or more numbers (resumable)')
+    purge.add_argument('numbers', nargs='*', help='Phone numbers, e.g. +15551234567')
+    purge.add_argument('--numbers-file', help='File with one phone number per line')
+    purge.add_argument('--workers', type=int, default=PURGE_WORKERS, help='Concurrent delete requests')
+    purge.add_argument('--rate', type=float, default=PURGE_RATE_PER_SECOND, help='Maximum delete requests per second')
+    purge.add_argument('--checkpoint', default=PURGE_CHECKPOINT_PATH, help='Progress file used to resume an interrupted purge')
+    purge.add_argument('--dry-run', action='store_true', help='Count messages without deleting anything')
+    purge.add_argument('--yes', action='store_true', help="Skip the 'DELETE' confirmation prompt")
+    purge.add_argument('--archive-dir', help='Export each number to <dir>/<number>.jsonl.gz before deleting it')
+    args = parser.parse_args(argv)
+    
+    if not all([TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN]):
+        print("❌ Missing TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN. Please set these in your .env file and try again.")
+        return 1
+    
+    numbers = ['+' + n.lstrip('+') for n in args.numbers]
+    if args.numbers_file:
+        numbers += [n for n in load_numbers_file(args.numbers_file) if n not in numbers]
+    if not numbers:
+        print("❌ No phone numbers given (pass them as arguments or with --numbers-file)")
+        return 1
+    
+    if args.command in ('stats', 'export'):
+        results = []
+        for phone_number in numbers:
+            export_path = archive_path_for(args.output_dir, phone_number) if args.command == 'export' else None
+            results.append(get_message_stats_for_number(phone_number, export_path=export_path))
+            print("-" * 80)
+        if args.command == 'stats' and args.json_path:
+            with open(args.json_path, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"💾 Statistics written to {args.json_path}")
+        return 0 if all(r['success'] for r in results) else 1
+    
+    if not args.dry_run and not args.yes:
+        print(f"⚠️  WARNING: This will PERMANENTLY DELETE all message history with {len(numbers)} number(s)!")
+        if input("Type 'DELETE' to confirm: ").strip() != 'DELETE':
+            print("🛡️  Deletion cancelled. Messages are safe.")
+            return 1
+    
+    try:
+        result = purge_message_history(numbers, args.checkpoint, args.workers, args.rate, dry_run=args.dry_run, archive_dir=args.archive_dir)
+    except KeyboardInterrupt:
+        return 130
+    return 0 if result['success'] else 1
+
+
 if __name__ == '__main__':
+    # Subcommands (stats, export, purge) skip the single-number flow below
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+    
     # ============================================================================
     # SIMPLE USAGE: Set the phone number here and run the script
     # ============================================================================